@@ -0,0 +1,200 @@
+import os
+
+import pandas as pd
+import numpy as np
+
+try:
+    import polars as pl
+except ImportError:  # Polars is optional
+    pl = None
+
+from ShopRosterKeys import BLANK_VALUES
+
+# Environment variable that picks the backend when none is passed in
+BACKEND_ENV_VAR = 'SHOPROSTER_BACKEND'
+
+# Every character Python's str.strip() and the regex \s treat as whitespace.
+# Polars trims by the Unicode White_Space property, which is not quite the same
+# set, so it is given this list explicitly to keep both backends identical.
+PYTHON_WHITESPACE = ''.join(chr(c) for c in range(0x3001) if chr(c).isspace())
+
+
+def _is_string(values):
+    """Mask of the values that are Python strings, like the pandas .str accessor sees them"""
+    return np.fromiter((isinstance(v, str) for v in values), dtype=bool, count=len(values))
+
+
+class PandasBackend:
+    """Default backend built on pandas object columns and .str accessors"""
+
+    name = 'pandas'
+
+    def blank_to_nan(self, values):
+        """Convert values to strings and turn empty, whitespace-only, 'nan' and 'None' into NaN"""
+        values = pd.Series(values, dtype=object).astype(str)
+        blank = values.str.match(r'^\s*$') | values.isin(BLANK_VALUES)
+        return values.where(~blank, np.nan).to_numpy(dtype=object)
+
+    def clean_names(self, values):
+        """Strip and lowercase names; anything that is not a string becomes NaN"""
+        values = pd.Series(values, dtype=object)
+        return values.str.strip().str.lower().to_numpy(dtype=object)
+
+    def clean_emails(self, values):
+        """Blank out empty emails and lowercase the rest"""
+        return pd.Series(self.blank_to_nan(values), dtype=object).str.lower().to_numpy(dtype=object)
+
+    def pair_within_groups(self, codes, has_id):
+        """Pair rows without an ID with rows that have one inside each key group.
+
+        Within a group the n-th row without an ID takes the ID of the n-th row with
+        one, in row order. Pairs come back ordered by group first appearance.
+        """
+        rows = pd.DataFrame({'code': codes, 'has_id': has_id, 'pos': np.arange(len(codes))})
+        rows = rows[rows['code'] >= 0]
+        rows['rank'] = rows.groupby(['code', 'has_id'], sort=False).cumcount()
+
+        has_rows = rows[rows['has_id']]
+        no_rows = rows[~rows['has_id']]
+        pairs = no_rows.merge(has_rows, on=['code', 'rank'], suffixes=('_no', '_has'))
+        pairs = pairs.sort_values(['code', 'rank'], kind='stable')
+        return (pairs['code'].to_numpy(np.int64), pairs['pos_no'].to_numpy(np.int64),
+                pairs['pos_has'].to_numpy(np.int64))
+
+
+class PolarsBackend:
+    """Multi-threaded columnar backend, used when Polars is installed"""
+
+    name = 'polars'
+
+    def _to_polars(self, values):
+        """Load string values into a Polars string column"""
+        return pl.Series(values.tolist(), dtype=pl.Utf8)
+
+    def _from_polars(self, series, mask, size):
+        """Scatter a Polars string column back into an object array with NaN elsewhere"""
+        result = np.full(size, np.nan, dtype=object)
+        result[mask] = series.to_list()
+        return result
+
+    def blank_to_nan(self, values):
+        """Convert values to strings and turn empty, whitespace-only, 'nan' and 'None' into NaN"""
+        values = pd.Series(values, dtype=object).astype(str).to_numpy(dtype=object)
+        strings = self._to_polars(values)
+        blank = (strings.str.strip_chars(PYTHON_WHITESPACE) == '') | strings.is_in(BLANK_VALUES)
+        result = values.copy()
+        result[blank.to_numpy()] = np.nan
+        return result
+
+    def clean_names(self, values):
+        """Strip and lowercase names; anything that is not a string becomes NaN"""
+        values = np.asarray(values, dtype=object)
+        mask = _is_string(values)
+        strings = self._to_polars(values[mask])
+        cleaned = strings.str.strip_chars(PYTHON_WHITESPACE).str.to_lowercase()
+        return self._from_polars(cleaned, mask, len(values))
+
+    def clean_emails(self, values):
+        """Blank out empty emails and lowercase the rest"""
+        values = self.blank_to_nan(values)
+        mask = _is_string(values)
+        return self._from_polars(self._to_polars(values[mask]).str.to_lowercase(), mask, len(values))
+
+    def pair_within_groups(self, codes, has_id):
+        """Pair rows without an ID with rows that have one inside each key group.
+
+        Same pairing rule and order as the pandas backend, using window ranks
+        and a hash join.
+        """
+        rows = pl.DataFrame({
+            'code': np.asarray(codes, dtype=np.int64),
+            'has_id': np.asarray(has_id, dtype=bool),
+            'pos': np.arange(len(codes), dtype=np.int64)
+        }).filter(pl.col('code') >= 0)
+        rows = rows.with_columns(pl.int_range(pl.len()).over(['code', 'has_id']).alias('rank'))
+
+        has_rows = rows.filter(pl.col('has_id')).select('code', 'rank', pl.col('pos').alias('pos_has'))
+        no_rows = rows.filter(~pl.col('has_id')).select('code', 'rank', pl.col('pos').alias('pos_no'))
+        pairs = no_rows.join(has_rows, on=['code', 'rank'], how='inner').sort(['code', 'rank'])
+        return (pairs['code'].to_numpy().astype(np.int64), pairs['pos_no'].to_numpy().astype(np.int64),
+                pairs['pos_has'].to_numpy().astype(np.int64))
+
+
+class MemoizedBackend:
+    """Wraps a backend and remembers the normalized form of every string it has seen.
+
+    Normalizing is a pure function of each value, so keys worked out early,
+    for example while the rest of a file is still being read, are looked up
+    instead of recomputed when the merge steps ask for them. Not thread-safe:
+    use one instance per run.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = get_backend(backend)
+        self.name = self.backend.name
+        self._caches = {'blank_to_nan': {}, 'clean_names': {}, 'clean_emails': {}}
+
+    def _lookup(self, method, values):
+        """Normalize values, only passing strings not seen before to the wrapped backend"""
+        values = np.asarray(values, dtype=object)
+        normalize = getattr(self.backend, method)
+        result = np.empty(len(values), dtype=object)
+
+        # Only strings are cached; 1 and 1.0 would share a dict key but not a result
+        strings = _is_string(values)
+        if not strings.all():
+            result[~strings] = normalize(values[~strings])
+
+        if strings.any():
+            codes, uniques = pd.factorize(values[strings])
+            cache = self._caches[method]
+            unseen = [value for value in uniques if value not in cache]
+            if unseen:
+                cache.update(zip(unseen, normalize(np.array(unseen, dtype=object))))
+            normalized = np.empty(len(uniques), dtype=object)
+            normalized[:] = [cache[value] for value in uniques]
+            result[strings] = normalized[codes]
+        return result
+
+    def blank_to_nan(self, values):
+        return self._lookup('blank_to_nan', values)
+
+    def clean_names(self, values):
+        return self._lookup('clean_names', values)
+
+    def clean_emails(self, values):
+        return self._lookup('clean_emails', values)
+
+    def pair_within_groups(self, codes, has_id):
+        return self.backend.pair_within_groups(codes, has_id)
+
+
+# Backends in order of preference for automatic selection
+BACKENDS = {
+    'polars': PolarsBackend,
+    'pandas': PandasBackend,
+}
+
+
+def available_backends():
+    """List the backends that can run in this environment"""
+    return [name for name in BACKENDS if name != 'polars' or pl is not None]
+
+
+def get_backend(backend=None):
+    """Resolve a backend name (or 'auto') to a backend instance.
+
+    Passing None reads the SHOPROSTER_BACKEND environment variable and falls
+    back to 'auto', which picks Polars when it is installed and pandas otherwise.
+    """
+    if backend is not None and not isinstance(backend, str):
+        return backend
+
+    name = (backend or os.environ.get(BACKEND_ENV_VAR) or 'auto').lower()
+    if name == 'auto':
+        name = available_backends()[0]
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend '{name}'. Choose from: {', '.join(['auto'] + list(BACKENDS))}")
+    if name not in available_backends():
+        raise ImportError(f"The '{name}' backend needs the {name} package installed")
+    return BACKENDS[name]()
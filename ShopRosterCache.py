@@ -0,0 +1,228 @@
+import os
+import json
+import hashlib
+import tempfile
+
+import pandas as pd
+import numpy as np
+
+try:
+    import pyarrow as pa
+    from pyarrow import feather
+except ImportError:  # pyarrow is optional
+    pa = None
+
+from ShopRosterProfiles import find_profile, roster_from_cells
+from ShopRosterReader import get_reader_engine, read_cells
+
+# Environment variable that points at the cache directory
+CACHE_DIR_ENV_VAR = 'SHOPROSTER_CACHE_DIR'
+
+# Environment variable with the cache size limit in megabytes; 0 turns the cache off
+CACHE_SIZE_ENV_VAR = 'SHOPROSTER_CACHE_MB'
+
+# Where parsed rosters are kept when the environment variable is not set
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.shoproster', 'cache')
+
+# Size limit when the environment variable is not set
+DEFAULT_CACHE_MB = 2048
+
+# Size of the pieces a file is read in while it is hashed
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def content_hash(source):
+    """SHA-256 of a roster file given as a path or a file-like object"""
+    digest = hashlib.sha256()
+    if hasattr(source, 'read'):
+        source.seek(0)
+        for chunk in iter(lambda: source.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+        source.seek(0)
+    else:
+        with open(source, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _mapping_key(mapping):
+    """Short stable name for a column mapping ('raw' when there is none)"""
+    mapping = {req_col: file_col for req_col, file_col in (mapping or {}).items() if file_col}
+    if not mapping:
+        return 'raw'
+    return hashlib.sha1(json.dumps(mapping, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+
+
+class RosterCache:
+    """On-disk cache of parsed rosters as uncompressed Arrow (Feather v2) files.
+
+    Entries are keyed by the SHA-256 of the file, the reader engine and the
+    column mapping, so any session or process opening the same file gets the
+    same entry. Files are memory-mapped when loaded: numeric columns stay on
+    the shared mapped pages and only text columns become Python objects. The
+    least recently used entries are deleted once the directory grows past
+    the size limit.
+    """
+
+    def __init__(self, directory=None, max_bytes=None):
+        self.directory = directory or os.environ.get(CACHE_DIR_ENV_VAR) or DEFAULT_CACHE_DIR
+        if max_bytes is None:
+            max_bytes = int(float(os.environ.get(CACHE_SIZE_ENV_VAR, DEFAULT_CACHE_MB)) * 1024 * 1024)
+        self.max_bytes = max_bytes
+
+    @property
+    def enabled(self):
+        return pa is not None and self.max_bytes > 0
+
+    def key(self, source, engine=None):
+        """Cache key of a file for a reader engine"""
+        return f"{content_hash(source)}-{get_reader_engine(engine) or 'default'}"
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _header_path(self, key):
+        return self._path(f'{key}.json')
+
+    def _roster_path(self, key, mapping):
+        return self._path(f'{key}-{_mapping_key(mapping)}.feather')
+
+    def _write_atomic(self, path, write):
+        """Write to a temporary file next to path and move it into place"""
+        os.makedirs(self.directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        os.close(fd)
+        try:
+            write(temp_path)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def load(self, key, mapping=None, path=None):
+        """Load a cached roster, applying a saved profile like read_roster_with_profile does.
+
+        Returns (roster, profile name) or None when the file is not cached.
+        """
+        if not self.enabled:
+            return None
+
+        profile_name = None
+        if mapping is None:
+            # Profiles can change between opens, so pick one from the cached header each time
+            try:
+                with open(self._header_path(key), encoding='utf-8') as f:
+                    header = json.load(f)
+            except (OSError, ValueError):
+                return None
+            profile_name, profile = find_profile(header, path=path)
+            mapping = profile['mapping'] if profile else None
+
+        roster_path = self._roster_path(key, mapping)
+        try:
+            table = feather.read_table(roster_path, memory_map=True)
+        except (OSError, pa.ArrowException):
+            return None
+
+        # Mark the entry as recently used for eviction
+        for used_path in (roster_path, self._header_path(key)):
+            try:
+                os.utime(used_path)
+            except OSError:
+                pass
+
+        df = table.to_pandas(split_blocks=True)
+        for col_idx, dtype in enumerate(df.dtypes):
+            if dtype == object:
+                # Arrow nulls come back as None; the reader gives NaN
+                values = df.iloc[:, col_idx].to_numpy(copy=True)
+                values[pd.isna(values)] = np.nan
+                df.isetitem(col_idx, values)
+        return df, profile_name
+
+    def store(self, key, header, mapping, df):
+        """Cache a parsed roster with the raw header it was read with.
+
+        Rosters Arrow cannot hold exactly (such as columns mixing numbers and
+        text) are not cached. Returns whether the roster was stored.
+        """
+        if not self.enabled:
+            return False
+
+        # Column names and text columns have to come back exactly as they went in
+        if not df.columns.is_unique or not all(isinstance(col, str) for col in df.columns):
+            return False
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+        except (pa.ArrowException, TypeError, ValueError):
+            return False
+        for field, dtype in zip(table.schema, df.dtypes):
+            if dtype == object and not (pa.types.is_string(field.type) or pa.types.is_null(field.type)):
+                return False
+
+        def write_header(temp_path):
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(['' if value is None else str(value) for value in header], f)
+
+        roster_path = self._roster_path(key, mapping)
+        self._write_atomic(self._header_path(key), write_header)
+        self._write_atomic(roster_path,
+                           lambda temp_path: feather.write_feather(table, temp_path, compression='uncompressed'))
+        self.evict(keep=roster_path)
+        return True
+
+    def evict(self, keep=None):
+        """Delete the least recently used entries until the cache fits its size limit"""
+        try:
+            entries = [entry for entry in os.scandir(self.directory)
+                       if entry.is_file() and entry.name.endswith(('.feather', '.json'))]
+        except OSError:
+            return
+
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        total = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if total <= self.max_bytes:
+                break
+            if entry.path == keep:
+                continue
+            size = entry.stat().st_size
+            try:
+                os.remove(entry.path)
+                total -= size
+            except OSError:
+                # Still mapped by another process on some platforms; try again next time
+                continue
+
+    def clear(self):
+        """Delete every cached roster"""
+        max_bytes, self.max_bytes = self.max_bytes, 0
+        try:
+            self.evict()
+        finally:
+            self.max_bytes = max_bytes
+
+
+def read_roster_cached(source, engine=None, mapping=None, path=None, cache=None):
+    """Load a roster like read_roster_with_profile, going through the on-disk cache.
+
+    The first open of a file decodes it and stores the result; later opens
+    from any session or process memory-map the stored copy instead.
+    """
+    cache = cache or RosterCache()
+    if not cache.enabled:
+        rows, text_columns = read_cells(source, engine)
+        df, profile_name, _ = roster_from_cells(rows, text_columns, mapping, path)
+        return df, profile_name
+
+    key = cache.key(source, engine)
+    cached = cache.load(key, mapping, path)
+    if cached is not None:
+        return cached
+
+    rows, text_columns = read_cells(source, engine)
+    header = list(rows[0]) if rows else []
+    df, profile_name, applied = roster_from_cells(rows, text_columns, mapping, path)
+    cache.store(key, header, applied, df)
+    return df, profile_name
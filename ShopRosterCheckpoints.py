@@ -0,0 +1,380 @@
+import os
+import sys
+import json
+import zlib
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+import numpy as np
+
+from ShopRosterBackends import get_backend
+from ShopRosterPipeline import (build_email_keys, finalize_roster, normalize_member_ids,
+                                process_member_data_by_email, process_member_data_by_name,
+                                remove_empty_id_records, removed_record_list, split_passthrough)
+
+# Environment variable that points at the checkpoint directory
+CHECKPOINT_ENV_VAR = 'SHOPROSTER_CHECKPOINT_DIR'
+
+# Where checkpoints are kept when no path is given and the environment variable is not set
+DEFAULT_CHECKPOINT_DIR = os.path.join(os.path.expanduser('~'), '.shoproster', 'checkpoints')
+
+# Stage boundaries a checkpoint is written at, in order
+STAGES = ['normalized', 'name', 'email', 'empty_id']
+
+# Environment variable with the number of stage results kept in memory; 0 turns the memo off
+STAGE_MEMO_ENV_VAR = 'SHOPROSTER_STAGE_MEMO'
+
+# Stage results kept in memory when the environment variable is not set
+DEFAULT_STAGE_MEMO = 16
+
+# Environment variable capping the memory the stage results take, in megabytes
+STAGE_MEMO_SIZE_ENV_VAR = 'SHOPROSTER_STAGE_MEMO_MB'
+
+# Size cap of the stage memo when the environment variable is not set
+DEFAULT_STAGE_MEMO_MB = 256
+
+# Memo shared by every run in the process
+_memo = None
+_memo_lock = threading.Lock()
+
+
+def frame_checksum(df):
+    """SHA-256 over a roster's column names, types and cell values"""
+    digest = hashlib.sha256()
+    digest.update(json.dumps([[str(col), str(dtype)] for col, dtype in df.dtypes.items()]).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def checkpoint_path(checksum, path=None):
+    """Where the checkpoint for an input goes when no explicit path is given"""
+    directory = os.environ.get(CHECKPOINT_ENV_VAR) or DEFAULT_CHECKPOINT_DIR
+    return path or os.path.join(directory, f'{checksum}.npz')
+
+
+def _pack_json(value):
+    """Compress a JSON-friendly value into a byte array for a checkpoint"""
+    return np.frombuffer(zlib.compress(json.dumps(value).encode('utf-8'), 1), dtype=np.uint8)
+
+
+def _unpack_json(array):
+    return json.loads(zlib.decompress(array.tobytes()).decode('utf-8'))
+
+
+def load_checkpoint(path):
+    """Read a checkpoint: its stages, checksum, stats and changes, plus the stored arrays. None if there is none"""
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            arrays = {name: data[name] for name in data.files}
+    except (OSError, ValueError, zlib.error):
+        return None
+    state = _unpack_json(arrays.pop('meta'))
+    # Checkpoints written before steps could be left out ran every stage
+    state.setdefault('chain', STAGES[:STAGES.index(state['stage']) + 1])
+
+    # Each merge stage stores only the changes it added
+    state['changes'] = []
+    for stage in STAGES:
+        if f'changes_{stage}' in arrays:
+            state['changes'] += _unpack_json(arrays[f'changes_{stage}'])
+    state['arrays'] = arrays
+    return state
+
+
+def save_checkpoint(path, state, arrays):
+    """Write a checkpoint atomically, so a crash while saving leaves the previous one intact.
+
+    state holds the small metadata; arrays are stored as they are, so large
+    parts should already be packed.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, meta=_pack_json(state), **arrays)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def discard_checkpoint(path):
+    """Delete a checkpoint once it is no longer needed"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _pack(mask):
+    return np.packbits(mask)
+
+
+def _unpack(packed, size):
+    return np.unpackbits(packed, count=size).astype(bool)
+
+
+def stage_chain(match_email=True, remove_empty_ids=True):
+    """The stages a run goes through: the name merge always, the email merge and empty-ID removal if asked for"""
+    return ['normalized', 'name'] + ['email'] * match_email + ['empty_id'] * remove_empty_ids
+
+
+def _entry_size(entry):
+    """Approximate bytes a memo entry holds: its arrays plus its change log"""
+    size = sum(array.nbytes for array in entry['arrays'].values())
+    for change in entry['changes']:
+        size += sys.getsizeof(change) + sum(sys.getsizeof(value) for value in change.values())
+    return size
+
+
+class StageMemo:
+    """Bounded in-memory LRU of stage results.
+
+    Entries are keyed by the input checksum and the stages run to get
+    there, so a run with different downstream options finds the upstream
+    stages it shares with an earlier run. Entries hold the same packed
+    masks, copied-ID rows, change log and stats as a checkpoint, and are
+    never changed once stored. The least recently used entries are dropped
+    once there are more than max_entries or they take more than max_bytes;
+    an entry bigger than max_bytes on its own is not kept.
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None):
+        if max_entries is None:
+            max_entries = int(os.environ.get(STAGE_MEMO_ENV_VAR, DEFAULT_STAGE_MEMO))
+        if max_bytes is None:
+            max_bytes = int(float(os.environ.get(STAGE_MEMO_SIZE_ENV_VAR, DEFAULT_STAGE_MEMO_MB)) * 1024 * 1024)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, checksum, chain):
+        with self._lock:
+            entry = self._entries.get((checksum, tuple(chain)))
+            if entry is not None:
+                self._entries.move_to_end((checksum, tuple(chain)))
+            return entry
+
+    def put(self, checksum, chain, entry):
+        if self.max_entries <= 0:
+            return
+        key = (checksum, tuple(chain))
+        entry_size = _entry_size(entry)
+        with self._lock:
+            self.size -= self._sizes.pop(key, 0)
+            self._entries.pop(key, None)
+            if entry_size > self.max_bytes:
+                return
+            self._entries[key] = entry
+            self._sizes[key] = entry_size
+            self.size += entry_size
+            while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+                oldest, _ = self._entries.popitem(last=False)
+                self.size -= self._sizes.pop(oldest)
+
+    def deepest(self, checksum, chain):
+        """The entry for the longest run of leading stages of chain that is memoized, or None"""
+        for depth in range(len(chain), 0, -1):
+            entry = self.get(checksum, chain[:depth])
+            if entry is not None:
+                return entry
+        return None
+
+
+def stage_memo():
+    """The stage memo shared by every run in this process"""
+    global _memo
+    with _memo_lock:
+        if _memo is None:
+            _memo = StageMemo()
+        return _memo
+
+
+def _common_depth(done, chain):
+    """Number of leading stages two stage chains share"""
+    depth = 0
+    while depth < min(len(done), len(chain)) and done[depth] == chain[depth]:
+        depth += 1
+    return depth
+
+
+def _truncate(state, depth):
+    """Cut a loaded checkpoint back to its first depth stages, as if the later ones never ran"""
+    kept = state['chain'][:depth]
+    dropped = state['chain'][depth:]
+    arrays = state['arrays']
+    for stage in dropped:
+        arrays.pop(f'alive_{stage}', None)
+        if f'changes_{stage}' in arrays:
+            dropped_count = len(_unpack_json(arrays.pop(f'changes_{stage}')))
+            state['changes'] = state['changes'][:len(state['changes']) - dropped_count]
+        state['stats'].pop(f'{stage}_stats', None)
+    arrays['assigned_rows'] = arrays['assigned_rows'][:len(state['changes'])]
+    state['chain'] = kept
+    state['stage'] = kept[-1]
+    return state
+
+
+def _restore(df, chain, arrays, changes, backend):
+    """Rebuild the roster as it stood after the stages of chain from the original input.
+
+    IDs are normalized, the copied IDs from the change log put back and the
+    rows alive after the last merge stage taken, which is all the completed
+    stages changed. Returns the roster and the mask of rows alive after each
+    completed stage.
+    """
+    masks = {name: _unpack(arrays[f'alive_{name}'], len(df)) for name in chain[1:]}
+
+    normalize_member_ids(df, backend)
+    if changes:
+        copied_ids = np.array([change['id_copied'] for change in changes], dtype=object)
+        df.iloc[arrays['assigned_rows'], df.columns.get_loc('Member Card ID')] = copied_ids
+    if 'email' in chain:
+        build_email_keys(df, backend)
+    merged = [name for name in chain[1:] if name != 'empty_id']
+    alive = masks[merged[-1]] if merged else np.ones(len(df), dtype=bool)
+    return df.take(np.flatnonzero(alive)), masks
+
+
+def run_pipeline_resumable(df, path=None, progress=None, backend=None, keep=False, match_email=True,
+                           remove_empty_ids=True, memo=None):
+    """Run the merge steps like run_pipeline, checkpointing at every stage boundary.
+
+    A checkpoint is written after normalization, after the name merge, after
+    the email merge and after empty-ID removal. It holds the rows still
+    alive, the IDs copied so far, the change log and the stats, so a run
+    started again on the same input picks up after the last completed stage
+    instead of starting over. The input checksum is checked first; a
+    checkpoint made for a different input is ignored.
+
+    match_email=False leaves out the email merge and remove_empty_ids=False
+    leaves out empty-ID removal; the stats of a step left out are None. Each
+    stage's result is also kept in memo (the process-wide stage_memo() by
+    default), so comparing options on the same roster only runs the stages
+    after the first option that differs.
+
+    The checkpoint is deleted once the run completes unless keep is set.
+    Returns the same dict as run_pipeline.
+    """
+    if not df.index.is_unique:
+        raise ValueError("Resumable runs need a roster with a unique index")
+
+    backend = get_backend(backend)
+    memo = stage_memo() if memo is None else memo
+    chain = stage_chain(match_email, remove_empty_ids)
+    checksum = frame_checksum(df)
+    path = checkpoint_path(checksum, path)
+    size = len(df)
+
+    # The stages only need the key columns; the rest is gathered for the final roster
+    df, passthrough = split_passthrough(df)
+
+    # Spread each merge step's progress over its share of the run
+    steps = len(chain) - 1
+
+    def step_progress(step):
+        if progress is None:
+            return None
+        return lambda fraction, message: progress((step + fraction) / steps, message)
+
+    def positions(frame):
+        return df.index.get_indexer(frame.index)
+
+    def alive_mask(frame):
+        mask = np.zeros(size, dtype=bool)
+        mask[positions(frame)] = True
+        return mask
+
+    def save(stage, arrays, new_changes=None):
+        state['chain'] = state['chain'] + [stage]
+        state['stage'] = stage
+        stored.update(arrays)
+        if new_changes is not None:
+            # Original positions of the rows that received IDs; the IDs are in the change log
+            rows = df.index.get_indexer([change['no_id_row'] - 2 for change in new_changes])
+            stored['assigned_rows'] = np.concatenate([stored['assigned_rows'], rows.astype(np.int32)])
+            stored[f'changes_{stage}'] = _pack_json(new_changes)
+        save_checkpoint(path, {key: state[key] for key in ('checksum', 'chain', 'stage', 'stats')}, stored)
+        memo.put(checksum, state['chain'], {'chain': state['chain'], 'stats': dict(state['stats']),
+                                            'changes': state['changes'], 'arrays': dict(stored)})
+
+    # Start from the furthest stage of this chain found in memory or on disk
+    state = memo.deepest(checksum, chain)
+    if state is not None:
+        state = dict(state, stats=dict(state['stats']), arrays=dict(state['arrays']))
+    if state is None or len(state['chain']) < len(chain):
+        saved = load_checkpoint(path)
+        if saved is not None and saved.get('checksum') != checksum:
+            if progress is not None:
+                progress(0.0, "The roster changed since the last checkpoint; starting over")
+            saved = None
+        if saved is not None:
+            depth = _common_depth(saved['chain'], chain)
+            if depth > (len(state['chain']) if state is not None else 0):
+                state = _truncate(saved, depth)
+
+    if state is None:
+        state = {'checksum': checksum, 'chain': [], 'stats': {}, 'changes': []}
+        stored = {'assigned_rows': np.empty(0, dtype=np.int32)}
+    else:
+        state['checksum'] = checksum
+        stored = state.pop('arrays')
+        if progress is not None:
+            progress((len(state['chain']) - 1) / steps, f"Resuming after the {state['chain'][-1]} stage...")
+        current, masks = _restore(df, state['chain'], stored, state['changes'], backend)
+    done = len(state['chain'])
+
+    # Normalization: nothing to keep but the input checksum and the initial ID mask;
+    # the keys themselves are rebuilt in well under the time a checkpoint would take to load
+    if done < 1:
+        has_id = normalize_member_ids(df, backend)
+        save('normalized', {'has_id': _pack(has_id)})
+
+    # STEP 1: Process by name
+    if done < 2:
+        current, changes, state['stats']['name_stats'] = process_member_data_by_name(df, step_progress(0), backend)
+        state['changes'] = changes
+        save('name', {'alive_name': _pack(alive_mask(current))}, changes)
+
+    # STEP 2: Process by email
+    if match_email and done < 3:
+        current, changes, state['stats']['email_stats'] = process_member_data_by_email(
+            current, state['changes'], step_progress(1), backend)
+        new_changes = changes[len(state['changes']):]
+        state['changes'] = changes
+        save('email', {'alive_email': _pack(alive_mask(current))}, new_changes)
+
+    # STEP 3: Remove records with empty Member Card IDs
+    removed_records = []
+    if remove_empty_ids and done < len(chain):
+        current, removed_records, state['stats']['empty_id_stats'] = remove_empty_id_records(
+            current, step_progress(steps - 1), backend)
+        save('empty_id', {'alive_empty_id': _pack(alive_mask(current))})
+    elif remove_empty_ids:
+        removed = masks[chain[-2]] & ~masks['empty_id']
+        removed_records = removed_record_list(current[removed[positions(current)]])
+        current = current[masks['empty_id'][positions(current)]]
+
+    result = {
+        'final_df': finalize_roster(current, passthrough),
+        'changes': list(state['changes']),
+        'removed_records': removed_records,
+        'name_stats': state['stats']['name_stats'],
+        'email_stats': state['stats'].get('email_stats'),
+        'empty_id_stats': state['stats'].get('empty_id_stats')
+    }
+
+    # Only once the final roster is built, so a crash while building it still resumes
+    if not keep:
+        discard_checkpoint(path)
+    return result
@@ -0,0 +1,200 @@
+import pandas as pd
+import numpy as np
+
+from ShopRosterBackends import get_backend
+from ShopRosterPipeline import (_report, email_key_codes, finalize_roster, name_key_codes, normalize_member_ids,
+                                removed_record_list)
+
+
+class KeyIndex:
+    """Shared hash index from normalized keys to ids across several rosters.
+
+    Each roster interns its own keys first; only its distinct keys are then
+    joined against the index, so memory grows with the number of distinct
+    keys over all files, not with the rows.
+    """
+
+    def __init__(self):
+        self.keys = pd.Index([], dtype=object)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, codes, keys):
+        """Translate one roster's key codes (-1 for missing) into shared ids, adding unseen keys"""
+        keys = pd.Index(np.asarray(keys, dtype=object))
+        ids = self.keys.get_indexer(keys)
+        unseen = ids < 0
+        ids[unseen] = len(self.keys) + np.arange(unseen.sum())
+        self.keys = self.keys.append(keys[unseen])
+
+        shared = np.full(len(codes), -1, dtype=np.int64)
+        valid = codes >= 0
+        shared[valid] = ids[codes[valid]]
+        return shared
+
+
+def _gather(values, file_of, position_of, rows):
+    """Collect per-file column values for rows given by their position over all files"""
+    result = np.empty(len(rows), dtype=object)
+    for f in np.unique(file_of[rows]):
+        in_file = file_of[rows] == f
+        result[in_file] = values[f][position_of[rows[in_file]]]
+    return result
+
+
+def _pair_alive(codes, has_id, alive, backend):
+    """Pair rows without an ID with rows that have one inside each key group, among the alive rows.
+
+    Groups are ordered by first appearance among the alive rows, as they are
+    when a single roster is processed. Returns the pairs' shared key ids and
+    the positions of both sides over all rows.
+    """
+    rows = np.flatnonzero(alive)
+    local = np.full(len(rows), -1, dtype=np.int64)
+    valid = codes[rows] >= 0
+    local[valid] = pd.factorize(codes[rows][valid])[0]
+
+    group, no_pos, has_pos = backend.pair_within_groups(local, has_id[rows])
+    return codes[rows[no_pos]], rows[no_pos], rows[has_pos], len(np.unique(group))
+
+
+def merge_rosters(rosters, progress=None, backend=None):
+    """Run the name, email and empty-ID steps across several rosters at once.
+
+    rosters maps a source name (such as the file name) to its frame, in the
+    order the files should be read. Every row is tagged with its source, and
+    IDs are copied between rows of different files the same way as inside
+    one: the n-th row without an ID in a key group takes the ID of the n-th
+    row with one, in file order and then row order, and the rows the IDs
+    came from are removed from their file. The frames are changed in place.
+
+    Returns the combined change log and stats, plus the final roster,
+    removed records and stats of each file under 'files'.
+    """
+    backend = get_backend(backend)
+    names = list(rosters)
+    frames = [rosters[name] for name in names]
+
+    # Tag every row with its source file and position in it
+    sizes = np.array([len(df) for df in frames], dtype=np.int64)
+    file_of = np.repeat(np.arange(len(frames), dtype=np.int32), sizes)
+    starts = np.concatenate([[0], np.cumsum(sizes)])
+    position_of = np.arange(starts[-1]) - np.repeat(starts[:-1], sizes)
+    labels = [df.index.to_numpy() for df in frames]
+
+    # Build the shared key index one file at a time
+    _report(progress, 0.0, "Building the shared key index...")
+    name_index, email_index = KeyIndex(), KeyIndex()
+    name_codes, email_codes, has_id = [], [], []
+    for df in frames:
+        has_id.append(normalize_member_ids(df, backend))
+        codes, spell = name_key_codes(df, backend)
+        name_codes.append(name_index.add(codes, spell(np.arange(codes.max(initial=-1) + 1))))
+        codes, emails = email_key_codes(df, backend)
+        email_codes.append(email_index.add(codes, emails))
+
+        # The export carries the normalized emails, like a single-roster run
+        normalized = np.full(len(df), np.nan, dtype=object)
+        normalized[codes >= 0] = np.asarray(emails, dtype=object)[codes[codes >= 0]]
+        df['Email'] = normalized
+
+    name_codes = np.concatenate(name_codes) if frames else np.empty(0, dtype=np.int64)
+    email_codes = np.concatenate(email_codes) if frames else np.empty(0, dtype=np.int64)
+    has_id = np.concatenate(has_id) if frames else np.empty(0, dtype=bool)
+    alive = np.ones(len(has_id), dtype=bool)
+    received = np.zeros(len(has_id), dtype=bool)
+    ids = [df['Member Card ID'].to_numpy(copy=True) for df in frames]
+
+    def excel_row(rows):
+        return (_gather(labels, file_of, position_of, rows) + 2).tolist()
+
+    def copy_ids(match_type, codes, spelled):
+        """Pair rows on one key, copy the IDs across files and return the change log entries"""
+        key_ids, no_pos, has_pos, matches_found = _pair_alive(codes, has_id, alive, backend)
+        copied = _gather(ids, file_of, position_of, has_pos)
+        for f in np.unique(file_of[no_pos]):
+            receiving = file_of[no_pos] == f
+            ids[f][position_of[no_pos[receiving]]] = copied[receiving]
+
+        has_id[no_pos] = True
+        received[no_pos] = True
+        alive[has_pos] = False
+        identifiers = spelled.to_numpy()[key_ids].tolist()
+        changes = [
+            {
+                'match_type': match_type,
+                'identifier': identifier,
+                'no_id_file': names[no_file],
+                'no_id_row': no_row,
+                'has_id_file': names[has_file],
+                'has_id_row': has_row,
+                'id_copied': member_id
+            }
+            for identifier, no_file, no_row, has_file, has_row, member_id in zip(
+                identifiers, file_of[no_pos].tolist(), excel_row(no_pos), file_of[has_pos].tolist(),
+                excel_row(has_pos), copied)
+        ]
+        return changes, matches_found
+
+    # STEP 1: Name matching over all files
+    _report(progress, 0.2, "Matching records by name across files...")
+    records_with_id = int(has_id.sum())
+    total = len(has_id)
+    name_changes, name_matches = copy_ids('Name', name_codes, name_index.keys)
+    name_stats = {
+        'total_records': total,
+        'unique_names': len(name_index) + int((name_codes < 0).any()),
+        'matches_found': name_matches,
+        'ids_copied': len(name_changes),
+        'records_removed': len(name_changes),
+        'records_with_id': records_with_id,
+        'records_without_id': total - records_with_id
+    }
+
+    # STEP 2: Email matching over the rows left
+    _report(progress, 0.5, "Matching records by email across files...")
+    email_total = int(alive.sum())
+    alive_emails = email_codes[alive]
+    email_changes, email_matches = copy_ids('Email', email_codes, email_index.keys)
+    email_stats = {
+        'total_records': email_total,
+        'unique_emails': len(np.unique(alive_emails[alive_emails >= 0])),
+        'matches_found': email_matches,
+        'ids_copied': len(email_changes),
+        'records_removed': len(email_changes)
+    }
+
+    # STEP 3: Empty ID removal, file by file
+    _report(progress, 0.8, "Removing records with empty Member Card IDs...")
+    empty_id_stats = {'total_records': int(alive.sum()), 'records_removed': 0}
+    files = {}
+    for f, (name, df) in enumerate(zip(names, frames)):
+        rows = slice(starts[f], starts[f + 1])
+        df['Member Card ID'] = ids[f]
+        empty = alive[rows] & ~has_id[rows]
+        removed_records = [dict(record, file=name) for record in removed_record_list(df[empty])]
+        empty_id_stats['records_removed'] += len(removed_records)
+
+        keep = alive[rows] & has_id[rows]
+        files[name] = {
+            'final_df': finalize_roster(df.take(np.flatnonzero(keep))),
+            'removed_records': removed_records,
+            'stats': {
+                'total_records': len(df),
+                'ids_received': int(received[rows].sum()),
+                'records_merged_away': int((~alive[rows]).sum()),
+                'empty_id_removed': len(removed_records),
+                'final_records': int(keep.sum())
+            }
+        }
+
+    _report(progress, 1.0, "Cross-file merge complete")
+    return {
+        'files': files,
+        'changes': name_changes + email_changes,
+        'removed_records': [record for result in files.values() for record in result['removed_records']],
+        'name_stats': name_stats,
+        'email_stats': email_stats,
+        'empty_id_stats': empty_id_stats
+    }
@@ -0,0 +1,168 @@
+import csv
+
+from ShopRosterKeys import blank_to_none, normalize_email, normalize_name
+
+# Only the standard library is used here, so a command-line run on a CSV
+# roster starts without loading pandas or numpy. The rules match the
+# engine in ShopRosterPipeline: the same key normalization, pairing order,
+# change log and statistics.
+
+# Line ending of the CSV files written, the same as pandas' to_csv
+LINE_TERMINATOR = '\n'
+
+
+def read_csv_roster(path):
+    """Read a CSV roster as its header and rows of text, with empty cells as None"""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        width = len(header)
+        rows = []
+        for row in reader:
+            if not row:
+                continue
+            row = [value if value != '' else None for value in row[:width]]
+            rows.append(row + [None] * (width - len(row)))
+    return header, rows
+
+
+def write_csv_roster(path, header, rows):
+    """Write rows of text to CSV, with None as an empty cell"""
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f, lineterminator=LINE_TERMINATOR)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def write_csv_records(path, records, columns):
+    """Write a list of dicts (a change log or removed records) to CSV"""
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, columns, lineterminator=LINE_TERMINATOR, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(records)
+
+
+def _pair_groups(keys, has_id, rows):
+    """Pair rows without an ID with rows that have one inside each key group, like pair_within_groups.
+
+    Within a group the n-th row without an ID takes the ID of the n-th row
+    with one, in row order; groups come in order of first appearance among
+    rows. Returns the (key, row without, row with) pairs, the number of
+    groups with pairs and the number of distinct keys.
+    """
+    groups = {}
+    for row in rows:
+        key = keys[row]
+        if key is None:
+            continue
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = ([], [])
+        group[has_id[row]].append(row)
+
+    pairs = []
+    matches_found = 0
+    for key, (without_id, with_id) in groups.items():
+        count = min(len(without_id), len(with_id))
+        if count:
+            matches_found += 1
+            pairs.extend(zip([key] * count, without_id[:count], with_id[:count]))
+    return pairs, matches_found, len(groups)
+
+
+def merge_csv_rows(header, rows, log=None):
+    """Run the name, email and empty-ID steps on rows of text read by read_csv_roster.
+
+    Member Card IDs and emails are normalized in place. Returns the rows
+    kept and the change log, removed records and stats run_pipeline reports.
+    """
+    missing = [col for col in ('First Name', 'Last Name', 'Member Card ID', 'Email') if col not in header]
+    if missing:
+        raise ValueError(f"Missing required columns: {', '.join(missing)}")
+    first_col, last_col = header.index('First Name'), header.index('Last Name')
+    id_col, email_col = header.index('Member Card ID'), header.index('Email')
+
+    ids = [blank_to_none(row[id_col]) for row in rows]
+    has_id = [member_id is not None for member_id in ids]
+    alive = list(range(len(rows)))
+
+    def merge_on_key(match_type, keys):
+        """Copy IDs across the alive rows sharing a key and drop the rows the IDs came from"""
+        nonlocal alive
+        pairs, matches_found, distinct = _pair_groups(keys, has_id, alive)
+        taken = set()
+        changes = []
+        for key, no_id_row, has_id_row in pairs:
+            ids[no_id_row] = ids[has_id_row]
+            has_id[no_id_row] = True
+            taken.add(has_id_row)
+            changes.append({
+                'match_type': match_type,
+                'identifier': key,
+                'no_id_row': no_id_row + 2,  # +2 for the header and 1-based rows, like Excel
+                'has_id_row': has_id_row + 2,
+                'id_copied': ids[has_id_row]
+            })
+        before = len(alive)
+        alive = [row for row in alive if row not in taken]
+        if log is not None:
+            log(f"{match_type} matching: {len(changes)} IDs copied in {matches_found} groups")
+        return changes, matches_found, distinct, before - len(alive)
+
+    # STEP 1: Name matching; rows missing either part of the name get no key
+    names = [normalize_name(row[first_col], row[last_col]) for row in rows]
+    records_with_id = sum(has_id)
+    name_changes, name_matches, distinct_names, name_removed = merge_on_key('Name', names)
+    name_stats = {
+        'total_records': len(rows),
+        'unique_names': distinct_names + (None in names),
+        'matches_found': name_matches,
+        'ids_copied': len(name_changes),
+        'records_removed': name_removed,
+        'records_with_id': records_with_id,
+        'records_without_id': len(rows) - records_with_id
+    }
+
+    # STEP 2: Email matching over the rows left
+    emails = [normalize_email(row[email_col]) for row in rows]
+    email_total = len(alive)
+    email_changes, email_matches, distinct_emails, email_removed = merge_on_key('Email', emails)
+    email_stats = {
+        'total_records': email_total,
+        'unique_emails': distinct_emails,
+        'matches_found': email_matches,
+        'ids_copied': len(email_changes),
+        'records_removed': email_removed
+    }
+
+    # STEP 3: Remove the rows still without an ID
+    removed_records = [
+        {'row': row + 2, 'first_name': rows[row][first_col], 'last_name': rows[row][last_col], 'email': emails[row]}
+        for row in alive if not has_id[row]
+    ]
+    empty_id_stats = {'total_records': len(alive), 'records_removed': len(removed_records)}
+
+    kept = []
+    for row in alive:
+        if has_id[row]:
+            values = list(rows[row])
+            values[id_col] = ids[row]
+            values[email_col] = emails[row]
+            kept.append(values)
+
+    return {
+        'rows': kept,
+        'changes': name_changes + email_changes,
+        'removed_records': removed_records,
+        'name_stats': name_stats,
+        'email_stats': email_stats,
+        'empty_id_stats': empty_id_stats
+    }
+
+
+def process_csv_file(input_path, output_path, log=None):
+    """Read a CSV roster, run the three merge steps and write the result as CSV"""
+    header, rows = read_csv_roster(input_path)
+    result = merge_csv_rows(header, rows, log)
+    write_csv_roster(output_path, header, result['rows'])
+    return result
@@ -0,0 +1,188 @@
+import pandas as pd
+import numpy as np
+
+from ShopRosterBackends import get_backend
+from ShopRosterPipeline import HELPER_COLUMNS, is_id_column
+
+# What rows can be matched on between two versions, with the label shown for the key column
+DIFF_KEYS = {
+    'row': 'Excel Row',
+    'Member Card ID': 'Member Card ID',
+    'Email': 'Email'
+}
+
+# Multiplier used to fold column hashes into one hash per row
+_ROW_HASH_MULTIPLIER = np.uint64(1000003)
+
+
+def _excel_rows(df):
+    """Excel row of every record: the index label plus the header and 1-based numbering"""
+    return np.asarray(df.index) + 2
+
+
+def _diff_keys(df, key, backend):
+    """Key of every row (NaN where it has none), normalized like the merge steps see it"""
+    if key == 'row':
+        return pd.Series(_excel_rows(df), dtype=object)
+    if key not in df.columns:
+        raise ValueError(f"Both versions need a '{key}' column to be compared on it")
+
+    values = df[key].to_numpy(dtype=object)
+    if key == 'Email':
+        return pd.Series(backend.clean_emails(values), dtype=object)
+    return pd.Series(backend.blank_to_nan(values), dtype=object)
+
+
+def _match_rows(old_keys, new_keys):
+    """Pair rows of two versions with the same key; repeated keys pair up in row order.
+
+    Returns the positions of the matched rows in both versions, as a hash
+    join on (key, occurrence) over integer codes.
+    """
+    codes = pd.factorize(pd.concat([old_keys, new_keys], ignore_index=True))[0]
+    split = len(old_keys)
+
+    # Occurrences are counted within each version
+    occurrence = np.concatenate([pd.Series(part).groupby(part).cumcount().to_numpy()
+                                 for part in (codes[:split], codes[split:])])
+    composite = codes.astype(np.int64) * (int(occurrence.max(initial=0)) + 1) + occurrence
+
+    old_composite = composite[:split]
+    new_composite = composite[split:]
+    old_valid = np.flatnonzero(old_keys.notna().to_numpy())
+    new_valid = np.flatnonzero(new_keys.notna().to_numpy())
+
+    found = pd.Index(old_composite[old_valid]).get_indexer(new_composite[new_valid])
+    matched = found >= 0
+    return old_valid[found[matched]], new_valid[matched]
+
+
+def _cell_hashes(old_col, new_col):
+    """Hash one column of both versions so equal cells hash alike, whatever the column dtype"""
+    old_col, new_col = old_col.reset_index(drop=True), new_col.reset_index(drop=True)
+    numeric = all(col.dtype.kind in 'iuf' for col in (old_col, new_col))
+    if numeric:
+        hashed = [col.astype('float64').to_numpy() for col in (old_col, new_col)]
+    else:
+        # Compare everything else as text, with missing cells as empty text
+        hashed = [col.astype(object).where(col.notna(), '').astype(str).to_numpy(dtype=object)
+                  for col in (old_col, new_col)]
+    return [pd.util.hash_array(values) for values in hashed]
+
+
+def diff_rosters(old, new, key='row', backend=None):
+    """Compare two versions of a roster and report added, removed and changed rows.
+
+    Rows are matched on key: 'row' (the Excel row, which for a processed
+    roster is the row the record came from in the upload), 'Member Card ID'
+    or 'Email'. Keys are normalized like the merge steps do; rows repeating
+    a key are matched in row order, and rows without a key are reported as
+    added or removed. Every cell of the shared columns is hashed once, the
+    column hashes are folded into a row hash, and only rows whose hashes
+    differ are compared column by column.
+
+    Returns a dict with the 'changed' cells (one row per cell), the 'added'
+    and 'removed' records, the columns only one version has, and 'stats'.
+    """
+    if key not in DIFF_KEYS:
+        raise ValueError(f"Unknown diff key '{key}'; choose one of {', '.join(DIFF_KEYS)}")
+    backend = get_backend(backend)
+    key_label = DIFF_KEYS[key]
+
+    old_keys = _diff_keys(old, key, backend)
+    new_keys = _diff_keys(new, key, backend)
+    old_pos, new_pos = _match_rows(old_keys, new_keys)
+
+    columns = [col for col in old.columns if col in new.columns and col not in HELPER_COLUMNS]
+    old_hashes = np.empty((len(old), len(columns)), dtype=np.uint64)
+    new_hashes = np.empty((len(new), len(columns)), dtype=np.uint64)
+    for col_idx, col in enumerate(columns):
+        old_hashes[:, col_idx], new_hashes[:, col_idx] = _cell_hashes(old[col], new[col])
+
+    # One hash per row decides which matched rows need a closer look
+    old_row_hash = np.zeros(len(old), dtype=np.uint64)
+    new_row_hash = np.zeros(len(new), dtype=np.uint64)
+    for col_idx in range(len(columns)):
+        old_row_hash = old_row_hash * _ROW_HASH_MULTIPLIER ^ old_hashes[:, col_idx]
+        new_row_hash = new_row_hash * _ROW_HASH_MULTIPLIER ^ new_hashes[:, col_idx]
+    differs = old_row_hash[old_pos] != new_row_hash[new_pos]
+    changed_old, changed_new = old_pos[differs], new_pos[differs]
+
+    # Cells that differ in those rows
+    pair_idx, col_idx = np.nonzero(old_hashes[changed_old] != new_hashes[changed_new])
+    cell_old, cell_new = changed_old[pair_idx], changed_new[pair_idx]
+    old_values = np.empty(len(pair_idx), dtype=object)
+    new_values = np.empty(len(pair_idx), dtype=object)
+    for i in np.unique(col_idx):
+        in_col = col_idx == i
+        old_values[in_col] = old[columns[i]].to_numpy(dtype=object)[cell_old[in_col]]
+        new_values[in_col] = new[columns[i]].to_numpy(dtype=object)[cell_new[in_col]]
+
+    # Values from different columns share a column here, so show them as text
+    for values in (old_values, new_values):
+        present = pd.notna(values)
+        values[present] = values[present].astype(str)
+
+    changed = pd.DataFrame({
+        'key': old_keys.to_numpy()[cell_old],
+        'old_row': _excel_rows(old)[cell_old],
+        'new_row': _excel_rows(new)[cell_new],
+        'column': np.asarray(columns, dtype=object)[col_idx],
+        'old_value': old_values,
+        'new_value': new_values
+    })
+
+    def unmatched(df, matched_pos):
+        rest = np.ones(len(df), dtype=bool)
+        rest[matched_pos] = False
+        records = df.drop(columns=[col for col in HELPER_COLUMNS if col in df.columns]).take(np.flatnonzero(rest))
+        records.insert(0, 'Excel Row', _excel_rows(records))
+        return records.reset_index(drop=True)
+
+    added = unmatched(new, new_pos)
+    removed = unmatched(old, old_pos)
+    return {
+        'key': key_label,
+        'changed': changed,
+        'added': added,
+        'removed': removed,
+        'added_columns': [col for col in new.columns if col not in old.columns and col not in HELPER_COLUMNS],
+        'removed_columns': [col for col in old.columns if col not in new.columns and col not in HELPER_COLUMNS],
+        'stats': {
+            'old_records': len(old),
+            'new_records': len(new),
+            'unchanged': int((~differs).sum()),
+            'changed_records': int(differs.sum()),
+            'changed_cells': len(changed),
+            'added': len(added),
+            'removed': len(removed)
+        }
+    }
+
+
+def write_diff_excel(diff, output):
+    """Write a diff to xlsx: a summary sheet, then the changed cells, added and removed records"""
+    summary = pd.DataFrame(
+        [('Matched on', diff['key'])]
+        + [(name.replace('_', ' ').capitalize(), value) for name, value in diff['stats'].items()]
+        + [('Columns added', ', '.join(map(str, diff['added_columns']))),
+           ('Columns removed', ', '.join(map(str, diff['removed_columns'])))],
+        columns=['Item', 'Value'])
+    changed = diff['changed'].rename(columns={'key': diff['key']})
+
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        for sheet_name, df in [('Summary', summary), ('Changed', changed),
+                               ('Added', diff['added']), ('Removed', diff['removed'])]:
+            df.to_excel(writer, index=False, sheet_name=sheet_name)
+
+            # Keep IDs as text, including the changed values of ID columns
+            worksheet = writer.sheets[sheet_name]
+            for col_idx, col in enumerate(df.columns, start=1):
+                if sheet_name == 'Changed' and col in ('old_value', 'new_value'):
+                    rows = np.flatnonzero([is_id_column(name) for name in df['column']]) + 2
+                elif is_id_column(col):
+                    rows = range(2, len(df) + 2)
+                else:
+                    continue
+                for row in rows:
+                    worksheet.cell(row=int(row), column=col_idx).number_format = '@'
@@ -0,0 +1,181 @@
+from statistics import NormalDist
+
+import pandas as pd
+import numpy as np
+
+from ShopRosterBackends import get_backend
+from ShopRosterPipeline import email_key_codes, member_id_mask, name_key_codes
+
+# Below this many expected groups in a sample the dry run counts everything exactly
+MIN_SAMPLED_GROUPS = 30
+
+# A sample is not trusted when one linked group holds more than this share of the rows
+MAX_GROUP_SHARE = 0.05
+
+
+def _simulate_merge(codes, has_id, alive):
+    """Work out which rows a merge on these keys would pair up, without changing anything.
+
+    Mirrors the merge rule: inside each key group the n-th row without an ID
+    takes the ID of the n-th row with one, in row order. Returns the rows that
+    give their ID away (and get removed), the rows that receive one, and the
+    number of pairs per key.
+    """
+    valid = alive & (codes >= 0)
+    rows = np.flatnonzero(valid)
+    group_count = int(codes.max(initial=-1)) + 1
+
+    n_has = np.bincount(codes[valid & has_id], minlength=group_count)
+    n_no = np.bincount(codes[valid & ~has_id], minlength=group_count)
+    pairs = np.minimum(n_has, n_no)
+
+    # Rank of each row among the rows of its group with the same ID state
+    rank = pd.DataFrame({'code': codes[rows], 'has_id': has_id[rows]}).groupby(
+        ['code', 'has_id'], sort=False).cumcount().to_numpy()
+    paired = np.zeros(len(codes), dtype=bool)
+    paired[rows] = rank < pairs[codes[rows]]
+
+    return paired & has_id, paired & ~has_id, pairs
+
+
+def _first_rows(codes, mask):
+    """Indicator of the first row of each key among the masked rows"""
+    rows = np.flatnonzero(mask & (codes >= 0))
+    first = np.zeros(len(codes), dtype=bool)
+    first[rows[np.unique(codes[rows], return_index=True)[1]]] = True
+    return first
+
+
+def _linked_groups(name_codes, email_codes):
+    """Label every row with the smallest row number it is linked to through shared names or emails"""
+    labels = np.arange(len(name_codes))
+    while True:
+        previous = labels.copy()
+
+        # Hook every row onto the smallest label in its name group and its email group
+        for codes in (name_codes, email_codes):
+            valid = codes >= 0
+            smallest = np.full(int(codes.max(initial=-1)) + 1, len(labels))
+            np.minimum.at(smallest, codes[valid], labels[valid])
+            labels[valid] = np.minimum(labels[valid], smallest[codes[valid]])
+
+        # Follow labels to their roots
+        while True:
+            jumped = labels[labels]
+            if np.array_equal(jumped, labels):
+                break
+            labels = jumped
+
+        if np.array_equal(labels, previous):
+            return labels
+
+
+def _row_counts(name_codes, email_codes, has_id):
+    """Per-row indicators whose sums give every statistic the merge steps report"""
+    everyone = np.ones(len(name_codes), dtype=bool)
+
+    # STEP 1: Name matching
+    gave_id, got_id, name_pairs = _simulate_merge(name_codes, has_id, everyone)
+    name_first = _first_rows(name_codes, everyone)
+    name_group_matched = np.zeros(len(name_codes), dtype=bool)
+    name_group_matched[name_first] = name_pairs[name_codes[name_first]] > 0
+
+    # STEP 2: Email matching on the rows left after step 1
+    alive = ~gave_id
+    has_id = has_id | got_id
+    email_gave_id, email_got_id, email_pairs = _simulate_merge(email_codes, has_id, alive)
+    email_first = _first_rows(email_codes, alive)
+    email_group_matched = np.zeros(len(email_codes), dtype=bool)
+    email_group_matched[email_first] = email_pairs[email_codes[email_first]] > 0
+
+    # STEP 3: Empty ID removal on the rows left after step 2
+    final_alive = alive & ~email_gave_id
+    has_id = has_id | email_got_id
+
+    return {
+        'name_stats': {
+            'total_records': everyone,
+            'unique_names': name_first,
+            'matches_found': name_group_matched,
+            'ids_copied': got_id,
+            'records_removed': gave_id
+        },
+        'email_stats': {
+            'total_records': alive,
+            'unique_emails': email_first,
+            'matches_found': email_group_matched,
+            'ids_copied': email_got_id,
+            'records_removed': email_gave_id
+        },
+        'empty_id_stats': {
+            'total_records': final_alive,
+            'records_removed': final_alive & ~has_id
+        }
+    }
+
+
+def dry_run(df, sample=None, confidence=0.95, seed=0, backend=None):
+    """Estimate what the three merge steps will do without changing or logging anything.
+
+    Builds the name, email and ID keys once and counts group sizes to predict
+    the stats dicts process_member_data_by_name, process_member_data_by_email
+    and remove_empty_id_records would return. With no sample the counts are
+    exact.
+
+    With sample (a fraction between 0 and 1), whole groups of rows linked by a
+    shared name or email are sampled, so no match is ever split, and every
+    figure is scaled up with a confidence interval under 'bounds'.
+    """
+    if sample is not None and not 0 < sample <= 1:
+        raise ValueError("sample must be a fraction between 0 and 1")
+
+    backend = get_backend(backend)
+    name_codes, _ = name_key_codes(df, backend)
+    email_codes, _ = email_key_codes(df, backend)
+
+    # Rows missing a name still count once towards unique names, like Series.unique()
+    missing_name = bool((name_codes < 0).any())
+
+    # Sampling only says something useful with plenty of small linked groups;
+    # otherwise count everything exactly
+    if sample is not None and sample < 1:
+        clusters = _linked_groups(name_codes, email_codes)
+        sizes = np.bincount(clusters)
+        if (np.count_nonzero(sizes) * sample < MIN_SAMPLED_GROUPS
+                or sizes.max(initial=0) > MAX_GROUP_SHARE * len(df)):
+            sample = None
+
+    if sample is None or sample >= 1:
+        indicators = _row_counts(name_codes, email_codes, member_id_mask(df, backend))
+        result = {step: {key: int(rows.sum()) for key, rows in stats.items()}
+                  for step, stats in indicators.items()}
+        result['name_stats']['unique_names'] += int(missing_name)
+        result['sample'] = 1.0
+        return result
+
+    # Sample whole groups of rows linked by name or email, so no match is split
+    rng = np.random.default_rng(seed)
+    rows = np.flatnonzero((rng.random(len(df)) < sample)[clusters])
+
+    # Only the sampled rows need their IDs looked at
+    indicators = _row_counts(name_codes[rows], email_codes[rows], member_id_mask(df.iloc[rows], backend))
+    sample_clusters = pd.factorize(clusters[rows])[0]
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+
+    result = {'sample': sample, 'confidence': confidence, 'bounds': {}}
+    for step, stats in indicators.items():
+        result[step] = {}
+        result['bounds'][step] = {}
+        for key, flags in stats.items():
+            # Horvitz-Thompson estimate over sampled groups and its interval
+            per_cluster = np.bincount(sample_clusters, weights=flags, minlength=sample_clusters.max(initial=-1) + 1)
+            estimate = per_cluster.sum() / sample
+            spread = z * np.sqrt((1 - sample) / sample ** 2 * (per_cluster ** 2).sum())
+            result[step][key] = int(round(estimate))
+            result['bounds'][step][key] = (max(0, int(np.floor(estimate - spread))), int(np.ceil(estimate + spread)))
+
+    if missing_name:
+        result['name_stats']['unique_names'] += 1
+        low, high = result['bounds']['name_stats']['unique_names']
+        result['bounds']['name_stats']['unique_names'] = (low + 1, high + 1)
+    return result
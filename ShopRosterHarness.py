@@ -0,0 +1,401 @@
+"""Output-equivalence and timing harness for every roster merge implementation.
+
+Runs a corpus of rosters through the command-line script, the three app
+versions and the processing engines, compares the final rosters and change
+logs for exact equality, and times each of them. With a saved baseline, a
+stage or implementation slowing down by more than the threshold fails the
+run.
+
+    python ShopRosterHarness.py rosters/*.xlsx --synthetic 2000,20000
+    python ShopRosterHarness.py rosters/ --save-baseline timings.json
+    python ShopRosterHarness.py rosters/ --baseline timings.json --threshold 0.25
+"""
+import os
+import ast
+import sys
+import json
+import logging
+import contextlib
+import time
+import argparse
+import tempfile
+
+import pandas as pd
+import numpy as np
+
+import ShopRosterPipeline as pipeline
+from ShopRosterBackends import MemoizedBackend, available_backends
+from ShopRosterCheckpoints import CHECKPOINT_ENV_VAR, StageMemo, run_pipeline_resumable
+from ShopRosterCrossMerge import merge_rosters
+from ShopRosterCsv import process_csv_file
+from ShopRosterProfiles import read_roster_with_profile
+from ShopRosterStreaming import process_roster_file
+
+# Directory the merge scripts live in
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Slowdowns smaller than this many seconds are treated as noise, whatever the ratio
+MIN_REGRESSION_SECONDS = 0.005
+
+# Default allowed slowdown against the baseline (0.2 = 20% slower)
+DEFAULT_THRESHOLD = 0.2
+
+def synthetic_roster(rows, seed=0):
+    """A reproducible roster with the awkward cases real exports have.
+
+    Names differ in case and surrounding spaces, emails in case, and IDs
+    include blanks, whitespace-only cells and 'nan' text.
+    """
+    rng = np.random.default_rng(seed)
+    people = max(rows // 3, 1)
+    firsts = np.array(['John', 'Mary', 'Bob', 'Ann', 'Sue', 'Li', 'Mary Ann', 'Jose'], dtype=object)
+    lasts = np.array(['Smith', 'Jones', 'Lee', 'Brown', 'Wu', 'Garcia', 'Van Dyke'], dtype=object)
+    person = rng.integers(0, people, rows)
+
+    first = firsts[person % len(firsts)] + (person // len(firsts)).astype(str)
+    last = lasts[person % len(lasts)].copy()
+    first = np.where(rng.random(rows) < 0.1, np.char.lower(first.astype(str)).astype(object), first)
+    last = np.where(rng.random(rows) < 0.1, last + ' ', last)
+
+    email = np.array([f'member{p}@example.com' for p in person % (people // 2 + 1)], dtype=object)
+    email = np.where(rng.random(rows) < 0.1, np.char.upper(email.astype(str)).astype(object), email)
+    email[rng.random(rows) < 0.1] = np.nan
+
+    ids = (100000 + person).astype(str).astype(object)
+    blanks = rng.random(rows)
+    ids[blanks < 0.4] = np.nan
+    ids[(blanks >= 0.4) & (blanks < 0.43)] = ''
+    ids[(blanks >= 0.43) & (blanks < 0.45)] = ' '
+
+    return pd.DataFrame({
+        'First Name': first,
+        'Last Name': last,
+        'Member Card ID': ids,
+        'Email': email,
+        'Visits': rng.integers(0, 100, rows)
+    })
+
+
+def _load_functions(filename):
+    """Load the functions of a merge script without running its app or command-line code"""
+    path = os.path.join(SCRIPT_DIR, filename)
+    with open(path, encoding='utf-8') as f:
+        tree = ast.parse(f.read(), path)
+    tree.body = [node for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom, ast.FunctionDef))]
+
+    namespace = {'__name__': os.path.splitext(filename)[0]}
+    exec(compile(tree, path, 'exec'), namespace)
+    return namespace
+
+
+@contextlib.contextmanager
+def _app_warnings_off():
+    """Silence the warnings the app versions' progress bars log when no app is running"""
+    logging.disable(logging.WARNING)
+    try:
+        yield
+    finally:
+        logging.disable(logging.NOTSET)
+
+
+def _run_merge_cli(df, source):
+    result_df, changes = _load_functions('ShopRosterMerge.py')['merge_by_name'](df, log=lambda *args: None)
+    return result_df, changes
+
+
+def _run_gui_1_0(df, source):
+    with _app_warnings_off():
+        result_df, changes, _ = _load_functions('ShopRosterMergeGui.py')['process_member_data'](df)
+    return result_df, changes
+
+
+def _run_gui_1_1(df, source):
+    with _app_warnings_off():
+        functions = _load_functions('ShopRosterMergeGui1.1.py')
+        name_df, name_changes, _ = functions['process_member_data_by_name'](df)
+        final_df, changes, _ = functions['process_member_data_by_email'](name_df, name_changes)
+    return final_df, changes
+
+
+def _run_gui_1_2(df, source):
+    # An empty memo, so every repeat runs the stages instead of finding the last repeat's results
+    result = run_pipeline_resumable(df, memo=StageMemo(0))
+    return result['final_df'], result['changes']
+
+
+def _run_engine(backend):
+    def run(df, source):
+        result = pipeline.run_pipeline(df, backend=backend)
+        return result['final_df'], result['changes']
+    return run
+
+
+def _run_memoized(df, source):
+    result = pipeline.run_pipeline(df, backend=MemoizedBackend())
+    return result['final_df'], result['changes']
+
+
+def _run_cross_merge(df, source):
+    result = merge_rosters({'roster': df})
+    changes = [{key: value for key, value in change.items() if key not in ('no_id_file', 'has_id_file')}
+               for change in result['changes']]
+    return result['files']['roster']['final_df'], changes
+
+
+def _run_streaming(df, source):
+    # An empty memo, as for the app, so every repeat runs the stages
+    result = process_roster_file(source, memo=StageMemo(0))
+    result.pop('export').result()
+    return result['final_df'], result['changes']
+
+
+def _run_csv(df, source):
+    # The input row travels as an extra column so the kept rows can be lined up with the reference
+    with tempfile.TemporaryDirectory() as directory:
+        input_path = os.path.join(directory, 'roster.csv')
+        output_path = os.path.join(directory, 'processed.csv')
+        df.assign(_input_row=df.index).to_csv(input_path, index=False)
+        result = process_csv_file(input_path, output_path)
+        final_df = pd.read_csv(output_path, dtype=str, keep_default_na=False, na_values=[''])
+
+    final_df = final_df.set_index(final_df.pop('_input_row').astype(np.int64).rename(None))
+    # CSV holds text only, so typed columns are parsed back the way the roster had them
+    for col in df.columns:
+        if df[col].dtype.kind == 'b':
+            final_df[col] = final_df[col] == 'True'
+        elif df[col].dtype.kind in 'iuf':
+            final_df[col] = final_df[col].astype(df[col].dtype)
+        elif df[col].dtype.kind == 'M':
+            final_df[col] = pd.to_datetime(final_df[col]).astype(df[col].dtype)
+    return final_df, result['changes']
+
+
+# name: (merge passes it runs, whether it must match the reference exactly, runner)
+IMPLEMENTATIONS = {
+    'ShopRosterMerge.py': ('name', False, _run_merge_cli),
+    'ShopRosterMergeGui.py': ('name', False, _run_gui_1_0),
+    'ShopRosterMergeGui1.1.py': ('name+email', False, _run_gui_1_1),
+    'ShopRosterMergeGui1.2.py': ('full', True, _run_gui_1_2),
+    'engine:memoized': ('full', True, _run_memoized),
+    'engine:cross_merge': ('full', True, _run_cross_merge),
+    'engine:streaming': ('full', True, _run_streaming),
+    'csv:stdlib': ('full', True, _run_csv),
+}
+for _backend in available_backends():
+    IMPLEMENTATIONS[f'engine:{_backend}'] = ('full', True, _run_engine(_backend))
+
+
+def reference_run(df):
+    """Run the engine's merge steps one at a time, timing each.
+
+    Returns the final roster and change log after each pass level and the
+    seconds each stage took.
+    """
+    timings = {}
+    outputs = {}
+
+    start = time.perf_counter()
+    current, changes, _ = pipeline.process_member_data_by_name(df)
+    timings['name'] = time.perf_counter() - start
+    outputs['name'] = (pipeline.finalize_roster(current), changes)
+
+    start = time.perf_counter()
+    current, changes, _ = pipeline.process_member_data_by_email(current, changes)
+    timings['email'] = time.perf_counter() - start
+    outputs['name+email'] = (pipeline.finalize_roster(current), changes)
+
+    start = time.perf_counter()
+    current, _, _ = pipeline.remove_empty_id_records(current)
+    timings['empty_id'] = time.perf_counter() - start
+    outputs['full'] = (pipeline.finalize_roster(current), changes)
+    return outputs, timings
+
+
+def _canonical_changes(changes):
+    """Change log entries as comparable tuples, whatever keys the implementation used"""
+    return [(change.get('match_type', 'Name'), change.get('identifier', change.get('name')),
+             change['no_id_row'], change['has_id_row'],
+             None if pd.isna(change['id_copied']) else str(change['id_copied']))
+            for change in changes]
+
+
+def _cell_text(values):
+    return np.array(['<missing>' if pd.isna(value) else repr(value) for value in values], dtype=object)
+
+
+def compare_outputs(expected, actual):
+    """Describe the first difference between two (final roster, change log) pairs, or None if equal"""
+    expected_df, expected_changes = expected
+    actual_df, actual_changes = actual
+    actual_df = pipeline.finalize_roster(actual_df)
+
+    if list(expected_df.columns) != list(actual_df.columns):
+        return f"columns differ: {list(expected_df.columns)} vs {list(actual_df.columns)}"
+    if not np.array_equal(np.asarray(expected_df.index), np.asarray(actual_df.index)):
+        missing = expected_df.index.difference(actual_df.index)
+        extra = actual_df.index.difference(expected_df.index)
+        detail = f"{len(expected_df)} rows expected, got {len(actual_df)}"
+        if len(missing):
+            detail += f"; {len(missing)} missing (first at Excel row {missing[0] + 2})"
+        if len(extra):
+            detail += f"; {len(extra)} extra (first at Excel row {extra[0] + 2})"
+        if not len(missing) and not len(extra):
+            detail += "; same rows in a different order"
+        return detail
+
+    for col in expected_df.columns:
+        expected_values = _cell_text(expected_df[col].to_numpy(dtype=object))
+        actual_values = _cell_text(actual_df[col].to_numpy(dtype=object))
+        differs = np.flatnonzero(expected_values != actual_values)
+        if len(differs):
+            row = differs[0]
+            return (f"{len(differs)} cell(s) differ in '{col}', first at Excel row {expected_df.index[row] + 2}: "
+                    f"{expected_values[row]} vs {actual_values[row]}")
+
+    expected_changes = _canonical_changes(expected_changes)
+    actual_changes = _canonical_changes(actual_changes)
+    if expected_changes != actual_changes:
+        if len(expected_changes) != len(actual_changes):
+            return f"{len(expected_changes)} changes expected, got {len(actual_changes)}"
+        first = next(i for i, (a, b) in enumerate(zip(expected_changes, actual_changes)) if a != b)
+        return f"change {first + 1} differs: {expected_changes[first]} vs {actual_changes[first]}"
+    return None
+
+
+def _best_time(run, repeat):
+    """Run a timed function repeat times; return its last result and the best time"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = run()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def run_harness(sources, implementations=None, repeat=3):
+    """Run every fixture through every implementation.
+
+    Returns one report per fixture with each implementation's outcome
+    ('match', 'drift' for a legacy script that differs, 'mismatch' for an
+    engine that differs, or 'error') and the timings in seconds, with the
+    engine's stages under 'stage:<name>'.
+    """
+    implementations = implementations or list(IMPLEMENTATIONS)
+    reports = []
+    for source in sources:
+        original, _ = read_roster_with_profile(source)
+        outputs, stage_timings = None, {}
+        for _ in range(repeat):
+            run_outputs, run_timings = reference_run(original.copy())
+            outputs = outputs or run_outputs
+            for stage, seconds in run_timings.items():
+                stage_timings[stage] = min(stage_timings.get(stage, float('inf')), seconds)
+
+        report = {'fixture': os.path.basename(source), 'rows': len(original), 'results': {},
+                  'timings': {f'stage:{stage}': seconds for stage, seconds in stage_timings.items()}}
+        for name in implementations:
+            level, exact, run = IMPLEMENTATIONS[name]
+            try:
+                actual, seconds = _best_time(lambda: run(original.copy(), source), repeat)
+            except Exception as e:
+                report['results'][name] = {'status': 'error', 'detail': f"{type(e).__name__}: {e}"}
+                continue
+
+            difference = compare_outputs(outputs[level], actual)
+            if difference is None:
+                status = 'match'
+            else:
+                status = 'mismatch' if exact else 'drift'
+            report['results'][name] = {'status': status, 'detail': difference, 'passes': level}
+            report['timings'][name] = seconds
+        reports.append(report)
+    return reports
+
+
+def find_regressions(reports, baseline, threshold=DEFAULT_THRESHOLD):
+    """Timings more than threshold slower than the baseline, as (fixture, timing, baseline, now)"""
+    regressions = []
+    for report in reports:
+        previous = baseline.get(report['fixture'], {})
+        for name, seconds in report['timings'].items():
+            before = previous.get(name)
+            if before is None:
+                continue
+            if seconds > before * (1 + threshold) and seconds - before > MIN_REGRESSION_SECONDS:
+                regressions.append((report['fixture'], name, before, seconds))
+    return regressions
+
+
+def _collect_sources(paths, synthetic, directory):
+    sources = []
+    for path in paths:
+        if os.path.isdir(path):
+            sources += sorted(os.path.join(path, name) for name in os.listdir(path)
+                              if name.lower().endswith(('.xlsx', '.xls')) and not name.startswith('~$'))
+        else:
+            sources.append(path)
+
+    # Synthetic fixtures go through a real file so every implementation reads the same input
+    for seed, rows in enumerate(synthetic):
+        path = os.path.join(directory, f'synthetic_{rows}.xlsx')
+        pipeline.write_roster_excel(synthetic_roster(rows, seed), path)
+        sources.append(path)
+    return sources
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that every roster merge implementation gives the same answer, and time them")
+    parser.add_argument('paths', nargs='*', help="Roster files or directories of them")
+    parser.add_argument('--synthetic', default='', help="Also generate synthetic rosters of these sizes, e.g. 2000,20000")
+    parser.add_argument('--only', default='', help="Comma-separated implementations to run (default: all)")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per timing; the best is kept (default: 3)")
+    parser.add_argument('--baseline', help="JSON timings to compare against")
+    parser.add_argument('--save-baseline', help="Write this run's timings as a baseline")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f"Allowed slowdown against the baseline (default: {DEFAULT_THRESHOLD})")
+    parser.add_argument('--strict', action='store_true', help="Also fail when a legacy script drifts from the engine")
+    args = parser.parse_args()
+
+    implementations = [name.strip() for name in args.only.split(',') if name.strip()] or None
+    unknown = [name for name in implementations or [] if name not in IMPLEMENTATIONS]
+    if unknown:
+        parser.error(f"unknown implementation(s): {', '.join(unknown)}; choose from {', '.join(IMPLEMENTATIONS)}")
+    synthetic = [int(size) for size in args.synthetic.split(',') if size.strip()]
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Keep the checkpoints of resumable runs out of the user's checkpoint directory
+        os.environ[CHECKPOINT_ENV_VAR] = os.path.join(directory, 'checkpoints')
+        sources = _collect_sources(args.paths, synthetic, directory)
+        if not sources:
+            parser.error("no rosters given; pass files, directories or --synthetic sizes")
+        reports = run_harness(sources, implementations, args.repeat)
+
+    failed = False
+    for report in reports:
+        print(f"\n{report['fixture']} ({report['rows']} rows)")
+        for stage in ('stage:name', 'stage:email', 'stage:empty_id'):
+            print(f"  {stage:<28} {report['timings'][stage] * 1000:9.1f} ms")
+        for name, result in report['results'].items():
+            seconds = report['timings'].get(name)
+            timing = f"{seconds * 1000:9.1f} ms" if seconds is not None else " " * 12
+            print(f"  {name:<28} {timing}  {result['status']}" + (f": {result['detail']}" if result['detail'] else ''))
+            if result['status'] in ('mismatch', 'error') or (args.strict and result['status'] == 'drift'):
+                failed = True
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = find_regressions(reports, json.load(f), args.threshold)
+        for fixture, name, before, now in regressions:
+            print(f"SLOWER: {fixture} {name}: {before * 1000:.1f} ms -> {now * 1000:.1f} ms")
+        failed = failed or bool(regressions)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump({report['fixture']: report['timings'] for report in reports}, f, indent=2)
+
+    print("\nFAILED" if failed else "\nOK")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,347 @@
+"""Run history: the copied IDs, removed records and stats of every run.
+
+Each run's audit data is appended to a local SQLite database, indexed so a
+member's history comes back in milliseconds however many runs it holds:
+
+    python ShopRosterHistory.py runs --since 2026-01-01
+    python ShopRosterHistory.py search --name "John Smith"
+    python ShopRosterHistory.py search --email john@example.com --since 2026-01-01 --until 2026-03-31
+    python ShopRosterHistory.py search --member-id 123456
+"""
+import os
+import sys
+import json
+import zlib
+import sqlite3
+import argparse
+import threading
+from contextlib import closing
+from datetime import datetime, timedelta
+
+from ShopRosterKeys import normalize_email, normalize_name
+
+# Environment variable that points at the history database
+HISTORY_ENV_VAR = 'SHOPROSTER_HISTORY'
+
+# Where the history is kept when no path is given and the environment variable is not set
+DEFAULT_HISTORY_PATH = os.path.join(os.path.expanduser('~'), '.shoproster', 'history.sqlite')
+
+# Statistics kept with each run
+STAT_KEYS = ['name_stats', 'email_stats', 'empty_id_stats']
+
+# Databases whose schema this process has already set up, by absolute path
+_initialized = set()
+_initialized_lock = threading.Lock()
+
+# Most values one IN (...) query is given, well under SQLite's variable limit
+_QUERY_CHUNK = 500
+
+# Repeated text (match keys, names, Member Card IDs, file names) is stored
+# once in terms and referred to by number, which keeps the history small and
+# makes every lookup an integer index search. Changes and removed records
+# are clustered by run, so a run's rows sit together on disk
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS terms (
+    term_id INTEGER PRIMARY KEY,
+    term TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    run_at TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    source TEXT,
+    changes INTEGER NOT NULL,
+    removed INTEGER NOT NULL,
+    stats BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS changes (
+    run_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    match_type TEXT NOT NULL,
+    identifier INTEGER,
+    no_id_file INTEGER,
+    no_id_row INTEGER,
+    has_id_file INTEGER,
+    has_id_row INTEGER,
+    id_copied INTEGER,
+    PRIMARY KEY (run_id, seq)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS removed (
+    run_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    file INTEGER,
+    row INTEGER,
+    first_name INTEGER,
+    last_name INTEGER,
+    name_key INTEGER,
+    email INTEGER,
+    PRIMARY KEY (run_id, seq)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS runs_run_at ON runs(run_at);
+CREATE INDEX IF NOT EXISTS changes_identifier ON changes(identifier);
+CREATE INDEX IF NOT EXISTS changes_id_copied ON changes(id_copied);
+CREATE INDEX IF NOT EXISTS removed_name_key ON removed(name_key);
+CREATE INDEX IF NOT EXISTS removed_email ON removed(email);
+"""
+
+def history_path(path=None):
+    """Where the history database is: path, SHOPROSTER_HISTORY or the default"""
+    return path or os.environ.get(HISTORY_ENV_VAR) or DEFAULT_HISTORY_PATH
+
+
+def _text(value):
+    """A logged value as text, with missing values (None, NaN, NaT, pd.NA) as None"""
+    try:
+        missing = value is None or bool(value != value)
+    except TypeError:  # pd.NA, whose comparisons are missing too
+        missing = True
+    if missing:
+        return None
+    if hasattr(value, 'item'):
+        value = value.item()
+    return str(value)
+
+
+def _json_default(value):
+    """Let numpy scalars in the stats through json.dumps"""
+    if hasattr(value, 'item'):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _time_bounds(since=None, until=None):
+    """The run_at range since/until cover, as text for low <= run_at < high.
+
+    Both take a date, a datetime or ISO text; until is inclusive, and a
+    bare date covers that whole day.
+    """
+    def as_datetime(value):
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value)
+        if not isinstance(value, datetime):
+            value = datetime.combine(value, datetime.min.time())
+        return value
+
+    low = high = None
+    if since is not None:
+        low = as_datetime(since).isoformat(sep=' ', timespec='seconds')
+    if until is not None:
+        date_only = len(until) == 10 if isinstance(until, str) else not isinstance(until, datetime)
+        end = as_datetime(until) + (timedelta(days=1) if date_only else timedelta(seconds=1))
+        high = end.isoformat(sep=' ', timespec='seconds')
+    return low, high
+
+
+class RunHistory:
+    """Append-only store of the audit data of every run.
+
+    Each run adds a row to runs (when, what kind of run, the source and its
+    stats as compressed JSON), its change log to changes and its removed
+    records to removed. Match keys, Member Card IDs and file names are kept
+    once in terms, and changes and removed records are indexed by them, so a
+    search reads only the matching rows. The database is in WAL mode, so the
+    app, the service and the watcher can append while others search.
+    """
+
+    def __init__(self, path=None):
+        self.path = history_path(path)
+        absolute = os.path.abspath(self.path)
+        with _initialized_lock:
+            # The schema and WAL mode are set up once per database, not on every run
+            if absolute in _initialized and os.path.exists(absolute):
+                return
+            os.makedirs(os.path.dirname(absolute), exist_ok=True)
+            with closing(self._connect()) as conn:
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.executescript(SCHEMA)
+            _initialized.add(absolute)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _term_ids(self, conn, terms):
+        """ID of every term, adding the new ones; None stays None"""
+        distinct = list({term for term in terms if term is not None})
+        conn.executemany('INSERT OR IGNORE INTO terms(term) VALUES (?)', [(term,) for term in distinct])
+        ids = {}
+        for start in range(0, len(distinct), _QUERY_CHUNK):
+            chunk = distinct[start:start + _QUERY_CHUNK]
+            ids.update(conn.execute(f"SELECT term, term_id FROM terms WHERE term IN ({','.join('?' * len(chunk))})",
+                                    chunk).fetchall())
+        return ids
+
+    def record(self, result, kind='roster', source=None, run_at=None):
+        """Append a run's changes, removed records and stats; returns the new run ID.
+
+        result is what run_pipeline, run_pipeline_resumable, merge_rosters,
+        process_workbook or merge_csv_rows returned. Changes and removed
+        records from several files keep the file they came from.
+        """
+        run_at = (run_at or datetime.now()).isoformat(sep=' ', timespec='seconds')
+        stats = {key: result[key] for key in STAT_KEYS if key in result}
+        if 'files' in result:
+            stats['files'] = {name: file_result['stats'] for name, file_result in result['files'].items()}
+
+        changes = [
+            (_text(change['identifier']), _text(change.get('no_id_file')), change['no_id_row'],
+             _text(change.get('has_id_file')), change['has_id_row'], _text(change['id_copied']), change['match_type'])
+            for change in result['changes']
+        ]
+        removed = [
+            (_text(record.get('file')), record['row'], _text(record['first_name']), _text(record['last_name']),
+             normalize_name(_text(record['first_name']), _text(record['last_name'])),
+             normalize_email(_text(record['email'])))
+            for record in result['removed_records']
+        ]
+
+        with closing(self._connect()) as conn, conn:
+            terms = [value for change in changes for value in (change[0], change[1], change[3], change[5])]
+            terms += [value for record in removed for value in record[:1] + record[2:]]
+            ids = self._term_ids(conn, terms)
+
+            run_id = conn.execute(
+                'INSERT INTO runs(run_at, kind, source, changes, removed, stats) VALUES (?, ?, ?, ?, ?, ?)',
+                (run_at, kind, source, len(changes), len(removed),
+                 zlib.compress(json.dumps(stats, default=_json_default).encode('utf-8')))).lastrowid
+            conn.executemany(
+                'INSERT INTO changes(run_id, seq, match_type, identifier, no_id_file, no_id_row, has_id_file, '
+                'has_id_row, id_copied) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [(run_id, seq, match_type, ids.get(identifier), ids.get(no_id_file), int(no_id_row),
+                  ids.get(has_id_file), int(has_id_row), ids.get(id_copied))
+                 for seq, (identifier, no_id_file, no_id_row, has_id_file, has_id_row, id_copied, match_type)
+                 in enumerate(changes)])
+            conn.executemany(
+                'INSERT INTO removed(run_id, seq, file, row, first_name, last_name, name_key, email) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                [(run_id, seq, ids.get(file), int(row), ids.get(first_name), ids.get(last_name), ids.get(name_key),
+                  ids.get(email))
+                 for seq, (file, row, first_name, last_name, name_key, email) in enumerate(removed)])
+        return run_id
+
+    def runs(self, since=None, until=None, limit=None):
+        """The runs in a date range, newest first, with their stats"""
+        low, high = _time_bounds(since, until)
+        query = 'SELECT * FROM runs WHERE run_at >= ? AND run_at < ? ORDER BY run_at DESC, run_id DESC LIMIT ?'
+        with closing(self._connect()) as conn:
+            rows = conn.execute(query, (low or '', high or '~', -1 if limit is None else limit)).fetchall()
+        return [dict(row, stats=json.loads(zlib.decompress(row['stats']).decode('utf-8'))) for row in rows]
+
+    def _term_id(self, conn, term):
+        row = conn.execute('SELECT term_id FROM terms WHERE term = ?', (term,)).fetchone()
+        return None if row is None else row[0]
+
+    def search(self, name=None, email=None, member_id=None, since=None, until=None, limit=None):
+        """The changes and removed records of a member, newest run first.
+
+        name is matched the way the name merge matches it (trimmed and
+        case-insensitive, first and last name separated by a space), email
+        case-insensitively and member_id exactly against the IDs copied;
+        records matching any of them are returned. Leave them all out to get
+        everything in the date range. Returns {'changes': [...],
+        'removed_records': [...]}, each record with the run ID, time and
+        source of its run.
+        """
+        low, high = _time_bounds(since, until)
+        searching = name is not None or email is not None or member_id is not None
+        filters = [('Name', 'identifier', 'name_key', normalize_name(full_name=name)),
+                   ('Email', 'identifier', 'email', normalize_email(email) if email is not None else None),
+                   (None, 'id_copied', None, _text(member_id))]
+
+        with closing(self._connect()) as conn:
+            # Every filter is a term; a term never seen matches nothing
+            change_filters, removed_filters = [], []
+            for match_type, change_column, removed_column, term in filters:
+                if term is None:
+                    continue
+                term_id = self._term_id(conn, term)
+                if match_type is None:
+                    change_filters.append((f'c.{change_column} = ?', [term_id]))
+                else:
+                    change_filters.append((f'c.{change_column} = ? AND c.match_type = ?', [term_id, match_type]))
+                if removed_column is not None:
+                    removed_filters.append((f'r.{removed_column} = ?', [term_id]))
+
+            def select(table, alias, columns, member_filters):
+                # Removed records never have an ID, so a search by Member Card ID alone finds none
+                if searching and not member_filters:
+                    return []
+                where, params = [], []
+                if low is not None:
+                    where.append('u.run_at >= ?')
+                    params.append(low)
+                if high is not None:
+                    where.append('u.run_at < ?')
+                    params.append(high)
+                if member_filters:
+                    where.append('(' + ' OR '.join(f'({clause})' for clause, _ in member_filters) + ')')
+                    params += [param for _, clause_params in member_filters for param in clause_params]
+                query = (f'SELECT u.run_id, u.run_at, u.source, {", ".join(columns)} FROM {table} {alias} '
+                         f'JOIN runs u ON u.run_id = {alias}.run_id WHERE {" AND ".join(where) or "1"} '
+                         f'ORDER BY u.run_at DESC, u.run_id DESC, {alias}.seq LIMIT ?')
+                return [dict(row) for row in conn.execute(query, params + [-1 if limit is None else limit])]
+
+            def term(alias, column):
+                return f'(SELECT term FROM terms WHERE term_id = {alias}.{column}) AS {column}'
+
+            changes = select('changes', 'c', ['c.match_type', term('c', 'identifier'), term('c', 'no_id_file'),
+                                              'c.no_id_row', term('c', 'has_id_file'), 'c.has_id_row',
+                                              term('c', 'id_copied')], change_filters)
+            removed = select('removed', 'r', [term('r', 'file'), 'r.row', term('r', 'first_name'),
+                                              term('r', 'last_name'), term('r', 'email')], removed_filters)
+        return {'changes': changes, 'removed_records': removed}
+
+
+def record_run(result, kind='roster', source=None, path=None):
+    """Append a run to the history, returning its run ID.
+
+    The history is an audit trail next to the merge, so a history that
+    cannot be written (a full or read-only disk, an unexpected value) never
+    fails the run; the error is printed and the run ID is None then.
+    """
+    try:
+        return RunHistory(path).record(result, kind, source)
+    except Exception as e:
+        print(f"Could not add the run to the history at {history_path(path)}: {e}", file=sys.stderr)
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Look up the copied IDs and removed records of past runs")
+    parser.add_argument('--history', help="History database (default: SHOPROSTER_HISTORY or ~/.shoproster/history.sqlite)")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    runs = commands.add_parser('runs', help="List runs")
+    search = commands.add_parser('search', help="Find a member's changes and removals")
+    search.add_argument('--name', help="First and last name")
+    search.add_argument('--email', help="Email address")
+    search.add_argument('--member-id', help="Member Card ID copied")
+    for command in (runs, search):
+        command.add_argument('--since', help="First date (YYYY-MM-DD)")
+        command.add_argument('--until', help="Last date (YYYY-MM-DD), inclusive")
+        command.add_argument('--limit', type=int, default=200, help="Most rows to show (default: 200)")
+    args = parser.parse_args()
+
+    history = RunHistory(args.history)
+    if args.command == 'runs':
+        for run in history.runs(args.since, args.until, args.limit):
+            print(f"#{run['run_id']} {run['run_at']} {run['kind']} {run['source'] or ''}: "
+                  f"{run['changes']} IDs copied, {run['removed']} records removed")
+        return 0
+
+    found = history.search(args.name, args.email, args.member_id, args.since, args.until, args.limit)
+    for change in found['changes']:
+        print(f"{change['run_at']} {change['source'] or ''}: {change['match_type']} match '{change['identifier']}' "
+              f"copied ID {change['id_copied']} from row {change['has_id_row']} to row {change['no_id_row']}")
+    for record in found['removed_records']:
+        print(f"{record['run_at']} {record['source'] or ''}: removed row {record['row']} "
+              f"({record['first_name']} {record['last_name']}, {record['email']}) for an empty Member Card ID")
+    if not found['changes'] and not found['removed_records']:
+        print("Nothing found")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+import os
+import math
+import time
+import uuid
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+# Environment variables for the worker pool size and how long results are kept
+MAX_JOBS_ENV_VAR = 'SHOPROSTER_MAX_JOBS'
+JOB_TTL_ENV_VAR = 'SHOPROSTER_JOB_TTL'
+
+# Defaults: two merges at a time, results kept for an hour
+DEFAULT_MAX_JOBS = 2
+DEFAULT_JOB_TTL = 3600
+
+
+def json_safe(value):
+    """Make change logs and stats JSON friendly: NaN becomes null, numpy scalars become Python"""
+    if isinstance(value, dict):
+        return {key: json_safe(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [json_safe(item) for item in value]
+    if hasattr(value, 'item'):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+class JobQueue:
+    """Bounded pool of worker threads that runs roster jobs by ID.
+
+    Jobs wait in submission order until a worker is free. Each job reports
+    progress through a callback, and its result is kept until it expires so a
+    page reload can pick it up again with the same job ID.
+    """
+
+    def __init__(self, max_workers=None, result_ttl=None):
+        self.max_workers = max_workers or int(os.environ.get(MAX_JOBS_ENV_VAR, DEFAULT_MAX_JOBS))
+        self.result_ttl = result_ttl or float(os.environ.get(JOB_TTL_ENV_VAR, DEFAULT_JOB_TTL))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='roster-job')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue fn(*args, progress=callback, **kwargs) and return the new job ID"""
+        self.purge_expired()
+
+        job_id = uuid.uuid4().hex
+        job = {
+            'id': job_id,
+            'status': 'queued',
+            'fraction': 0.0,
+            'message': "Waiting for a free worker...",
+            'submitted': time.time(),
+            'started': None,
+            'finished': None,
+            'error': None,
+            'exception': None,
+            'result': None,
+            'future': None
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+            job['future'] = self._executor.submit(self._run, job, fn, args, kwargs)
+        return job_id
+
+    def _run(self, job, fn, args, kwargs):
+        """Run one job on a worker thread and record how it ended"""
+        def progress(fraction, message):
+            job['fraction'] = min(max(float(fraction), 0.0), 1.0)
+            job['message'] = message
+
+        job['status'] = 'running'
+        job['started'] = time.time()
+        job['message'] = "Starting..."
+        try:
+            job['result'] = fn(*args, progress=progress, **kwargs)
+            job['status'] = 'done'
+            job['fraction'] = 1.0
+            job['message'] = "Finished"
+        except Exception as e:
+            job['status'] = 'failed'
+            job['exception'] = e
+            job['error'] = f"{e}\n{traceback.format_exc()}"
+            job['message'] = f"Failed: {e}"
+        finally:
+            job['finished'] = time.time()
+
+    def status(self, job_id):
+        """Snapshot of a job's state without its result, or None if it is unknown or expired"""
+        self.purge_expired()
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            snapshot = {key: value for key, value in job.items() if key not in ('result', 'exception', 'future')}
+
+            # Tell queued jobs how many are waiting in front of them
+            if job['status'] == 'queued':
+                snapshot['position'] = sum(
+                    1 for other in self._jobs.values()
+                    if other['status'] == 'queued' and other['submitted'] < job['submitted'])
+        return snapshot
+
+    def result(self, job_id):
+        """Result of a finished job, or None if it is not done or has expired"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None or job['status'] != 'done':
+            return None
+        return job['result']
+
+    def wait(self, job_id, timeout=None):
+        """Block until a job finishes and return its result, raising the job's own exception if it failed"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            raise KeyError(f"Unknown job '{job_id}'")
+        job['future'].result(timeout=timeout)
+        if job['status'] == 'failed':
+            raise job['exception']
+        if job['status'] != 'done':
+            raise RuntimeError(job['message'])
+        return job['result']
+
+    def cancel(self, job_id):
+        """Cancel a job that has not started yet; returns True if it was cancelled"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or not job['future'].cancel():
+                return False
+            job['status'] = 'cancelled'
+            job['finished'] = time.time()
+        return True
+
+    def forget(self, job_id):
+        """Drop a finished job and its result right away; returns False if it is unknown or has not finished"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job['finished'] is None:
+                return False
+            del self._jobs[job_id]
+        return True
+
+    def purge_expired(self):
+        """Drop finished jobs whose results are older than the time to live"""
+        cutoff = time.time() - self.result_ttl
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job['finished'] is not None and job['finished'] < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
+        return len(expired)
+
+    def shutdown(self, wait=True):
+        """Stop accepting jobs and optionally wait for running ones to finish"""
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
@@ -0,0 +1,35 @@
+# The merge's key rules for one value at a time, for the code that works
+# value by value: the CSV fast path, the member lookup and the run history.
+# The backends in ShopRosterBackends apply the same rules to whole columns.
+# Only the standard library is used here, so the CSV fast path can use it
+# without loading pandas or numpy.
+
+# Text the merge steps treat as an empty value, besides empty and whitespace-only text
+BLANK_VALUES = ('nan', 'None')
+
+
+def blank_to_none(value):
+    """The value as text, or None when it is missing, blank, 'nan' or 'None' (like blank_to_nan)"""
+    text = str(value)
+    if not text.strip() or text in BLANK_VALUES:
+        return None
+    return text
+
+
+def clean_name(value):
+    """Strip and lowercase a name part; None when the cell is not text"""
+    return value.strip().lower() if isinstance(value, str) else None
+
+
+def normalize_name(first_name=None, last_name=None, full_name=None):
+    """The full-name key the name merge uses: parts stripped, lowercased and joined by a space"""
+    if full_name is not None:
+        return clean_name(full_name)
+    first, last = clean_name(first_name), clean_name(last_name)
+    return f"{first} {last}" if first is not None and last is not None else None
+
+
+def normalize_email(email):
+    """The email key the email merge uses: None for blanks, otherwise lowercased"""
+    text = blank_to_none(email)
+    return text.lower() if text is not None else None
@@ -0,0 +1,257 @@
+"""Membership lookup against a processed roster.
+
+Build a lookup file once from a processed roster, then check sign-ups by
+name or email without running the merge:
+
+    python ShopRosterLookup.py build processed_roster.xlsx roster.lookup
+    python ShopRosterLookup.py check roster.lookup --first John --last Smith --email john@example.com
+    python ShopRosterLookup.py check roster.lookup --file signups.xlsx --output checked.xlsx
+"""
+import os
+import sys
+import argparse
+import hashlib
+import tempfile
+
+import pandas as pd
+import numpy as np
+
+from ShopRosterKeys import normalize_email, normalize_name
+from ShopRosterPipeline import email_key_codes, name_key_codes, write_roster_excel
+from ShopRosterProfiles import read_roster_with_profile
+
+# Keys the lookup holds, in the order matches are reported
+LOOKUP_KINDS = ['name', 'email']
+
+
+def key_hash(key):
+    """Stable 64-bit hash of a normalized key, the same in every process"""
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def _pack_strings(values):
+    """Concatenate strings into one UTF-8 byte array with offsets, so loading builds no Python objects"""
+    encoded = [value.encode('utf-8') for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+class MemberLookup:
+    """Exact hash index of the name and email keys of a processed roster.
+
+    For each kind of key it keeps the 64-bit hashes of the distinct
+    normalized keys, sorted, with the key text alongside and the Member Card
+    IDs and Excel rows of the members holding each key grouped after it. A
+    query hashes its key, finds it by binary search and confirms the hit
+    against the stored text, so hash collisions never give a false match.
+    Everything is held in a handful of flat arrays written uncompressed, so a
+    lookup file loads in milliseconds without building Python objects.
+    """
+
+    def __init__(self, arrays):
+        self._arrays = arrays
+        self._blobs = {name: value.tobytes() for name, value in arrays.items() if name.endswith('_blob')}
+
+    @classmethod
+    def from_roster(cls, df, backend=None):
+        """Build the lookup from a processed roster"""
+        rows = np.asarray(df.index) + 2
+        ids = df['Member Card ID'].astype(object).where(df['Member Card ID'].notna(), '').astype(str).to_numpy()
+
+        name_codes, spell = name_key_codes(df, backend)
+        email_codes, emails = email_key_codes(df, backend)
+        keyed = {
+            'name': (name_codes, spell),
+            'email': (email_codes, lambda codes: np.asarray(emails, dtype=object)[codes].tolist())
+        }
+
+        arrays = {'member_count': np.array([len(df)], dtype=np.int64)}
+        for kind, (codes, spell_keys) in keyed.items():
+            distinct, counts = np.unique(codes[codes >= 0], return_counts=True)
+            keys = spell_keys(distinct)
+            hashes = np.array([key_hash(key) for key in keys], dtype=np.uint64)
+            order = np.argsort(hashes, kind='stable')
+
+            # Members of each key, grouped in the order of the sorted keys and in row order inside a key
+            rank = np.empty(len(distinct), dtype=np.int64)
+            rank[order] = np.arange(len(distinct))
+            present = np.flatnonzero(codes >= 0)
+            members = present[np.argsort(rank[np.searchsorted(distinct, codes[present])], kind='stable')]
+
+            arrays[f'{kind}_hashes'] = hashes[order]
+            arrays[f'{kind}_key_blob'], arrays[f'{kind}_key_offsets'] = _pack_strings(np.asarray(keys, dtype=object)[order])
+            arrays[f'{kind}_member_offsets'] = np.concatenate([[0], np.cumsum(counts[order])]).astype(np.int64)
+            arrays[f'{kind}_rows'] = rows[members].astype(np.int64)
+            arrays[f'{kind}_id_blob'], arrays[f'{kind}_id_offsets'] = _pack_strings(ids[members])
+        return cls(arrays)
+
+    @classmethod
+    def load(cls, path):
+        """Load a lookup written by save"""
+        with np.load(path, allow_pickle=False) as data:
+            return cls({name: data[name] for name in data.files})
+
+    def save(self, path):
+        """Write the lookup atomically as an uncompressed .npz file"""
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **self._arrays)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def __len__(self):
+        """Number of members in the roster the lookup was built from"""
+        if 'member_count' not in self._arrays:  # lookup files from before the count was stored
+            return len(self._arrays['name_rows'])
+        return int(self._arrays['member_count'][0])
+
+    def _text(self, kind, field, position):
+        offsets = self._arrays[f'{kind}_{field}_offsets']
+        return self._blobs[f'{kind}_{field}_blob'][offsets[position]:offsets[position + 1]].decode('utf-8')
+
+    def _key_position(self, kind, key, hashes=None, first=None, last=None):
+        """Position of key among the stored keys, confirmed against its text; -1 if it is not there"""
+        if first is None:
+            if key is None:
+                return -1
+            hashes = self._arrays[f'{kind}_hashes']
+            value = np.uint64(key_hash(key))
+            first, last = hashes.searchsorted(value, 'left'), hashes.searchsorted(value, 'right')
+
+        # Almost always a single candidate; more only on a 64-bit hash collision
+        for position in range(first, last):
+            if self._text(kind, 'key', position) == key:
+                return position
+        return -1
+
+    def _members(self, kind, position):
+        offsets = self._arrays[f'{kind}_member_offsets']
+        return range(offsets[position], offsets[position + 1])
+
+    def _member(self, kind, member):
+        return self._text(kind, 'id', member) or None, int(self._arrays[f'{kind}_rows'][member])
+
+    def contains_name(self, first_name=None, last_name=None, full_name=None):
+        """Whether the roster has a member with this name"""
+        return self._key_position('name', normalize_name(first_name, last_name, full_name)) >= 0
+
+    def contains_email(self, email):
+        """Whether the roster has a member with this email"""
+        return self._key_position('email', normalize_email(email)) >= 0
+
+    def find(self, first_name=None, last_name=None, email=None, full_name=None):
+        """Every roster member matching the name or the email, name matches first"""
+        keys = {'name': normalize_name(first_name, last_name, full_name), 'email': normalize_email(email)}
+        matches = []
+        for kind in LOOKUP_KINDS:
+            position = self._key_position(kind, keys[kind])
+            if position < 0:
+                continue
+            for member in self._members(kind, position):
+                member_id, row = self._member(kind, member)
+                matches.append({'match_type': kind.capitalize(), 'identifier': keys[kind],
+                                'member_card_id': member_id, 'row': row})
+        return matches
+
+    def _bulk(self, kind, keys):
+        """First member holding each key, -1 where no member does"""
+        hashes = self._arrays[f'{kind}_hashes']
+        found = np.full(len(keys), -1, dtype=np.int64)
+        present = np.flatnonzero([key is not None for key in keys])
+        if not len(present):
+            return found
+
+        query = np.array([key_hash(key) for key in keys[present]], dtype=np.uint64)
+        first = hashes.searchsorted(query, 'left')
+        last = hashes.searchsorted(query, 'right')
+
+        # Only keys whose hash is in the roster need their text compared
+        offsets = self._arrays[f'{kind}_member_offsets']
+        for i in np.flatnonzero(last > first):
+            position = self._key_position(kind, keys[present[i]], hashes, first[i], last[i])
+            if position >= 0:
+                found[present[i]] = offsets[position]
+        return found
+
+    def check(self, df):
+        """Check a table of sign-ups in bulk.
+
+        df needs First Name and Last Name and/or Email columns. Returns a
+        frame with, per sign-up, whether the name and the email are already
+        in the roster and the Member Card ID and Excel row of the first
+        match (by name, then by email).
+        """
+        keys = {
+            'name': np.array([normalize_name(first, last) for first, last in zip(df['First Name'], df['Last Name'])]
+                             if 'First Name' in df.columns and 'Last Name' in df.columns else [None] * len(df),
+                             dtype=object),
+            'email': np.array([normalize_email(email) for email in df['Email']]
+                              if 'Email' in df.columns else [None] * len(df), dtype=object)
+        }
+
+        result = pd.DataFrame(index=df.index)
+        member_ids = np.full(len(df), None, dtype=object)
+        rows = np.full(len(df), -1, dtype=np.int64)
+        for kind in reversed(LOOKUP_KINDS):
+            found = self._bulk(kind, keys[kind])
+            result[f'{kind}_found'] = found >= 0
+            for i in np.flatnonzero(found >= 0):
+                member_ids[i], rows[i] = self._member(kind, found[i])
+
+        result = result[[f'{kind}_found' for kind in LOOKUP_KINDS]]
+        result['member_card_id'] = member_ids
+        result['row'] = pd.Series(rows, index=df.index).where(rows >= 0).astype('Int64')
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check sign-ups against a processed roster by name or email")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build', help="Build a lookup file from a processed roster")
+    build.add_argument('roster', help="Processed roster (xlsx)")
+    build.add_argument('lookup', help="Lookup file to write")
+
+    check = commands.add_parser('check', help="Check one sign-up or a file of them")
+    check.add_argument('lookup', help="Lookup file built with 'build'")
+    check.add_argument('--first', help="First name")
+    check.add_argument('--last', help="Last name")
+    check.add_argument('--email', help="Email address")
+    check.add_argument('--file', help="Roster of sign-ups to check in bulk")
+    check.add_argument('--output', help="Where to write the bulk results (xlsx); printed when left out")
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        df, _ = read_roster_with_profile(args.roster)
+        lookup = MemberLookup.from_roster(df)
+        lookup.save(args.lookup)
+        print(f"Indexed {len(lookup)} members from {args.roster}")
+        return 0
+
+    lookup = MemberLookup.load(args.lookup)
+    if args.file:
+        signups, _ = read_roster_with_profile(args.file)
+        result = pd.concat([signups, lookup.check(signups)], axis=1)
+        if args.output:
+            write_roster_excel(result, args.output)
+        else:
+            print(result.to_string())
+        return 0
+
+    matches = lookup.find(args.first, args.last, args.email)
+    if not matches:
+        print("No existing member found")
+        return 1
+    for match in matches:
+        print(f"{match['match_type']} match '{match['identifier']}': Member Card ID "
+              f"{match['member_card_id'] or '(none)'} at row {match['row']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
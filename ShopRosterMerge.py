@@ -1,7 +1,165 @@
-import pandas as pd
-import numpy as np
+import sys
+
+# Columns of the change and removed-record reports written with --changes and --removed
+CHANGE_COLUMNS = ['match_type', 'identifier', 'no_id_row', 'has_id_row', 'id_copied']
+REMOVED_COLUMNS = ['row', 'first_name', 'last_name', 'email']
+
+def merge_by_name(df, log=print):
+    """Copy Member Card IDs between records with the same name and drop the records they came from.
+
+    Returns the merged roster and the list of changes; progress is reported through log.
+    """
+    import pandas as pd
+    import numpy as np
+    
+    # Create a modified dataframe where empty strings are treated as NaN
+    df['Member Card ID'] = df['Member Card ID'].replace('', np.nan)
+    
+    # Create name keys for matching
+    df['FullName'] = df['First Name'].str.strip().str.lower() + ' ' + df['Last Name'].str.strip().str.lower()
+    
+    # Create list to track which rows to keep
+    rows_to_keep = list(range(len(df)))
+    
+    # Track changes
+    changes = []
+    
+    # Process each unique full name
+    for name in df['FullName'].unique():
+        # Get indices of all rows with this name
+        indices = df[df['FullName'] == name].index.tolist()
+        
+        # Skip if only one record with this name
+        if len(indices) <= 1:
+            continue
+        
+        # Check if we have both with and without IDs in this group
+        has_id_indices = []
+        no_id_indices = []
+        
+        for idx in indices:
+            if pd.notna(df.loc[idx, 'Member Card ID']):
+                has_id_indices.append(idx)
+            else:
+                no_id_indices.append(idx)
+        
+        # If we have both types, process them
+        if has_id_indices and no_id_indices:
+            # Print what we found for visibility
+            log(f"\nFound match group for '{name}':")
+            log(f"  With IDs: {len(has_id_indices)} records at rows {[i+2 for i in has_id_indices]}")
+            log(f"  Without IDs: {len(no_id_indices)} records at rows {[i+2 for i in no_id_indices]}")
+            
+            # Look specifically at the records to verify
+            for i, idx in enumerate(has_id_indices):
+                log(f"  ID record {i+1}: {df.loc[idx, 'First Name']} {df.loc[idx, 'Last Name']} - ID: {df.loc[idx, 'Member Card ID']}")
+            for i, idx in enumerate(no_id_indices):
+                log(f"  No ID record {i+1}: {df.loc[idx, 'First Name']} {df.loc[idx, 'Last Name']}")
+            
+            # For each record without ID, copy from a record with ID
+            for no_id_idx in no_id_indices:
+                if has_id_indices:
+                    # Get the first available ID record
+                    has_id_idx = has_id_indices.pop(0)
+                    member_id = df.loc[has_id_idx, 'Member Card ID']
+                    
+                    # Copy the ID to the record without one
+                    df.loc[no_id_idx, 'Member Card ID'] = member_id
+                    
+                    # Mark the source record for removal
+                    if has_id_idx in rows_to_keep:
+                        rows_to_keep.remove(has_id_idx)
+                    
+                    # Track the change
+                    changes.append({
+                        'name': name,
+                        'no_id_row': no_id_idx + 2,  # +2 for Excel row
+                        'has_id_row': has_id_idx + 2,  # +2 for Excel row
+                        'id_copied': member_id
+                    })
+    
+    # Keep only the rows we want
+    result_df = df.iloc[rows_to_keep].copy()
+    
+    # Remove the helper column
+    result_df = result_df.drop(columns=['FullName'])
+    
+    return result_df, changes
+
+def _is_csv(path):
+    return path.lower().endswith('.csv')
+
+def _process_with_engine(input_path, output_path, log):
+    """Run a roster through the full engine, for spreadsheets or when the output is not CSV"""
+    import pandas as pd
+    from ShopRosterCsv import LINE_TERMINATOR
+    from ShopRosterPipeline import REQUIRED_COLUMNS, run_pipeline
+    from ShopRosterProfiles import read_roster_with_profile
+    from ShopRosterStreaming import write_roster_rows
+    
+    if _is_csv(input_path):
+        # Every cell is text and only empty cells are missing, as in the CSV fast path
+        df = pd.read_csv(input_path, dtype=str, keep_default_na=False, na_values=[''], encoding='utf-8-sig')
+    else:
+        df, profile_name = read_roster_with_profile(input_path)
+        if profile_name:
+            log(f"Applied column mapping profile '{profile_name}'")
+    missing = [col for col in REQUIRED_COLUMNS if col not in df.columns]
+    if missing:
+        raise ValueError(f"Missing required columns: {', '.join(missing)}")
+    
+    result = run_pipeline(df)
+    if _is_csv(output_path):
+        result['final_df'].to_csv(output_path, index=False, lineterminator=LINE_TERMINATOR)
+    else:
+        write_roster_rows(result['final_df'], output_path)
+    return result
+
+def run_cli(argv):
+    """Non-interactive run for scheduled jobs: all three merge steps, no prompts.
+
+    CSV in and CSV out takes a path that only uses the standard library, so
+    small rosters finish before pandas would even have been imported.
+    """
+    import argparse
+    from ShopRosterCsv import process_csv_file, write_csv_records
+    from ShopRosterHistory import record_run
+    
+    parser = argparse.ArgumentParser(
+        description="Merge duplicate members by name, then email, and drop records without a Member Card ID")
+    parser.add_argument('input', help="Roster to process (csv, xlsx or xls)")
+    parser.add_argument('output', help="Where to write the processed roster (csv or xlsx)")
+    parser.add_argument('--changes', help="Also write the copied IDs to this CSV file")
+    parser.add_argument('--removed', help="Also write the records removed for empty IDs to this CSV file")
+    parser.add_argument('--quiet', action='store_true', help="Only print errors")
+    args = parser.parse_args(argv)
+    log = (lambda message: None) if args.quiet else print
+    
+    try:
+        if _is_csv(args.input) and _is_csv(args.output):
+            result = process_csv_file(args.input, args.output, log)
+        else:
+            result = _process_with_engine(args.input, args.output, log)
+        if args.changes:
+            write_csv_records(args.changes, result['changes'], CHANGE_COLUMNS)
+        if args.removed:
+            write_csv_records(args.removed, result['removed_records'], REMOVED_COLUMNS)
+        record_run(result, 'command_line', args.input)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    
+    final_records = result['empty_id_stats']['total_records'] - result['empty_id_stats']['records_removed']
+    log(f"Total records: {result['name_stats']['total_records']}")
+    log(f"IDs copied by name: {result['name_stats']['ids_copied']}")
+    log(f"IDs copied by email: {result['email_stats']['ids_copied']}")
+    log(f"Removed for empty Member Card ID: {result['empty_id_stats']['records_removed']}")
+    log(f"Final records: {final_records}, saved to {args.output}")
+    return 0
 
 def main():
+    import pandas as pd
+    
     try:
         # Get file paths
         input_file = input("Enter the path to your input Excel file: ")
@@ -19,77 +177,7 @@ def main():
         print(f"Records with Member Card ID: {len(df) - sum(empty_ids)}")
         print(f"Records with empty Member Card ID: {sum(empty_ids)}")
         
-        # Create a modified dataframe where empty strings are treated as NaN
-        df['Member Card ID'] = df['Member Card ID'].replace('', np.nan)
-        
-        # Create name keys for matching
-        df['FullName'] = df['First Name'].str.strip().str.lower() + ' ' + df['Last Name'].str.strip().str.lower()
-        
-        # Create list to track which rows to keep
-        rows_to_keep = list(range(len(df)))
-        
-        # Track changes
-        changes = []
-        
-        # Process each unique full name
-        for name in df['FullName'].unique():
-            # Get indices of all rows with this name
-            indices = df[df['FullName'] == name].index.tolist()
-            
-            # Skip if only one record with this name
-            if len(indices) <= 1:
-                continue
-            
-            # Check if we have both with and without IDs in this group
-            has_id_indices = []
-            no_id_indices = []
-            
-            for idx in indices:
-                if pd.notna(df.loc[idx, 'Member Card ID']):
-                    has_id_indices.append(idx)
-                else:
-                    no_id_indices.append(idx)
-            
-            # If we have both types, process them
-            if has_id_indices and no_id_indices:
-                # Print what we found for visibility
-                print(f"\nFound match group for '{name}':")
-                print(f"  With IDs: {len(has_id_indices)} records at rows {[i+2 for i in has_id_indices]}")
-                print(f"  Without IDs: {len(no_id_indices)} records at rows {[i+2 for i in no_id_indices]}")
-                
-                # Look specifically at the records to verify
-                for i, idx in enumerate(has_id_indices):
-                    print(f"  ID record {i+1}: {df.loc[idx, 'First Name']} {df.loc[idx, 'Last Name']} - ID: {df.loc[idx, 'Member Card ID']}")
-                for i, idx in enumerate(no_id_indices):
-                    print(f"  No ID record {i+1}: {df.loc[idx, 'First Name']} {df.loc[idx, 'Last Name']}")
-                
-                # For each record without ID, copy from a record with ID
-                for no_id_idx in no_id_indices:
-                    if has_id_indices:
-                        # Get the first available ID record
-                        has_id_idx = has_id_indices.pop(0)
-                        member_id = df.loc[has_id_idx, 'Member Card ID']
-                        
-                        # Copy the ID to the record without one
-                        df.loc[no_id_idx, 'Member Card ID'] = member_id
-                        
-                        # Mark the source record for removal
-                        if has_id_idx in rows_to_keep:
-                            rows_to_keep.remove(has_id_idx)
-                            
-                        # Track the change
-                        changes.append({
-                            'name': name,
-                            'no_id_row': no_id_idx + 2,  # +2 for Excel row
-                            'has_id_row': has_id_idx + 2,  # +2 for Excel row
-                            'id_copied': member_id
-                        })
-        
-        # Keep only the rows we want
-        result_df = df.iloc[rows_to_keep].copy()
-        
-        # Remove the helper column
-        result_df = result_df.drop(columns=['FullName'])
+        result_df, changes = merge_by_name(df)
         
         # Report on changes
         print(f"\nProcessed {len(changes)} matches:")
@@ -111,4 +199,7 @@ def main():
         traceback.print_exc()
 
 if __name__ == "__main__":
+    # With arguments run unattended (cron); without, ask for the files
+    if len(sys.argv) > 1:
+        sys.exit(run_cli(sys.argv[1:]))
     main()
@@ -1,287 +1,453 @@
 import streamlit as st
 import pandas as pd
-import numpy as np
 import io
 import base64
+import sqlite3
 
-def get_download_link(df, filename, text):
-    """Generate a download link for a DataFrame"""
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False)
-    b64 = base64.b64encode(output.getvalue()).decode()
-    href = f'<a href="data:application/vnd.openxmlformats-officedocument.spreadsheetml.sheet;base64,{b64}" download="{filename}">{text}</a>'
-    return href
+import ShopRosterPipeline as pipeline
+from ShopRosterBackends import available_backends
+from ShopRosterReader import available_readers, sheet_names
+from ShopRosterProfiles import save_profile
+from ShopRosterCache import read_roster_cached
+from ShopRosterJobs import JobQueue
+from ShopRosterViews import RecordIndex, build_change_index, build_removed_index
+from ShopRosterDryRun import dry_run
+from ShopRosterStreaming import ExcelExport
+from ShopRosterCheckpoints import run_pipeline_resumable
+from ShopRosterCrossMerge import merge_rosters
+from ShopRosterDiff import DIFF_KEYS, diff_rosters, write_diff_excel
+from ShopRosterHistory import RunHistory, record_run
+from ShopRosterValidation import validate_roster
+from ShopRosterWorkbook import process_workbook
 
-def process_member_data_by_name(df):
-    """Process member data to merge IDs and remove duplicates based on names"""
-    # Track processing statistics
-    stats = {
-        "total_records": len(df),
-        "unique_names": 0,
-        "matches_found": 0,
-        "ids_copied": 0,
-        "records_removed": 0
-    }
-    
-    # Create a progress bar
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-    
-    # Create name keys for matching
-    status_text.text("Creating name keys for matching...")
-    df['FullName'] = df['First Name'].str.strip().str.lower() + ' ' + df['Last Name'].str.strip().str.lower()
-    
-    # Handle empty Member Card IDs
-    # Convert empty strings AND whitespace-only strings to NaN
-    df['Member Card ID'] = df['Member Card ID'].astype(str)
-    df['Member Card ID'] = df['Member Card ID'].replace(r'^\s*$', np.nan, regex=True)
-    df['Member Card ID'] = df['Member Card ID'].replace('nan', np.nan)
-    df['Member Card ID'] = df['Member Card ID'].replace('None', np.nan)
-    
-    # Get counts before processing
-    empty_ids = df['Member Card ID'].isna() | (df['Member Card ID'].str.strip() == '')
-    st.write(f"Initial records with Member Card ID: {len(df) - sum(empty_ids)}")
-    st.write(f"Initial records without Member Card ID: {sum(empty_ids)}")
-    
-    # Create list to track which rows to keep
-    rows_to_keep = list(range(len(df)))
-    
-    # Track changes for reporting
-    changes = []
-    
-    # Get unique names
-    unique_names = df['FullName'].unique()
-    stats["unique_names"] = len(unique_names)
-    
-    # Process each unique full name
-    for i, name in enumerate(unique_names):
-        # Update progress
-        progress_bar.progress((i + 1) / len(unique_names))
-        status_text.text(f"Processing {i+1} of {len(unique_names)} unique names: {name}")
-        
-        # Get indices of all rows with this name
-        indices = df[df['FullName'] == name].index.tolist()
-        
-        # Skip if only one record with this name
-        if len(indices) <= 1:
-            continue
-        
-        # Check if we have both with and without IDs in this group
-        has_id_indices = []
-        no_id_indices = []
-        
-        for idx in indices:
-            # Check if Member Card ID is empty or NaN
-            id_value = df.loc[idx, 'Member Card ID']
-            is_empty = pd.isna(id_value) or str(id_value).strip() == ''
-            
-            if not is_empty:
-                has_id_indices.append(idx)
-            else:
-                no_id_indices.append(idx)
-        
-        # If we have both types, process them
-        if has_id_indices and no_id_indices:
-            stats["matches_found"] += 1
-            
-            # For each record without ID, copy from a record with ID
-            for no_id_idx in no_id_indices:
-                if has_id_indices:
-                    # Get the first available ID record
-                    has_id_idx = has_id_indices.pop(0)
-                    member_id = df.loc[has_id_idx, 'Member Card ID']
-                    
-                    # Copy the ID to the record without one
-                    df.loc[no_id_idx, 'Member Card ID'] = member_id
-                    
-                    # Mark the source record for removal
-                    if has_id_idx in rows_to_keep:
-                        rows_to_keep.remove(has_id_idx)
-                        stats["records_removed"] += 1
-                        
-                    # Track the change
-                    stats["ids_copied"] += 1
-                    changes.append({
-                        'match_type': 'Name',
-                        'identifier': name,
-                        'no_id_row': no_id_idx + 2,  # +2 for Excel row number
-                        'has_id_row': has_id_idx + 2,  # +2 for Excel row number
-                        'id_copied': member_id
-                    })
-    
-    # Keep only the rows we want
-    result_df = df.iloc[rows_to_keep].copy()
-    
-    # Clear progress indicators when done
-    progress_bar.empty()
-    status_text.empty()
-    
-    return result_df, changes, stats
+# How often the page checks on a running job, in seconds
+JOB_POLL_SECONDS = 1
 
-def process_member_data_by_email(df, previous_changes):
-    """Process member data to merge IDs and remove duplicates based on emails"""
-    # Track processing statistics
-    stats = {
-        "total_records": len(df),
-        "unique_emails": 0,
-        "matches_found": 0,
-        "ids_copied": 0,
-        "records_removed": 0
-    }
-    
-    # Create a progress bar
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-    
-    # Handle empty Email addresses
-    # Convert empty strings AND whitespace-only strings to NaN
-    df['Email'] = df['Email'].astype(str)
-    df['Email'] = df['Email'].replace(r'^\s*$', np.nan, regex=True) 
-    df['Email'] = df['Email'].replace('nan', np.nan)
-    df['Email'] = df['Email'].replace('None', np.nan)
-    
-    # Normalize email addresses to lowercase
-    df['Email'] = df['Email'].str.lower()
-    
-    # Create list to track which rows to keep
-    rows_to_keep = list(range(len(df)))
-    
-    # Track changes for reporting
-    changes = []
-    
-    # Get valid emails (excluding NaN/empty)
-    valid_emails = df['Email'].dropna()
-    valid_emails = valid_emails[valid_emails != '']
-    unique_emails = valid_emails.unique()
-    stats["unique_emails"] = len(unique_emails)
-    
-    # Process each unique email
-    for i, email in enumerate(unique_emails):
-        # Update progress
-        progress_bar.progress((i + 1) / len(unique_emails))
-        status_text.text(f"Processing {i+1} of {len(unique_emails)} unique emails: {email}")
-        
-        # Get indices of all rows with this email
-        indices = df[df['Email'] == email].index.tolist()
-        
-        # Skip if only one record with this email
-        if len(indices) <= 1:
-            continue
-        
-        # Check if we have both with and without IDs in this group
-        has_id_indices = []
-        no_id_indices = []
-        
-        for idx in indices:
-            # Check if Member Card ID is empty or NaN
-            id_value = df.loc[idx, 'Member Card ID']
-            is_empty = pd.isna(id_value) or str(id_value).strip() == ''
-            
-            if not is_empty:
-                has_id_indices.append(idx)
-            else:
-                no_id_indices.append(idx)
-        
-        # If we have both types, process them
-        if has_id_indices and no_id_indices:
-            stats["matches_found"] += 1
-            
-            # For each record without ID, copy from a record with ID
-            for no_id_idx in no_id_indices:
-                if has_id_indices:
-                    # Get the first available ID record
-                    has_id_idx = has_id_indices.pop(0)
-                    member_id = df.loc[has_id_idx, 'Member Card ID']
-                    
-                    # Copy the ID to the record without one
-                    df.loc[no_id_idx, 'Member Card ID'] = member_id
-                    
-                    # Mark the source record for removal
-                    if has_id_idx in rows_to_keep:
-                        rows_to_keep.remove(has_id_idx)
-                        stats["records_removed"] += 1
-                        
-                    # Track the change
-                    stats["ids_copied"] += 1
-                    changes.append({
-                        'match_type': 'Email',
-                        'identifier': email,
-                        'no_id_row': no_id_idx + 2,  # +2 for Excel row number
-                        'has_id_row': has_id_idx + 2,  # +2 for Excel row number
-                        'id_copied': member_id
-                    })
-    
-    # Keep only the rows we want
-    result_df = df.iloc[rows_to_keep].copy()
-    
-    # Clear progress indicators when done
-    progress_bar.empty()
-    status_text.empty()
-    
-    # Combine changes with previous changes
-    all_changes = previous_changes + changes
-    
-    return result_df, all_changes, stats
+# Most changes and removed records a history search shows
+HISTORY_ROWS = 1000
 
-def remove_empty_id_records(df):
-    """Remove records that still have empty Member Card ID fields"""
-    # Track processing statistics
-    stats = {
-        "total_records": len(df),
-        "records_removed": 0
-    }
-    
-    # Create a progress bar
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-    
-    status_text.text("Identifying records with empty Member Card IDs...")
-    
-    # Handle empty Member Card IDs
-    # Convert empty strings AND whitespace-only strings to NaN
-    df['Member Card ID'] = df['Member Card ID'].astype(str)
-    df['Member Card ID'] = df['Member Card ID'].replace(r'^\s*$', np.nan, regex=True)
-    df['Member Card ID'] = df['Member Card ID'].replace('nan', np.nan)
-    df['Member Card ID'] = df['Member Card ID'].replace('None', np.nan)
-    
-    # Identify empty IDs
-    empty_ids = df['Member Card ID'].isna() | (df['Member Card ID'].str.strip() == '')
-    empty_id_count = sum(empty_ids)
-    
-    # Track records to be removed
-    removed_records = []
-    
-    if empty_id_count > 0:
-        # Get indices of records with empty IDs
-        empty_id_indices = df[empty_ids].index.tolist()
-        
-        # Process each record to be removed
-        for i, idx in enumerate(empty_id_indices):
-            # Update progress
-            progress_bar.progress((i + 1) / len(empty_id_indices))
-            status_text.text(f"Processing {i+1} of {len(empty_id_indices)} records with empty IDs")
-            
-            # Add to removal list
-            record_info = {
-                'row': idx + 2,  # +2 for Excel row number
-                'first_name': df.loc[idx, 'First Name'],
-                'last_name': df.loc[idx, 'Last Name'],
-                'email': df.loc[idx, 'Email']
-            }
-            removed_records.append(record_info)
+def process_roster(df, backend=None, progress=None, match_email=True, remove_empty_ids=True, source=None):
+    """Job body: run the merge steps picked and prepare the Excel download"""
+    # Checkpoint each stage so a restart part way through picks up where it left off;
+    # stages are also memoized, so rerunning the roster with other options only redoes what changed
+    result = run_pipeline_resumable(df, progress=progress, backend=backend, match_email=match_email,
+                                    remove_empty_ids=remove_empty_ids)
+    # Keep the audit trail of the run after the page is gone
+    result['run_id'] = record_run(result, 'roster', source)
+    
+    if progress is not None:
+        progress(1.0, "Preparing Excel file...")
+    # Write and encode the workbook on background threads while the logs are indexed
+    export = ExcelExport(result['final_df'], encode=True)
+    
+    # Index the change log and removed records once for paging
+    result['change_index'] = build_change_index(result['changes'])
+    result['removed_index'] = build_removed_index(result['removed_records'])
+    
+    result['excel'] = export.result().getvalue()
+    result['excel_b64'] = export.encoded()
+    # The merge works on a copy of the key columns, so the upload is left as it was for the before/after comparison
+    result['original'] = df
+    return result
+
+def process_rosters(rosters, backend=None, progress=None):
+    """Job body: merge several rosters against each other and prepare one Excel download per file"""
+    result = merge_rosters(rosters, progress=progress, backend=backend)
+    result['run_id'] = record_run(result, 'cross_file', ', '.join(rosters))
+    
+    if progress is not None:
+        progress(1.0, "Preparing Excel files...")
+    exports = {name: ExcelExport(file_result['final_df'], encode=True) for name, file_result in result['files'].items()}
+    
+    result['change_index'] = build_change_index(result['changes'])
+    result['removed_index'] = build_removed_index(result['removed_records'])
+    
+    for name, export in exports.items():
+        result['files'][name]['excel_b64'] = export.encoded()
+    return result
+
+def process_sheets(data, sheets, combined, reader=None, backend=None, progress=None, source=None):
+    """Job body: process the selected sheets of a workbook and prepare one Excel download holding them all"""
+    result = process_workbook(data, sheets, combined, engine=reader, backend=backend, encode=True, progress=progress)
+    result['run_id'] = record_run(result, 'workbook', source)
+    
+    if progress is not None:
+        progress(1.0, "Preparing Excel file...")
+    result['change_index'] = build_change_index(result['changes'])
+    result['removed_index'] = build_removed_index(result['removed_records'])
+    
+    result['workbook_b64'] = result.pop('export').encoded()
+    return result
+
+@st.cache_resource
+def get_job_queue():
+    """One bounded job queue shared by every session on this server"""
+    return JobQueue()
+
+def show_record_page(index, key, label, equals=None):
+    """Filter, sort and page a record index on the server and send only the visible page"""
+    col1, col2, col3 = st.columns(3)
+    search = col1.text_input("Search:", key=f"{key}_search")
+    sort_by = col2.selectbox("Sort by:", ["(original order)"] + index.columns, key=f"{key}_sort")
+    descending = col3.checkbox("Descending", key=f"{key}_descending")
+    
+    col1, col2, col3, col4 = st.columns(4)
+    first_row = col1.number_input("From Excel row:", min_value=0, value=0, key=f"{key}_first")
+    last_row = col2.number_input("To Excel row (0 = no limit):", min_value=0, value=0, key=f"{key}_last")
+    page_size = col3.selectbox("Rows per page:", [25, 50, 100, 500], index=1, key=f"{key}_page_size")
+    page = col4.number_input("Page:", min_value=1, value=1, key=f"{key}_page")
+    
+    row_range = None
+    if first_row or last_row:
+        row_range = (first_row, last_row or float('inf'))
+    
+    page_df, total, page_count = index.query(
+        equals=equals,
+        search=search,
+        row_range=row_range,
+        sort_by=None if sort_by == "(original order)" else sort_by,
+        ascending=not descending,
+        page=page,
+        page_size=page_size
+    )
+    st.dataframe(page_df)
+    st.write(f"Showing page {min(page, page_count)} of {page_count}: {len(page_df)} of {total} matching {label} "
+             f"({len(index)} total).")
+
+def show_diff(diff, key):
+    """Show a before/after comparison with paged tables and an export button"""
+    stats = diff['stats']
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Unchanged Records", stats['unchanged'])
+    col2.metric("Changed Records", stats['changed_records'], f"{stats['changed_cells']} cells")
+    col3.metric("Added Records", stats['added'])
+    col4.metric("Removed Records", stats['removed'])
+    if diff['added_columns'] or diff['removed_columns']:
+        st.write(f"Columns added: {', '.join(map(str, diff['added_columns'])) or 'none'}; "
+                 f"columns removed: {', '.join(map(str, diff['removed_columns'])) or 'none'}")
+    
+    # Index each table once per session for paging; the diff itself may be shared with other sessions
+    cached = st.session_state.get(f"{key}_indexes")
+    if cached is None or cached[0] is not diff:
+        cached = (diff, {
+            'changed': RecordIndex(diff['changed'], search_columns=['key', 'old_value', 'new_value'],
+                                   row_columns=['old_row', 'new_row']),
+            'added': RecordIndex(diff['added'], search_columns=diff['added'].columns[1:], row_columns=['Excel Row']),
+            'removed': RecordIndex(diff['removed'], search_columns=diff['removed'].columns[1:],
+                                   row_columns=['Excel Row'])
+        })
+        st.session_state[f"{key}_indexes"] = cached
+    indexes = cached[1]
+    
+    changed_tab, added_tab, removed_tab = st.tabs(["Changed", "Added", "Removed"])
+    with changed_tab:
+        column = st.selectbox("Column:", ["All"] + indexes['changed'].values('column'), key=f"{key}_column")
+        show_record_page(indexes['changed'], f"{key}_changed", "changed cells", equals={'column': column})
+    with added_tab:
+        show_record_page(indexes['added'], f"{key}_added", "added records")
+    with removed_tab:
+        show_record_page(indexes['removed'], f"{key}_removed", "removed records")
+    
+    if st.button("Export Comparison", key=f"{key}_export"):
+        output = io.BytesIO()
+        write_diff_excel(diff, output)
+        b64 = base64.b64encode(output.getvalue()).decode()
+        href = f'<a href="data:application/vnd.openxmlformats-officedocument.spreadsheetml.sheet;base64,{b64}" download="roster_comparison.xlsx">Click here to download the comparison</a>'
+        st.markdown(href, unsafe_allow_html=True)
+
+def compare_versions(before_file, after_file):
+    """Compare two uploaded versions of a roster"""
+    with st.spinner("Loading data..."):
+        before, _ = read_roster_cached(before_file, reader)
+        after, _ = read_roster_cached(after_file, reader)
+    
+    diff_key = st.selectbox("Match rows on:", list(DIFF_KEYS), format_func=DIFF_KEYS.get, key="versions_key")
+    try:
+        diff = diff_rosters(before, after, diff_key, backend=backend)
+    except ValueError as e:
+        st.error(str(e))
+        return
+    show_diff(diff, "versions")
+
+def show_validation(validation):
+    """Show the data quality issues found in the key columns"""
+    summary = validation['summary']
+    summary = summary[summary['rows_flagged'] > 0]
+    if summary.empty:
+        st.success("No data quality issues found in the name, email and ID columns.")
+        return
+    
+    st.warning(f"Data quality: {summary['rows_flagged'].sum()} flagged value(s) may group records wrongly. "
+               "Fix them in the file and upload it again, or process as is.")
+    with st.expander("Data quality issues"):
+        st.dataframe(summary.reset_index(drop=True))
+        rule = st.selectbox("Rule:", ["All"] + summary['rule'].unique().tolist(), key="issues_rule")
+        index = RecordIndex(validation['flagged'], search_columns=['value'], row_columns=['row'])
+        show_record_page(index, "issues", "flagged values", equals={'rule': rule})
+
+def show_dry_run(estimate):
+    """Show the expected counts from a dry run, with ranges when it was sampled"""
+    bounds = estimate.get('bounds', {})
+    
+    def figure(step, key):
+        value = estimate[step][key]
+        if step in bounds:
+            low, high = bounds[step][key]
+            return f"{value} ({low}-{high})"
+        return str(value)
+    
+    if 'bounds' in estimate:
+        st.write(f"Estimated from a {estimate['sample']:.0%} sample; ranges are {estimate['confidence']:.0%} confidence bounds.")
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Name Groups to Merge", figure('name_stats', 'matches_found'))
+    col2.metric("Email Groups to Merge", figure('email_stats', 'matches_found'))
+    col3.metric("IDs to Copy", f"{figure('name_stats', 'ids_copied')} + {figure('email_stats', 'ids_copied')}")
+    col4.metric("Empty-ID Removals", figure('empty_id_stats', 'records_removed'))
+
+def show_results(result, job_id):
+    """Show statistics, change logs and the download link for a finished job"""
+    name_stats = result['name_stats']
+    email_stats = result['email_stats']
+    empty_id_stats = result['empty_id_stats']
+    all_changes = result['changes']
+    removed_records = result['removed_records']
+    final_result_df = result['final_df']
+    
+    st.write(f"Initial records with Member Card ID: {name_stats['records_with_id']}")
+    st.write(f"Initial records without Member Card ID: {name_stats['records_without_id']}")
+    
+    # Show statistics with three sections
+    st.subheader("Processing Results")
+    
+    # Name-based statistics
+    st.write("### Name-Based Deduplication")
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Unique Names", name_stats["unique_names"])
+    col2.metric("Matches Found", name_stats["matches_found"])
+    col3.metric("IDs Copied", name_stats["ids_copied"])
+    st.metric("Records Removed", name_stats["records_removed"])
+    
+    # Email-based statistics
+    st.write("### Email-Based Deduplication")
+    if email_stats is None:
+        st.info("Skipped: email matching was turned off for this run.")
+    else:
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Unique Emails", email_stats["unique_emails"])
+        col2.metric("Matches Found", email_stats["matches_found"])
+        col3.metric("IDs Copied", email_stats["ids_copied"])
+        st.metric("Records Removed", email_stats["records_removed"])
+    
+    # Empty ID removal statistics
+    st.write("### Empty ID Removal")
+    if empty_id_stats is None:
+        st.info("Skipped: records without a Member Card ID were kept in this run.")
+    else:
+        col1, col2 = st.columns(2)
+        col1.metric("Initial Records", empty_id_stats["total_records"])
+        col2.metric("Records with Empty IDs Removed", empty_id_stats["records_removed"])
+    
+    # Overall statistics
+    st.write("### Overall Results")
+    col1, col2 = st.columns(2)
+    total_records_removed = sum(stats["records_removed"] for stats in (name_stats, email_stats, empty_id_stats)
+                                if stats is not None)
+    col1.metric("Initial Records", name_stats["total_records"])
+    col2.metric("Final Records", name_stats["total_records"] - total_records_removed, f"-{total_records_removed}")
+    
+    # Show the changes made during ID matching
+    if all_changes:
+        st.subheader("ID Matching Changes")
         
-        # Remove records with empty IDs
-        result_df = df[~empty_ids].copy()
-        stats["records_removed"] = empty_id_count
+        # Add a filter widget
+        match_type = st.selectbox(
+            "Filter by match type:", 
+            ["All", "Name", "Email"]
+        )
+        show_record_page(result['change_index'], "changes", "changes", equals={'match_type': match_type})
+    else:
+        st.info("No matching profiles found to merge.")
+    
+    # Show records removed due to empty IDs
+    if removed_records:
+        st.subheader("Records Removed (Empty Member Card IDs)")
+        show_record_page(result['removed_index'], "removed", "records with empty Member Card IDs")
+    elif empty_id_stats is not None:
+        st.info("No records with empty Member Card IDs found.")
+    
+    # Preview the result
+    st.subheader("Result Preview")
+    st.dataframe(final_result_df.head())
+    
+    # Download link
+    st.subheader("Download Processed Data")
+    filename = "processed_roster.xlsx"
+    b64 = result['excel_b64']
+    href = f'<a href="data:application/vnd.openxmlformats-officedocument.spreadsheetml.sheet;base64,{b64}" download="{filename}">Click here to download the processed Excel file</a>'
+    st.markdown(href, unsafe_allow_html=True)
+    
+    # Before/after comparison of the upload and the processed roster
+    st.subheader("Compare with the Original Upload")
+    diff_key = st.selectbox("Match rows on:", list(DIFF_KEYS), format_func=DIFF_KEYS.get, key="result_diff_key")
+    # Kept per session: the job result is shared by every session showing the job, so it is only read
+    diffs = st.session_state.get("result_diffs")
+    if diffs is None or diffs['job'] != job_id:
+        diffs = st.session_state["result_diffs"] = {'job': job_id}
+    if diff_key not in diffs:
+        diffs[diff_key] = diff_rosters(result['original'], final_result_df, diff_key)
+    show_diff(diffs[diff_key], "result_diff")
+
+def show_cross_results(result):
+    """Show the combined statistics, change log and per-file downloads of a cross-file merge"""
+    name_stats = result['name_stats']
+    email_stats = result['email_stats']
+    empty_id_stats = result['empty_id_stats']
+    
+    st.subheader("Cross-File Results")
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Initial Records", name_stats["total_records"])
+    col2.metric("Name Matches", name_stats["matches_found"])
+    col3.metric("Email Matches", email_stats["matches_found"])
+    col4.metric("Empty IDs Removed", empty_id_stats["records_removed"])
+    
+    # Per-file breakdown; a multi-sheet workbook is broken down by sheet
+    st.write("### Per-Sheet Results" if 'workbook_b64' in result else "### Per-File Results")
+    st.dataframe(pd.DataFrame.from_dict({name: file_result['stats'] for name, file_result in result['files'].items()},
+                                        orient='index'))
+    
+    if result['changes']:
+        st.subheader("ID Matching Changes")
+        match_type = st.selectbox("Filter by match type:", ["All", "Name", "Email"])
+        show_record_page(result['change_index'], "changes", "changes", equals={'match_type': match_type})
     else:
-        result_df = df.copy()
+        st.info("No matching profiles found to merge.")
+    
+    if result['removed_records']:
+        st.subheader("Records Removed (Empty Member Card IDs)")
+        show_record_page(result['removed_index'], "removed", "records with empty Member Card IDs")
     
-    # Clear progress indicators when done
-    progress_bar.empty()
-    status_text.empty()
+    # One download per source file, or one workbook with every processed sheet
+    st.subheader("Download Processed Data")
+    if 'workbook_b64' in result:
+        b64 = result['workbook_b64']
+        href = f'<a href="data:application/vnd.openxmlformats-officedocument.spreadsheetml.sheet;base64,{b64}" download="processed_roster.xlsx">Download Processed Workbook</a>'
+        st.markdown(href, unsafe_allow_html=True)
+        return
+    for name, file_result in result['files'].items():
+        filename = f"processed_{name.rsplit('.', 1)[0]}.xlsx"
+        b64 = file_result['excel_b64']
+        href = f'<a href="data:application/vnd.openxmlformats-officedocument.spreadsheetml.sheet;base64,{b64}" download="{filename}">Download {filename}</a>'
+        st.markdown(href, unsafe_allow_html=True)
+
+def cross_file_upload(uploaded_files):
+    """Load several rosters and start a cross-file merge job"""
+    rosters = {}
+    with st.spinner("Loading data..."):
+        for uploaded in uploaded_files:
+            rosters[uploaded.name], profile_name = read_roster_cached(uploaded, reader)
+            if profile_name:
+                st.info(f"Applied column mapping profile '{profile_name}' to {uploaded.name}")
+    
+    # Every file needs the required columns; mappings are set up one file at a time
+    problems = {name: [col for col in pipeline.REQUIRED_COLUMNS if col not in df.columns] for name, df in rosters.items()}
+    problems = {name: missing for name, missing in problems.items() if missing}
+    if problems:
+        for name, missing in problems.items():
+            st.error(f"{name} is missing required columns: {', '.join(missing)}")
+        st.write("Open the file on its own to map its columns and save the mapping as a profile.")
+        return
+    
+    st.write(f"{len(rosters)} files, {sum(len(df) for df in rosters.values())} records in total.")
+    if st.button("Merge Files"):
+        job_id = get_job_queue().submit(process_rosters, rosters, backend=backend)
+        st.query_params["job"] = job_id
+
+def workbook_upload(uploaded):
+    """Pick the sheets of a workbook and how to deduplicate them, then start the processing job"""
+    names = sheet_names(uploaded, reader)
+    sheets = st.multiselect("Sheets to process:", names, default=names)
+    scope = st.radio("Remove duplicates:", ["Within each sheet", "Across all selected sheets"])
     
-    return result_df, removed_records, stats
+    if sheets and st.button("Process Sheets"):
+        job_id = get_job_queue().submit(process_sheets, uploaded.getvalue(), sheets,
+                                        scope == "Across all selected sheets", reader=reader, backend=backend,
+                                        source=uploaded.name)
+        st.query_params["job"] = job_id
+
+def show_history():
+    """Search the copied IDs and removed records of past runs by member or date"""
+    col1, col2, col3 = st.columns(3)
+    name = col1.text_input("Member name (first and last):", key="history_name")
+    email = col2.text_input("Email:", key="history_email")
+    member_id = col3.text_input("Member Card ID:", key="history_member_id")
+    col1, col2 = st.columns(2)
+    since = col1.date_input("From:", value=None, key="history_since")
+    until = col2.date_input("To (inclusive):", value=None, key="history_until")
+    
+    # Without a member to look for, list the runs themselves
+    list_runs = not (name.strip() or email.strip() or member_id.strip())
+    try:
+        history = RunHistory()
+        found = history.search(name.strip() or None, email.strip() or None, member_id.strip() or None, since, until,
+                               limit=HISTORY_ROWS)
+        runs = history.runs(since, until, limit=HISTORY_ROWS) if list_runs else None
+    except (OSError, sqlite3.Error) as e:
+        st.error(f"Could not read the run history: {str(e)}")
+        return
+    
+    if list_runs:
+        st.subheader(f"Runs ({len(runs)})")
+        if runs:
+            st.dataframe(pd.DataFrame(runs).drop(columns=['stats']), hide_index=True)
+        else:
+            st.info("No runs recorded in this period.")
+    
+    st.subheader(f"ID Matching Changes ({len(found['changes'])})")
+    if found['changes']:
+        st.dataframe(pd.DataFrame(found['changes']), hide_index=True)
+    st.subheader(f"Records Removed for Empty Member Card IDs ({len(found['removed_records'])})")
+    if found['removed_records']:
+        st.dataframe(pd.DataFrame(found['removed_records']), hide_index=True)
+    if HISTORY_ROWS in (len(found['changes']), len(found['removed_records'])):
+        st.caption(f"Showing the {HISTORY_ROWS} most recent; narrow the search or the dates to see others.")
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def show_job_progress(job_id):
+    """Poll a queued or running job; only this fragment reruns, not the upload and checks above it"""
+    jobs = get_job_queue()
+    status = jobs.status(job_id)
+    if status is None or status['status'] not in ('queued', 'running'):
+        # Rerun the whole page once to show how the job ended
+        st.rerun()
+    
+    if status['status'] == 'queued':
+        st.info(f"Waiting for a free worker ({status['position']} job(s) ahead)...")
+    else:
+        st.progress(status['fraction'], text=status['message'])
+    
+    # The job keeps running if the page is closed or reloaded
+    if st.button("Cancel") and jobs.cancel(job_id):
+        st.rerun()
+
+def show_job(job_id):
+    """Show a processing job's progress, or its results once it has finished"""
+    jobs = get_job_queue()
+    status = jobs.status(job_id)
+    
+    if status is None:
+        st.warning("This processing run has expired or is unknown. Please process the file again.")
+    elif status['status'] in ('queued', 'running'):
+        show_job_progress(job_id)
+    elif status['status'] == 'failed':
+        st.error(f"Processing failed: {status['error']}")
+    elif status['status'] == 'cancelled':
+        st.info("Processing was cancelled.")
+    else:
+        result = jobs.result(job_id)
+        if 'files' in result:
+            show_cross_results(result)
+        else:
+            show_results(result, job_id)
 
 # Set up the Streamlit app
 st.set_page_config(page_title="Golf Shop Roster Utility", page_icon="solsticelogo.png", layout="wide")
@@ -290,40 +456,60 @@ st.set_page_config(page_title="Golf Shop Roster Utility", page_icon="solsticelog
 st.title("Golf Shop Roster Utility")
 st.markdown("© Solstice Solutions | all rights reserved")
 
+# Let the user pick the processing engine; 'auto' uses the fastest one installed
+backend = st.sidebar.selectbox("Processing engine:", ["auto"] + available_backends())
+reader = st.sidebar.selectbox("Spreadsheet reader:", ["auto"] + available_readers())
+
+# Cross-file mode resolves duplicates between several exports at once,
+# workbook mode processes rosters split over several sheets of one file,
+# comparison mode diffs any two versions of a roster and history mode searches past runs
+mode = st.sidebar.radio("Mode:", ["Process one roster", "Merge several roster files together",
+                                  "Process a multi-sheet workbook", "Compare two roster versions",
+                                  "Search run history"])
+
 # File uploader
-st.write("Upload your Excel roster file")
-uploaded_file = st.file_uploader("", type=['xlsx', 'xls'])
+uploaded_file = None
+if mode == "Merge several roster files together":
+    st.write("Upload the Excel roster files to merge together")
+    uploaded_files = st.file_uploader("", type=['xlsx', 'xls'], accept_multiple_files=True)
+    if uploaded_files:
+        cross_file_upload(uploaded_files)
+elif mode == "Process a multi-sheet workbook":
+    st.write("Upload an Excel workbook with members on several sheets")
+    workbook_file = st.file_uploader("", type=['xlsx', 'xls'], key="workbook_file")
+    if workbook_file is not None:
+        workbook_upload(workbook_file)
+elif mode == "Compare two roster versions":
+    col1, col2 = st.columns(2)
+    before_file = col1.file_uploader("Before", type=['xlsx', 'xls'], key="before_file")
+    after_file = col2.file_uploader("After", type=['xlsx', 'xls'], key="after_file")
+    if before_file is not None and after_file is not None:
+        compare_versions(before_file, after_file)
+elif mode == "Search run history":
+    show_history()
+else:
+    st.write("Upload your Excel roster file")
+    uploaded_file = st.file_uploader("", type=['xlsx', 'xls'])
 
 if uploaded_file is not None:
     # Load the data
     try:
         with st.spinner("Loading data..."):
-            # First, try to identify the GGS_ID column by checking column names
-            # Read the first few rows to get column names
-            preview_df = pd.read_excel(uploaded_file, nrows=1)
-            column_dtypes = {}
-            
-            # Look for columns that might contain IDs and ensure they're treated as strings
-            for col in preview_df.columns:
-                if any(id_term in col.lower() for id_term in ['id', 'ggs', 'member', 'card']):
-                    column_dtypes[col] = str
-            
-            # Now read the full file with the specified dtypes
-            df = pd.read_excel(uploaded_file, dtype=column_dtypes)
-            
-            # Additionally, convert any other columns that look like they contain large numeric IDs
-            for col in df.columns:
-                # Check a sample of values to see if they're large numbers
-                sample = df[col].dropna().head(10)
-                if sample.astype(str).str.len().mean() > 10 and pd.to_numeric(sample, errors='coerce').notna().all():
-                    df[col] = df[col].astype(str)
+            # Read with the fastest installed engine, keeping ID columns as text
+            # and applying a saved column-mapping profile if one fits this file.
+            # Files opened before (by any session) come from the on-disk cache.
+            session_mapping = st.session_state.get("column_mappings", {}).get(uploaded_file.name)
+            df, profile_name = read_roster_cached(uploaded_file, reader, mapping=session_mapping)
+        
+        if profile_name:
+            st.info(f"Applied column mapping profile '{profile_name}'")
         
         # Show a preview of the data
         st.subheader("Data Preview")
         st.dataframe(df.head())
         
         # Verify required columns exist
-        required_columns = ['First Name', 'Last Name', 'Member Card ID', 'Email']
+        required_columns = pipeline.REQUIRED_COLUMNS
         missing_columns = [col for col in required_columns if col not in df.columns]
         
         if missing_columns:
@@ -331,7 +517,7 @@ if uploaded_file is not None:
             
             # Show available columns to help the user
             st.write("Available columns in your file:")
-            st.write(", ".join(df.columns.tolist()))
+            st.write(", ".join(str(col) for col in df.columns))
             
             # Allow column mapping
             st.subheader("Column Mapping")
@@ -342,129 +528,52 @@ if uploaded_file is not None:
                 if req_col in missing_columns:
                     mapping[req_col] = st.selectbox(f"Select column for '{req_col}':", [""] + df.columns.tolist())
             
-            if st.button("Apply Mapping"):
-                # Rename columns according to mapping
-                for req_col, file_col in mapping.items():
-                    if file_col:
-                        df = df.rename(columns={file_col: req_col})
-                st.success("Column mapping applied!")
-                st.experimental_rerun()
+            # Save the mapping so files with the same layout are mapped automatically
+            new_profile_name = st.text_input("Save this mapping as profile:", value=uploaded_file.name.rsplit('.', 1)[0])
+            
+            if not st.button("Apply Mapping"):
+                st.stop()
             
-            st.stop()
+            if new_profile_name:
+                save_profile(new_profile_name, mapping, df.columns)
+            else:
+                # Keep an unnamed mapping for the rest of this session
+                st.session_state.setdefault("column_mappings", {})[uploaded_file.name] = mapping
             
-        # Process button
+            # Rename columns according to mapping
+            df = df.rename(columns={file_col: req_col for req_col, file_col in mapping.items() if file_col})
+            missing_columns = [col for col in required_columns if col not in df.columns]
+            if missing_columns:
+                st.error(f"Still missing required columns: {', '.join(missing_columns)}")
+                st.stop()
+            st.success("Column mapping applied!" + (f" Saved as profile '{new_profile_name}'." if new_profile_name else ""))
+            
+        # Check the key columns for values that would group records wrongly
+        show_validation(validate_roster(df))
+        
+        # Dry run: estimate the impact without changing anything
+        with st.expander("Dry run: estimate merge impact before processing"):
+            sample_percent = st.slider("Share of the roster to analyse (%):", 1, 100, 100)
+            if st.button("Run Dry Run"):
+                with st.spinner("Estimating..."):
+                    estimate = dry_run(df, sample=sample_percent / 100, backend=backend)
+                show_dry_run(estimate)
+        
+        # Steps to run; switching them and processing again reuses the stages the runs share
+        col1, col2 = st.columns(2)
+        match_email = col1.checkbox("Match by email after matching by name", value=True)
+        remove_empty_ids = col2.checkbox("Remove records still without a Member Card ID", value=True)
+        
+        # Process button: run the merge as a background job and remember its ID in the URL
         if st.button("Process Data"):
-            with st.spinner("Processing data..."):
-                # STEP 1: Process by name
-                st.subheader("STEP 1: Processing by Name")
-                name_result_df, name_changes, name_stats = process_member_data_by_name(df)
-                
-                # STEP 2: Process by email
-                st.subheader("STEP 2: Processing by Email")
-                email_result_df, all_changes, email_stats = process_member_data_by_email(name_result_df, name_changes)
-                
-                # STEP 3: Remove records with empty Member Card IDs
-                st.subheader("STEP 3: Removing Records with Empty Member Card IDs")
-                final_result_df, removed_records, empty_id_stats = remove_empty_id_records(email_result_df)
-                
-                # Remove the helper column from the final result
-                if 'FullName' in final_result_df.columns:
-                    final_result_df = final_result_df.drop(columns=['FullName'])
-                
-                # Show statistics with three sections
-                st.subheader("Processing Results")
-                
-                # Name-based statistics
-                st.write("### Name-Based Deduplication")
-                col1, col2, col3 = st.columns(3)
-                col1.metric("Unique Names", name_stats["unique_names"])
-                col2.metric("Matches Found", name_stats["matches_found"])
-                col3.metric("IDs Copied", name_stats["ids_copied"])
-                st.metric("Records Removed", name_stats["records_removed"])
-                
-                # Email-based statistics
-                st.write("### Email-Based Deduplication")
-                col1, col2, col3 = st.columns(3)
-                col1.metric("Unique Emails", email_stats["unique_emails"])
-                col2.metric("Matches Found", email_stats["matches_found"])
-                col3.metric("IDs Copied", email_stats["ids_copied"])
-                st.metric("Records Removed", email_stats["records_removed"])
-                
-                # Empty ID removal statistics
-                st.write("### Empty ID Removal")
-                col1, col2 = st.columns(2)
-                col1.metric("Initial Records", empty_id_stats["total_records"])
-                col2.metric("Records with Empty IDs Removed", empty_id_stats["records_removed"])
-                
-                # Overall statistics
-                st.write("### Overall Results")
-                col1, col2 = st.columns(2)
-                total_records_removed = name_stats["records_removed"] + email_stats["records_removed"] + empty_id_stats["records_removed"]
-                col1.metric("Initial Records", name_stats["total_records"])
-                col2.metric("Final Records", name_stats["total_records"] - total_records_removed, f"-{total_records_removed}")
-                
-                # Show the changes made during ID matching
-                if all_changes:
-                    st.subheader("ID Matching Changes")
-                    
-                    # Convert to DataFrame for display
-                    changes_df = pd.DataFrame(all_changes)
-                    
-                    # Add a filter widget
-                    match_type = st.selectbox(
-                        "Filter by match type:", 
-                        ["All", "Name", "Email"]
-                    )
-                    
-                    if match_type == "All":
-                        filtered_df = changes_df
-                    else:
-                        filtered_df = changes_df[changes_df['match_type'] == match_type]
-                    
-                    st.dataframe(filtered_df)
-                    st.write(f"Showing {len(filtered_df)} changes out of {len(changes_df)} total changes.")
-                else:
-                    st.info("No matching profiles found to merge.")
-                
-                # Show records removed due to empty IDs
-                if removed_records:
-                    st.subheader("Records Removed (Empty Member Card IDs)")
-                    removed_df = pd.DataFrame(removed_records)
-                    st.dataframe(removed_df)
-                    st.write(f"Removed {len(removed_records)} records with empty Member Card IDs.")
-                else:
-                    st.info("No records with empty Member Card IDs found.")
-                
-                # Preview the result
-                st.subheader("Result Preview")
-                st.dataframe(final_result_df.head())
-                
-                # Download link
-                st.subheader("Download Processed Data")
-                filename = "processed_roster.xlsx"
-                
-                # Create an Excel writer using openpyxl
-                output = io.BytesIO()
-                with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                    final_result_df.to_excel(writer, index=False)
-                    
-                    # Access the worksheet
-                    worksheet = writer.sheets['Sheet1']
-                    
-                    # Find ID columns and format them as text
-                    id_columns = [i+1 for i, col in enumerate(final_result_df.columns) 
-                                if any(id_term in col.lower() for id_term in ['id', 'ggs', 'member', 'card'])]
-                    
-                    for col_idx in id_columns:
-                        for row in range(2, len(final_result_df) + 2):  # +2 for header and 1-based indexing
-                            cell = worksheet.cell(row=row, column=col_idx)
-                            cell.number_format = '@'  # Format as text
-                
-                # Get the download link
-                b64 = base64.b64encode(output.getvalue()).decode()
-                href = f'<a href="data:application/vnd.openxmlformats-officedocument.spreadsheetml.sheet;base64,{b64}" download="{filename}">Click here to download the processed Excel file</a>'
-                st.markdown(href, unsafe_allow_html=True)
+            job_id = get_job_queue().submit(process_roster, df, backend=backend, match_email=match_email,
+                                            remove_empty_ids=remove_empty_ids, source=uploaded_file.name)
+            st.query_params["job"] = job_id
     
     except Exception as e:
         st.error(f"An error occurred: {str(e)}")
         st.exception(e)
+
+# Show the current processing job, which survives page reloads until it expires
+if "job" in st.query_params:
+    show_job(st.query_params["job"])
@@ -0,0 +1,422 @@
+import pandas as pd
+import numpy as np
+
+from ShopRosterBackends import get_backend
+
+# Columns the merge steps need to find in a roster
+REQUIRED_COLUMNS = ['First Name', 'Last Name', 'Member Card ID', 'Email']
+
+# Column names containing any of these terms are treated as IDs and kept as text
+ID_TERMS = ['id', 'ggs', 'member', 'card']
+
+# Helper column holding each row's position in the input, used to gather the passthrough columns
+ROW_POSITION_COLUMN = '_row_position'
+
+# Rows looked at to decide whether a text column has few enough distinct values to store as a categorical
+COMPACT_SAMPLE_ROWS = 1000
+
+# Helper columns added during processing that never go into the export
+HELPER_COLUMNS = ['FullName', ROW_POSITION_COLUMN]
+
+# Match key columns that are stored as categorical codes while processing
+KEY_COLUMNS = ['Email']
+
+
+def is_id_column(col):
+    """Check whether a column name looks like it holds IDs"""
+    return any(id_term in str(col).lower() for id_term in ID_TERMS)
+
+
+def _report(progress, fraction, message):
+    """Send a progress update to the caller if it asked for one"""
+    if progress is not None:
+        progress(fraction, message)
+
+
+def _intern(values, normalize):
+    """Factorize values once and normalize only the unique ones.
+
+    Returns integer codes (-1 for missing) and the normalized unique strings,
+    so each distinct key is stored exactly once no matter how many rows use it.
+    """
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+    normalized = normalize(np.asarray(uniques, dtype=object))
+
+    # Different raw values can normalize to the same key ("Smith " and "smith")
+    key_codes, keys = pd.factorize(normalized)
+    if len(key_codes):
+        codes = np.where(codes >= 0, key_codes[codes], -1)
+    return codes, keys
+
+
+def _smallest_int(values, low, high):
+    """values in the smallest signed integer type holding low to high"""
+    for dtype in (np.int8, np.int16, np.int32):
+        if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+            return values.astype(dtype)
+    return values.astype(np.int64)
+
+
+def compact_column(series):
+    """Hold a column in the smallest form that gives back exactly the same values.
+
+    Text columns with repeated values become categoricals and whole numbers
+    (also whole floats with gaps) the smallest integer type that fits them.
+    Anything else is kept as it is.
+    """
+    if isinstance(series.dtype, pd.api.extensions.ExtensionDtype):
+        return series.array
+    values = series.to_numpy()
+    if not len(values):
+        return values
+    if series.dtype.kind == 'i':
+        return _smallest_int(values, values.min(), values.max())
+    if series.dtype.kind == 'f':
+        missing = np.isnan(values)
+        filled = np.where(missing, 0, values)
+        if (np.array_equal(filled, np.trunc(filled)) and not np.signbit(filled[filled == 0]).any()
+                and np.abs(filled).max() < 2 ** 31):
+            return pd.arrays.IntegerArray(_smallest_int(filled, filled.min(), filled.max()), missing)
+        return values
+    if series.dtype == object:
+        # A sample tells free text (notes, unique codes) and mixed values from repeated text cheaply
+        sample = values[:COMPACT_SAMPLE_ROWS]
+        if (pd.api.types.infer_dtype(sample, skipna=True) != 'string'
+                or len(sample) > 1 and len(pd.unique(sample)) > len(sample) // 2):
+            return values
+
+        # Missing cells come back as NaN, so only columns that use NaN for them qualify
+        codes, uniques = pd.factorize(values)
+        if (len(uniques) <= len(values) // 2 and pd.api.types.infer_dtype(uniques, skipna=True) == 'string'
+                and all(type(value) is float for value in values[codes < 0])):
+            return pd.Categorical.from_codes(codes, categories=uniques)
+    return values
+
+
+def expand_column(values, dtype):
+    """Turn values taken from a compact column back into the column's original type"""
+    if isinstance(values, pd.Categorical) and not isinstance(dtype, pd.CategoricalDtype):
+        return np.asarray(values, dtype=object)
+    if isinstance(values, pd.arrays.IntegerArray) and dtype.kind == 'f':
+        return values.to_numpy(dtype=dtype, na_value=np.nan)
+    return values.astype(dtype, copy=False)
+
+
+class PassthroughColumns:
+    """The columns the merge steps never look at, held aside while the key columns are merged.
+
+    They are stored once, compacted with compact_column, and the stages only
+    carry the row position of each record, so no stage copies them. gather()
+    takes the surviving rows once, for the export.
+    """
+
+    def __init__(self, df, key_positions):
+        self.columns = df.columns
+        self.key_positions = key_positions
+        self.positions = [i for i in range(df.shape[1]) if i not in set(key_positions)]
+        self.dtypes = [df.dtypes.iloc[i] for i in self.positions]
+        self.values = [compact_column(df.iloc[:, i]) for i in self.positions]
+
+    def gather(self, key_df, rows):
+        """Put the passthrough columns of the given input rows back next to the key columns, in input order"""
+        if not self.positions:
+            return key_df
+        columns = dict(zip(self.key_positions, (key_df.iloc[:, i].array for i in range(key_df.shape[1]))))
+        for position, values, dtype in zip(self.positions, self.values, self.dtypes):
+            columns[position] = expand_column(values[rows], dtype)
+        result = pd.DataFrame({position: columns[position] for position in range(len(self.columns))}, copy=False,
+                              index=key_df.index)
+        result.columns = self.columns
+        return result
+
+
+def split_passthrough(df):
+    """Split a roster into a frame of the columns the merge steps use and its passthrough columns.
+
+    The key frame carries each row's input position in a helper column, so
+    finalize_roster can gather the passthrough columns for the rows kept.
+    """
+    key_positions = [i for i, col in enumerate(df.columns) if col in REQUIRED_COLUMNS]
+    passthrough = PassthroughColumns(df, key_positions)
+    key_df = df.iloc[:, key_positions].copy()
+    key_df[ROW_POSITION_COLUMN] = np.arange(len(df), dtype=np.int64)
+    return key_df, passthrough
+
+
+def member_id_mask(df, backend=None):
+    """Mask of rows that have a Member Card ID, leaving the frame untouched"""
+    return pd.notna(get_backend(backend).blank_to_nan(df['Member Card ID'].to_numpy()))
+
+
+def normalize_member_ids(df, backend=None):
+    """Convert empty Member Card IDs to NaN and return the mask of rows that have one"""
+    # Convert empty strings AND whitespace-only strings to NaN
+    df['Member Card ID'] = get_backend(backend).blank_to_nan(df['Member Card ID'].to_numpy())
+    return df['Member Card ID'].notna().to_numpy()
+
+
+def name_key_codes(df, backend=None):
+    """Intern the normalized full name of every row as an integer id (-1 where a name part is missing).
+
+    Returns the ids and a function that spells out full names for a set of ids,
+    so the readable strings are only built for the groups that need them.
+    """
+    backend = get_backend(backend)
+    first_codes, first_names = _intern(df['First Name'], backend.clean_names)
+    last_codes, last_names = _intern(df['Last Name'], backend.clean_names)
+    first_names = np.asarray(first_names, dtype=object)
+    last_names = np.asarray(last_names, dtype=object)
+
+    # Rows missing either part of the name get no key
+    both = (first_codes >= 0) & (last_codes >= 0)
+    codes = np.full(len(df), -1, dtype=np.int32)
+    first_of = last_of = np.empty(0, dtype=np.int64)
+
+    if both.any():
+        # Combine first and last name codes into one integer per row
+        width = len(last_names)
+        pair_codes, pairs = pd.factorize(first_codes[both].astype(np.int64) * width + last_codes[both])
+
+        # Different splits can spell the same name ("mary" + "ann smith"), so
+        # compare the joined strings once per distinct pair and then drop them
+        full_names = pd.Series(first_names[pairs // width]) + ' ' + pd.Series(last_names[pairs % width])
+        name_codes, _ = pd.factorize(full_names)
+        codes[both] = name_codes[pair_codes]
+
+        # Remember one first/last pair per name id to spell it out later
+        first_seen = np.unique(name_codes, return_index=True)[1]
+        first_of = pairs[first_seen] // width
+        last_of = pairs[first_seen] % width
+
+    def spell(name_codes):
+        return (first_names[first_of[name_codes]] + ' ' + last_names[last_of[name_codes]]).tolist()
+
+    return codes, spell
+
+
+def build_name_keys(df, backend=None):
+    """Add the FullName match key as interned integer ids and return the function that spells them"""
+    codes, spell = name_key_codes(df, backend)
+    df['FullName'] = codes
+    return spell
+
+
+def email_key_codes(df, backend=None):
+    """Intern the normalized lowercase email of every row; returns the codes (-1 for none) and the emails"""
+    return _intern(df['Email'], get_backend(backend).clean_emails)
+
+
+def build_email_keys(df, backend=None):
+    """Normalize the Email column into a lowercase categorical match key"""
+    codes, emails = email_key_codes(df, backend)
+    df['Email'] = pd.Categorical.from_codes(codes, categories=pd.Index(emails, dtype=object))
+
+    def spell(email_codes):
+        return df['Email'].cat.categories.to_numpy()[email_codes].tolist()
+
+    return spell
+
+
+def _merge_on_key(df, codes, spell, match_type, progress, backend):
+    """Copy IDs across rows sharing a key and drop the rows the IDs came from"""
+    has_id = df['Member Card ID'].notna().to_numpy()
+
+    _report(progress, 0.3, f"Matching records by {match_type.lower()}...")
+    group_codes, no_id_pos, has_id_pos = backend.pair_within_groups(codes, has_id)
+
+    # Copy the IDs to the records without one
+    id_column = df.columns.get_loc('Member Card ID')
+    copied_ids = df['Member Card ID'].to_numpy()[has_id_pos]
+    if len(no_id_pos):
+        df.iloc[no_id_pos, id_column] = copied_ids
+
+    # Mark the source records for removal
+    keep = np.ones(len(df), dtype=bool)
+    keep[has_id_pos] = False
+
+    # Rebuild readable identifiers only for the change log
+    _report(progress, 0.8, "Building change log...")
+    labels = df.index.to_numpy()
+    identifiers = spell(group_codes)
+    changes = [
+        {
+            'match_type': match_type,
+            'identifier': identifier,
+            'no_id_row': no_id_label + 2,  # +2 for Excel row number
+            'has_id_row': has_id_label + 2,  # +2 for Excel row number
+            'id_copied': member_id
+        }
+        for identifier, no_id_label, has_id_label, member_id
+        in zip(identifiers, labels[no_id_pos].tolist(), labels[has_id_pos].tolist(), copied_ids)
+    ]
+
+    matches_found = len(np.unique(group_codes))
+    return df.take(np.flatnonzero(keep)), changes, matches_found
+
+
+def process_member_data_by_name(df, progress=None, backend=None):
+    """Process member data to merge IDs and remove duplicates based on names"""
+    # Track processing statistics
+    stats = {
+        "total_records": len(df),
+        "unique_names": 0,
+        "matches_found": 0,
+        "ids_copied": 0,
+        "records_removed": 0
+    }
+
+    backend = get_backend(backend)
+
+    # Create name keys for matching
+    _report(progress, 0.0, "Creating name keys for matching...")
+    spell = build_name_keys(df, backend)
+
+    # Handle empty Member Card IDs
+    has_id = normalize_member_ids(df, backend)
+    stats["records_with_id"] = int(has_id.sum())
+    stats["records_without_id"] = len(df) - stats["records_with_id"]
+
+    # Unique names include the missing name, like Series.unique() does
+    codes = df['FullName'].to_numpy()
+    stats["unique_names"] = int(codes.max(initial=-1)) + 1 + int((codes < 0).any())
+
+    result_df, changes, stats["matches_found"] = _merge_on_key(df, codes, spell, 'Name', progress, backend)
+    stats["ids_copied"] = len(changes)
+    stats["records_removed"] = len(df) - len(result_df)
+
+    _report(progress, 1.0, "Name matching complete")
+    return result_df, changes, stats
+
+
+def process_member_data_by_email(df, previous_changes, progress=None, backend=None):
+    """Process member data to merge IDs and remove duplicates based on emails"""
+    # Track processing statistics
+    stats = {
+        "total_records": len(df),
+        "unique_emails": 0,
+        "matches_found": 0,
+        "ids_copied": 0,
+        "records_removed": 0
+    }
+
+    # Normalize email addresses to lowercase keys, empty ones become NaN
+    backend = get_backend(backend)
+    _report(progress, 0.0, "Creating email keys for matching...")
+    spell = build_email_keys(df, backend)
+    normalize_member_ids(df, backend)
+
+    codes = df['Email'].cat.codes.to_numpy()
+    stats["unique_emails"] = len(np.unique(codes[codes >= 0]))
+
+    result_df, changes, stats["matches_found"] = _merge_on_key(df, codes, spell, 'Email', progress, backend)
+    stats["ids_copied"] = len(changes)
+    stats["records_removed"] = len(df) - len(result_df)
+
+    _report(progress, 1.0, "Email matching complete")
+
+    # Combine changes with previous changes
+    all_changes = previous_changes + changes
+
+    return result_df, all_changes, stats
+
+
+def removed_record_list(removed):
+    """Describe removed rows for the report by Excel row, name and email"""
+    return [
+        {
+            'row': idx + 2,  # +2 for Excel row number
+            'first_name': first_name,
+            'last_name': last_name,
+            'email': email
+        }
+        for idx, first_name, last_name, email in zip(
+            removed.index.tolist(), removed['First Name'], removed['Last Name'], removed['Email'])
+    ]
+
+
+def remove_empty_id_records(df, progress=None, backend=None):
+    """Remove records that still have empty Member Card ID fields"""
+    # Track processing statistics
+    stats = {
+        "total_records": len(df),
+        "records_removed": 0
+    }
+
+    _report(progress, 0.0, "Identifying records with empty Member Card IDs...")
+    has_id = normalize_member_ids(df, backend)
+    empty_ids = ~has_id
+
+    # Track records to be removed
+    removed_records = removed_record_list(df[empty_ids])
+    stats["records_removed"] = len(removed_records)
+
+    _report(progress, 1.0, "Empty ID removal complete")
+    return df.take(np.flatnonzero(has_id)), removed_records, stats
+
+
+def finalize_roster(df, passthrough=None):
+    """Turn categorical key columns back into plain text and drop helper columns for export.
+
+    With the passthrough columns split off by split_passthrough, they are
+    gathered for the remaining rows and put back in their places.
+    """
+    result_df = df.drop(columns=[col for col in HELPER_COLUMNS if col in df.columns])
+    for col in KEY_COLUMNS:
+        if col in result_df.columns and isinstance(result_df[col].dtype, pd.CategoricalDtype):
+            result_df[col] = result_df[col].astype(object).where(result_df[col].notna(), np.nan)
+    if passthrough is not None:
+        result_df = passthrough.gather(result_df, df[ROW_POSITION_COLUMN].to_numpy())
+    return result_df
+
+
+def run_pipeline(df, progress=None, backend=None):
+    """Run the name, email and empty-ID steps and collect everything the reports need.
+
+    The steps work on the key columns only; the other columns are set aside
+    and only gathered for the final roster.
+    """
+    backend = get_backend(backend)
+    df, passthrough = split_passthrough(df)
+
+    # Spread each step's progress over its third of the overall run
+    def step_progress(step):
+        if progress is None:
+            return None
+        return lambda fraction, message: progress((step + fraction) / 3, message)
+
+    # STEP 1: Process by name
+    name_result_df, name_changes, name_stats = process_member_data_by_name(df, step_progress(0), backend)
+
+    # STEP 2: Process by email
+    email_result_df, all_changes, email_stats = process_member_data_by_email(
+        name_result_df, name_changes, step_progress(1), backend)
+
+    # STEP 3: Remove records with empty Member Card IDs
+    final_result_df, removed_records, empty_id_stats = remove_empty_id_records(
+        email_result_df, step_progress(2), backend)
+
+    return {
+        'final_df': finalize_roster(final_result_df, passthrough),
+        'changes': all_changes,
+        'removed_records': removed_records,
+        'name_stats': name_stats,
+        'email_stats': email_stats,
+        'empty_id_stats': empty_id_stats
+    }
+
+
+def write_roster_excel(df, output, sheet_name='Sheet1'):
+    """Write a roster to an xlsx path or buffer with ID columns formatted as text"""
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        df.to_excel(writer, index=False, sheet_name=sheet_name)
+
+        # Access the worksheet
+        worksheet = writer.sheets[sheet_name]
+
+        # Find ID columns and format them as text
+        id_columns = [i + 1 for i, col in enumerate(df.columns) if is_id_column(col)]
+
+        for col_idx in id_columns:
+            for row in range(2, len(df) + 2):  # +2 for header and 1-based indexing
+                cell = worksheet.cell(row=row, column=col_idx)
+                cell.number_format = '@'  # Format as text
@@ -0,0 +1,135 @@
+import os
+import json
+import hashlib
+import tempfile
+
+from ShopRosterPipeline import REQUIRED_COLUMNS
+from ShopRosterReader import build_roster, read_cells
+
+# Environment variable that points at the profiles file
+PROFILES_ENV_VAR = 'SHOPROSTER_PROFILES'
+
+# Where profiles are kept when the environment variable is not set
+DEFAULT_PROFILES_PATH = os.path.join(os.path.expanduser('~'), '.shoproster', 'mapping_profiles.json')
+
+
+def profiles_path(path=None):
+    """Resolve the location of the profiles file"""
+    return path or os.environ.get(PROFILES_ENV_VAR) or DEFAULT_PROFILES_PATH
+
+
+def header_fingerprint(columns):
+    """Fingerprint a header row so the same export layout is recognized on every upload"""
+    names = sorted(str(col).strip().lower() for col in columns if str(col).strip())
+    return hashlib.sha1('\n'.join(names).encode('utf-8')).hexdigest()[:16]
+
+
+def load_profiles(path=None):
+    """Load all saved column-mapping profiles, keyed by profile name"""
+    path = profiles_path(path)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_profiles(profiles, path):
+    """Write the profiles file atomically so a crash never leaves it half written"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(profiles, f, indent=2, sort_keys=True)
+    os.replace(temp_path, path)
+
+
+def save_profile(name, mapping, columns, path=None):
+    """Save a mapping of required columns to file columns under a profile name"""
+    mapping = {req_col: file_col for req_col, file_col in mapping.items() if file_col}
+    if not name:
+        raise ValueError("A profile needs a name")
+    if not mapping:
+        raise ValueError("A profile needs at least one mapped column")
+
+    path = profiles_path(path)
+    profiles = load_profiles(path)
+    profiles[name] = {
+        'fingerprint': header_fingerprint(columns),
+        'mapping': mapping
+    }
+    _write_profiles(profiles, path)
+    return profiles[name]
+
+
+def delete_profile(name, path=None):
+    """Remove a saved profile if it exists"""
+    path = profiles_path(path)
+    profiles = load_profiles(path)
+    if profiles.pop(name, None) is not None:
+        _write_profiles(profiles, path)
+
+
+def missing_columns(columns):
+    """List the required columns a header does not have"""
+    return [col for col in REQUIRED_COLUMNS if col not in columns]
+
+
+def find_profile(columns, profiles=None, path=None):
+    """Pick the profile for a header row.
+
+    A profile saved for exactly this header wins. Otherwise the first profile
+    (by name) whose source columns all exist and that fills in every missing
+    required column is used. Returns (name, profile) or (None, None).
+    """
+    columns = [str(col) for col in columns]
+    missing = missing_columns(columns)
+    if not missing:
+        return None, None
+
+    profiles = load_profiles(path) if profiles is None else profiles
+    fingerprint = header_fingerprint(columns)
+    candidates = sorted(profiles.items(), key=lambda item: (item[1].get('fingerprint') != fingerprint, item[0]))
+
+    for name, profile in candidates:
+        mapping = profile.get('mapping', {})
+        if (all(file_col in columns for file_col in mapping.values())
+                and all(req_col in mapping for req_col in missing)):
+            return name, profile
+    return None, None
+
+
+def apply_mapping(columns, mapping):
+    """Rename header names according to a {required column: file column} mapping"""
+    renames = {file_col: req_col for req_col, file_col in mapping.items() if file_col}
+    return [renames.get(str(col), col) for col in columns]
+
+
+def roster_from_cells(rows, text_columns=(), mapping=None, path=None):
+    """Build a roster from raw cells, applying a column mapping before the schema is inferred.
+
+    With no explicit mapping, a saved profile is picked from the header.
+    Returns the roster, the name of the profile that was applied (if any) and
+    the mapping that was used.
+    """
+    profile_name = None
+
+    if rows:
+        if mapping is None:
+            profile_name, profile = find_profile(rows[0], path=path)
+            mapping = profile['mapping'] if profile else None
+        if mapping:
+            # Rename before the schema is inferred so mapped ID columns stay text
+            rows[0] = apply_mapping(rows[0], mapping)
+
+    return build_roster(rows, text_columns), profile_name, mapping
+
+
+def read_roster_with_profile(source, engine=None, mapping=None, path=None, sheet=0):
+    """Load a roster and apply a column mapping in the same single read.
+
+    With no explicit mapping, a saved profile is picked from the header.
+    Returns the roster and the name of the profile that was applied, if any.
+    """
+    rows, text_columns = read_cells(source, engine, sheet)
+    df, profile_name, _ = roster_from_cells(rows, text_columns, mapping, path)
+    return df, profile_name
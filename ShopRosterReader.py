@@ -0,0 +1,284 @@
+import os
+import zipfile
+import importlib.util
+from datetime import date, datetime, time, timedelta
+
+import pandas as pd
+import numpy as np
+from pandas.errors import EmptyDataError
+from pandas.io.parsers import TextParser
+
+try:
+    from python_calamine import CalamineError
+except ImportError:  # calamine is optional
+    CalamineError = None
+
+try:
+    from openpyxl.utils.exceptions import InvalidFileException
+except ImportError:
+    InvalidFileException = None
+
+try:
+    from xlrd import XLRDError
+except ImportError:
+    XLRDError = None
+
+from ShopRosterPipeline import is_id_column
+
+# Environment variable that picks the spreadsheet reader when none is passed in
+READER_ENV_VAR = 'SHOPROSTER_READER'
+
+# Reader engines in order of preference for automatic selection.
+# 'default' lets pandas pick openpyxl for xlsx and xlrd for xls. calamine reads
+# whitespace-only text cells as empty, which the merge treats the same way.
+READER_ENGINES = ['calamine', 'default']
+
+# Rows handed on at a time when a sheet is read in chunks
+DEFAULT_CHUNK_ROWS = 5000
+
+# Errors the readers raise for a file that is not a workbook they can read
+# (pandas raises ValueError when it cannot tell the format)
+UNREADABLE_FILE_ERRORS = tuple(error for error in (ValueError, zipfile.BadZipFile, CalamineError,
+                                                   InvalidFileException, XLRDError) if error is not None)
+
+
+def _calamine_available():
+    """Check for the Rust-backed calamine reader (needs python-calamine and pandas 2.2+)"""
+    if importlib.util.find_spec('python_calamine') is None:
+        return False
+    major, minor = (int(part) for part in pd.__version__.split('.')[:2])
+    return (major, minor) >= (2, 2)
+
+
+def available_readers():
+    """List the spreadsheet reader engines that can run in this environment"""
+    return [engine for engine in READER_ENGINES if engine != 'calamine' or _calamine_available()]
+
+
+def get_reader_engine(engine=None):
+    """Resolve a reader name (or 'auto') to the engine argument for pandas.
+
+    Passing None reads the SHOPROSTER_READER environment variable and falls back
+    to 'auto', which uses calamine when it is installed and openpyxl/xlrd otherwise.
+    """
+    name = (engine or os.environ.get(READER_ENV_VAR) or 'auto').lower()
+    if name == 'auto':
+        name = available_readers()[0]
+    if name not in READER_ENGINES:
+        raise ValueError(f"Unknown reader '{name}'. Choose from: {', '.join(['auto'] + READER_ENGINES)}")
+    if name not in available_readers():
+        raise ImportError(f"The '{name}' reader needs python-calamine and pandas 2.2 or newer")
+    return None if name == 'default' else name
+
+
+def _convert_openpyxl_cell(cell):
+    """Convert an openpyxl cell the same way pandas does when it reads xlsx"""
+    if cell.value is None:
+        return ''
+    elif cell.data_type == 'e':
+        return np.nan
+    elif cell.data_type == 'n':
+        value = int(cell.value)
+        return value if value == cell.value else float(cell.value)
+    return cell.value
+
+
+def _convert_calamine_cell(value):
+    """Convert a calamine cell the same way pandas does when it reads with calamine"""
+    if isinstance(value, float):
+        as_int = int(value)
+        return as_int if as_int == value else value
+    elif isinstance(value, (datetime, date)) and not isinstance(value, time):
+        return pd.Timestamp(value)
+    elif isinstance(value, timedelta):
+        return pd.Timedelta(value)
+    return value
+
+
+def _trim_row(values):
+    """Drop trailing empty cells like pandas does"""
+    while values and values[-1] == '':
+        values.pop()
+    return values
+
+
+def _openpyxl_rows(book, text_columns, sheet=0):
+    """Read cell values and note the columns formatted as text, in one pass over the sheet"""
+    sheet = book.worksheets[sheet] if isinstance(sheet, int) else book[sheet]
+    sheet.reset_dimensions()
+
+    for row_number, row in enumerate(sheet.rows):
+        values = [_convert_openpyxl_cell(cell) for cell in row]
+
+        # Numbers stored in cells formatted as text mark the column as text
+        if row_number > 0:
+            for col_idx, cell in enumerate(row):
+                if (cell.data_type == 'n' and cell.value is not None and cell.has_style
+                        and col_idx not in text_columns and cell.number_format == '@'):
+                    text_columns.add(col_idx)
+
+        yield _trim_row(values)
+
+
+def _calamine_rows(book, sheet=0):
+    """Read cell values row by row from one sheet"""
+    sheet = book.get_sheet_by_index(sheet) if isinstance(sheet, int) else book.get_sheet_by_name(sheet)
+
+    # Rows come back without the empty columns in front of the data
+    offset = [''] * (sheet.start or (0, 0))[1]
+    for row in sheet.iter_rows():
+        yield _trim_row(offset + [_convert_calamine_cell(value) for value in row])
+
+
+def sheet_names(source, engine=None):
+    """List the sheets of a workbook in order"""
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    with pd.ExcelFile(source, engine=get_reader_engine(engine)) as workbook:
+        return list(workbook.sheet_names)
+
+
+def iter_cell_chunks(source, engine=None, chunk_rows=DEFAULT_CHUNK_ROWS, text_columns=None, sheet=0):
+    """Read one sheet (the first by default) as lists of raw cell rows, chunk_rows at a time.
+
+    The workbook is opened once. openpyxl exposes number formats, and the
+    columns formatted as text are added to text_columns as they are found;
+    calamine and xlrd only give values, so none are reported for them. Rows
+    keep their trailing empty cells trimmed, and empty rows at the end of the
+    sheet are dropped.
+    """
+    if text_columns is None:
+        text_columns = set()
+    if hasattr(source, 'seek'):
+        source.seek(0)
+
+    with pd.ExcelFile(source, engine=get_reader_engine(engine)) as workbook:
+        if workbook.engine == 'openpyxl':
+            rows = _openpyxl_rows(workbook.book, text_columns, sheet)
+        elif workbook.engine == 'calamine':
+            rows = _calamine_rows(workbook.book, sheet)
+        else:
+            raw = workbook.parse(sheet_name=sheet, header=None, dtype=object, na_filter=False)
+            rows = (_trim_row(row) for row in raw.to_numpy().tolist())
+
+        chunk = []
+        empty_rows = []
+        for values in rows:
+            # Hold empty rows back until a row with data shows they are not trailing
+            if not values:
+                empty_rows.append(values)
+                continue
+            chunk.extend(empty_rows)
+            empty_rows = []
+            chunk.append(values)
+            if len(chunk) >= chunk_rows:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def pad_rows(rows):
+    """Extend rows to the widest one"""
+    width = max((len(row) for row in rows), default=0)
+    return [row + [''] * (width - len(row)) if len(row) < width else row for row in rows]
+
+
+def read_cells(source, engine=None, sheet=0):
+    """Read one sheet (the first by default) as raw cell values plus the columns formatted as text"""
+    text_columns = set()
+    rows = [row for chunk in iter_cell_chunks(source, engine, text_columns=text_columns, sheet=sheet)
+            for row in chunk]
+    return pad_rows(rows), text_columns
+
+
+class LongIdScan:
+    """Running check for columns holding whole numbers longer than 10 digits or zero-padded numbers.
+
+    Rows can be fed in chunks as they are read. A column drops out of the
+    scan as soon as one value settles it, so most columns are only looked at
+    for a few rows.
+    """
+
+    def __init__(self):
+        self._digits = {}
+        self._settled = {}
+
+    def update(self, rows):
+        """Scan another chunk of data rows"""
+        width = max((len(row) for row in rows), default=0)
+        for col_idx in range(width):
+            if col_idx in self._settled:
+                continue
+            total, count = self._digits.get(col_idx, (0, 0))
+            for row in rows:
+                value = row[col_idx] if col_idx < len(row) else ''
+                if isinstance(value, bool):
+                    self._settled[col_idx] = False
+                    break
+                if value is None or value == '' or value != value:
+                    continue
+                if isinstance(value, int):
+                    digits = len(str(abs(value)))
+                elif isinstance(value, str) and value.isdigit() and value.isascii():
+                    # Leading zeros would be lost if the column were read as numbers
+                    if len(value) > 1 and value[0] == '0':
+                        self._settled[col_idx] = True
+                        break
+                    digits = len(value)
+                else:
+                    self._settled[col_idx] = False
+                    break
+                total += digits
+                count += 1
+            self._digits[col_idx] = (total, count)
+
+    def holds_long_ids(self, col_idx):
+        """Whether everything scanned so far says the column holds long or zero-padded IDs"""
+        if col_idx in self._settled:
+            return self._settled[col_idx]
+        total, count = self._digits.get(col_idx, (0, 0))
+        return count > 0 and total / count > 10
+
+
+def column_schema(header, text_columns, scan):
+    """Map the column names that must be read as text to str"""
+    column_dtypes = {}
+    for col_idx, col in enumerate(header):
+        name = col if col != '' else f'Unnamed: {col_idx}'
+        if is_id_column(name) or col_idx in text_columns or scan.holds_long_ids(col_idx):
+            column_dtypes[name] = str
+    return column_dtypes
+
+
+def infer_schema(rows, text_columns=()):
+    """Decide which columns must be read as text, in a single scan of the raw cells.
+
+    A column is text when its name looks like an ID, when its cells are
+    formatted as text in the workbook, or when it holds long or zero-padded
+    whole numbers. Everything else is left to pandas' normal type inference.
+    """
+    if not rows:
+        return {}
+
+    scan = LongIdScan()
+    scan.update(rows[1:])
+    return column_schema(rows[0], text_columns, scan)
+
+
+def build_roster(rows, text_columns=(), column_dtypes=None):
+    """Build the roster frame from raw cells with the text columns already decided"""
+    if column_dtypes is None:
+        column_dtypes = infer_schema(rows, text_columns)
+
+    # Long IDs go straight from the cell values to text, never through floats
+    try:
+        return TextParser(rows, header=0, dtype=column_dtypes, skip_blank_lines=False).read()
+    except EmptyDataError:
+        return pd.DataFrame()
+
+
+def read_roster(source, engine=None):
+    """Load a roster spreadsheet, keeping ID columns as text to prevent scientific notation"""
+    rows, text_columns = read_cells(source, engine)
+    return build_roster(rows, text_columns)
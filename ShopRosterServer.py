@@ -0,0 +1,232 @@
+"""Headless HTTP service for roster processing.
+
+Run with:  python ShopRosterServer.py --port 8765
+
+POST an Excel roster to /process and the processed roster comes back as an
+xlsx download with the run statistics in the X-Roster-Stats header. Add
+?output=json to get the statistics, change log and removed records as JSON
+instead, and ?name=<file name> to label the run in the run history. GET
+/health reports whether the service is up.
+"""
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+import ShopRosterPipeline as pipeline
+from ShopRosterCache import RosterCache
+from ShopRosterHistory import record_run
+from ShopRosterJobs import JobQueue, json_safe
+from ShopRosterReader import UNREADABLE_FILE_ERRORS
+from ShopRosterStreaming import ExcelExport, process_roster_file
+
+# Size of the pieces uploads and downloads are streamed in
+CHUNK_SIZE = 64 * 1024
+
+# Uploads and outputs up to this size stay in memory, larger ones spill to disk
+SPOOL_SIZE = 16 * 1024 * 1024
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+def run_stats(result):
+    """Collect the per-step statistics of a pipeline result"""
+    return {
+        'name': result['name_stats'],
+        'email': result['email_stats'],
+        'empty_id': result['empty_id_stats'],
+        'final_records': len(result['final_df'])
+    }
+
+
+def process_upload(upload, reader=None, backend=None, cache=None, progress=None, source=None):
+    """Job body: load an uploaded roster, run the merge and write the output workbook.
+
+    Reading overlaps with key normalization, and the workbook is written on
+    background threads while the response payload is put together. Files
+    seen before are loaded from the roster cache. The run is added to the
+    run history under source.
+    """
+    output = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    try:
+        result = process_roster_file(upload, reader, backend, output=output, cache=cache, progress=progress)
+        result.pop('export').result().seek(0)
+        result['run_id'] = record_run(result, 'service', source)
+    except BaseException:
+        output.close()
+        raise
+    result['excel'] = output
+    return result
+
+
+class RosterRequestHandler(BaseHTTPRequestHandler):
+    """Routes /health and /process requests to the warm pipeline"""
+
+    server_version = 'ShopRosterServer/1.0'
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(json_safe(payload)).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        """Stream the request body into a spooled temporary file"""
+        upload = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            while True:
+                size = int(self.rfile.readline().split(b';')[0].strip(), 16)
+                if size == 0:
+                    # Skip any trailers up to the blank line
+                    while self.rfile.readline() not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                remaining = size
+                while remaining:
+                    chunk = self.rfile.read(min(remaining, CHUNK_SIZE))
+                    if not chunk:
+                        raise ValueError("Upload ended early")
+                    upload.write(chunk)
+                    remaining -= len(chunk)
+                self.rfile.readline()
+        else:
+            remaining = int(self.headers.get('Content-Length', 0))
+            while remaining:
+                chunk = self.rfile.read(min(remaining, CHUNK_SIZE))
+                if not chunk:
+                    raise ValueError("Upload ended early")
+                upload.write(chunk)
+                remaining -= len(chunk)
+
+        upload.seek(0)
+        return upload
+
+    def do_GET(self):
+        if urlparse(self.path).path == '/health':
+            self._send_json(200, {'status': 'ok', 'max_jobs': self.server.jobs.max_workers})
+        else:
+            self._send_json(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/process':
+            self._send_json(404, {'error': 'Not found'})
+            return
+
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            upload = self._read_body()
+        except ValueError as e:
+            self._send_json(400, {'error': str(e)})
+            return
+
+        if upload.seek(0, 2) == 0:
+            upload.close()
+            self._send_json(400, {'error': 'POST the roster file as the request body'})
+            return
+        upload.seek(0)
+
+        jobs = self.server.jobs
+        job_id = jobs.submit(process_upload, upload, reader=params.get('reader'), backend=params.get('backend'),
+                             cache=self.server.cache, source=params.get('name'))
+        try:
+            result = jobs.wait(job_id)
+        except UNREADABLE_FILE_ERRORS as e:
+            # The upload itself is the problem: not a readable workbook, or missing required columns
+            self._send_json(422, {'error': str(e)})
+            return
+        except Exception as e:
+            # Anything else failed on this side, so clients and monitoring can tell it apart from bad input
+            print(f"Processing failed: {(jobs.status(job_id) or {}).get('error') or e}", file=sys.stderr)
+            self._send_json(500, {'error': f"Processing failed: {e}"})
+            return
+        finally:
+            # The response carries the result, so the queue does not need to keep it
+            jobs.forget(job_id)
+            upload.close()
+
+        stats = run_stats(result)
+        output = result['excel']
+        try:
+            if params.get('output') == 'json':
+                self._send_json(200, {
+                    'stats': stats,
+                    'run_id': result['run_id'],
+                    'profile': result['profile'],
+                    'changes': result['changes'],
+                    'removed_records': result['removed_records']
+                })
+                return
+
+            # Stream the workbook back with the stats alongside it in a header
+            size = output.seek(0, 2)
+            output.seek(0)
+            self.send_response(200)
+            self.send_header('Content-Type', XLSX_CONTENT_TYPE)
+            self.send_header('Content-Disposition', 'attachment; filename="processed_roster.xlsx"')
+            self.send_header('Content-Length', str(size))
+            self.send_header('X-Roster-Stats', json.dumps(json_safe(stats), separators=(',', ':')))
+            self.end_headers()
+            shutil.copyfileobj(output, self.wfile, CHUNK_SIZE)
+        finally:
+            output.close()
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+def warm_up():
+    """Run a tiny roster through every step so lazy imports happen before the first request"""
+    df = pd.DataFrame({
+        'First Name': ['Pat', 'Pat'],
+        'Last Name': ['Lee', 'Lee'],
+        'Member Card ID': ['1', None],
+        'Email': ['pat@example.com', None]
+    })
+    result = pipeline.run_pipeline(df)
+    ExcelExport(result['final_df']).result()
+
+
+def make_server(host='127.0.0.1', port=8765, max_jobs=None, quiet=False):
+    """Create the HTTP server with its own bounded job queue"""
+    server = ThreadingHTTPServer((host, port), RosterRequestHandler)
+    server.daemon_threads = True
+    server.jobs = JobQueue(max_workers=max_jobs)
+    server.cache = RosterCache()
+    server.quiet = quiet
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the roster merge over HTTP")
+    parser.add_argument('--host', default='127.0.0.1', help="Interface to listen on (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8765, help="Port to listen on (default: 8765)")
+    parser.add_argument('--max-jobs', type=int, default=None, help="Merges to run at once (default: SHOPROSTER_MAX_JOBS or 2)")
+    parser.add_argument('--quiet', action='store_true', help="Do not log each request")
+    args = parser.parse_args()
+
+    warm_up()
+    server = make_server(args.host, args.port, args.max_jobs, args.quiet)
+    print(f"Serving roster processing on http://{args.host}:{server.server_port}/process")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.jobs.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+import io
+import queue
+import base64
+import threading
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, Side
+
+from ShopRosterBackends import MemoizedBackend
+from ShopRosterCheckpoints import run_pipeline_resumable
+from ShopRosterPipeline import is_id_column
+from ShopRosterProfiles import apply_mapping, find_profile, missing_columns
+from ShopRosterReader import DEFAULT_CHUNK_ROWS, LongIdScan, build_roster, column_schema, iter_cell_chunks, pad_rows
+
+# Chunks a stage may run ahead of the stage consuming them
+QUEUE_CHUNKS = 4
+
+# Rows handed to the workbook writer at a time
+EXPORT_CHUNK_ROWS = 2000
+
+# Key columns normalized while the file is still being read, with the backend method for each
+KEY_NORMALIZERS = {
+    'First Name': 'clean_names',
+    'Last Name': 'clean_names',
+    'Email': 'clean_emails',
+    'Member Card ID': 'blank_to_nan'
+}
+
+# Cell formats pandas uses for dates, kept so the output looks the same as before
+DATETIME_FORMAT = 'YYYY-MM-DD HH:MM:SS'
+DATE_FORMAT = 'YYYY-MM-DD'
+
+_THIN = Side(style='thin')
+HEADER_FONT = Font(bold=True)
+HEADER_BORDER = Border(left=_THIN, right=_THIN, top=_THIN, bottom=_THIN)
+HEADER_ALIGNMENT = Alignment(horizontal='center', vertical='top')
+
+_DONE = object()
+
+
+class _Failed:
+    """Carries an exception from a stage thread to the stage consuming its output"""
+
+    def __init__(self, error):
+        self.error = error
+
+
+def background(produce, maxsize=QUEUE_CHUNKS):
+    """Run a generator function on its own thread and iterate its output through a bounded queue.
+
+    The producer stays at most maxsize items ahead of the consumer. Errors are
+    raised in the consumer, and closing the iterator early stops the producer.
+    """
+    items = queue.Queue(maxsize)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def run():
+        produced = produce()
+        try:
+            for item in produced:
+                if not put(item):
+                    return
+            put(_DONE)
+        except BaseException as e:
+            put(_Failed(e))
+        finally:
+            produced.close()
+
+    threading.Thread(target=run, daemon=True).start()
+    try:
+        while True:
+            item = items.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failed):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+
+
+def _column_values(rows, col_idx, as_text):
+    """Pull one column out of a chunk of raw rows, with whole numbers as text for text columns"""
+    values = [row[col_idx] if col_idx < len(row) else '' for row in rows]
+    if as_text:
+        values = [str(value) if isinstance(value, int) and not isinstance(value, bool) else value
+                  for value in values]
+    return values
+
+
+def stream_roster(source, engine=None, mapping=None, path=None, backend=None, chunk_rows=DEFAULT_CHUNK_ROWS,
+                  cache=None):
+    """Load a roster with reading and key normalization overlapping.
+
+    A background thread decodes the sheet chunk by chunk. While it works on
+    the next chunk, this thread scans the last one for long IDs and
+    normalizes its names, emails and Member Card IDs into a memoized backend,
+    so the merge steps find most keys already worked out. Column mappings are
+    applied to the header like read_roster_with_profile does.
+
+    With a RosterCache, a file parsed before is loaded from the cache instead
+    and a new one is stored in it.
+
+    Returns the roster, the name of the profile that was applied (if any)
+    and the memoized backend to run the merge with.
+    """
+    memo = MemoizedBackend(backend)
+    if cache is not None and cache.enabled:
+        cache_key = cache.key(source, engine)
+        cached = cache.load(cache_key, mapping, path)
+        if cached is not None:
+            return cached + (memo,)
+
+    header = []
+    text_columns = set()
+    scan = LongIdScan()
+    rows = []
+    profile_name = None
+    key_columns = None
+
+    for chunk in background(lambda: iter_cell_chunks(source, engine, chunk_rows, text_columns)):
+        data = chunk
+        if key_columns is None:
+            header = list(chunk[0])
+            if mapping is None:
+                profile_name, profile = find_profile(chunk[0], path=path)
+                mapping = profile['mapping'] if profile else None
+            if mapping:
+                # Rename before the schema is decided so mapped ID columns stay text
+                chunk[0] = apply_mapping(chunk[0], mapping)
+            key_columns = [(chunk[0].index(col), method, is_id_column(col))
+                           for col, method in KEY_NORMALIZERS.items() if col in chunk[0]]
+            data = chunk[1:]
+
+        scan.update(data)
+        for col_idx, method, as_text in key_columns:
+            getattr(memo, method)(_column_values(data, col_idx, as_text))
+        rows.extend(chunk)
+
+    if rows:
+        rows = pad_rows(rows)
+        df = build_roster(rows, text_columns, column_schema(rows[0], text_columns, scan))
+    else:
+        df = build_roster(rows)
+
+    if cache is not None and cache.enabled:
+        cache.store(cache_key, header, mapping, df)
+    return df, profile_name, memo
+
+
+def _export_values(series):
+    """Turn a column into the Python values the workbook writer takes, with missing values left out"""
+    values = series.astype(object)
+    if series.dtype.kind == 'f':
+        # Infinite values are written as text, like pandas does
+        values = values.where(~np.isposinf(series), 'inf').where(~np.isneginf(series), '-inf')
+    return values.where(series.notna(), None).tolist()
+
+
+def _export_chunks(df, chunk_rows):
+    """Yield the rows of a frame as lists of tuples, chunk_rows at a time"""
+    for start in range(0, len(df), chunk_rows):
+        part = df.iloc[start:start + chunk_rows]
+        yield list(zip(*(_export_values(part.iloc[:, i]) for i in range(part.shape[1]))))
+
+
+def _excel_cell(sheet, value, number_format):
+    """Convert a value like pandas does for Excel, with a cell number format where one is needed"""
+    if isinstance(value, datetime):
+        number_format = number_format or DATETIME_FORMAT
+    elif isinstance(value, date):
+        number_format = number_format or DATE_FORMAT
+    elif isinstance(value, timedelta):
+        value = value.total_seconds() / 86400
+        number_format = number_format or '0'
+    elif value is not None and not isinstance(value, (str, int, float)):
+        value = str(value)
+
+    if number_format is None:
+        return value
+    cell = WriteOnlyCell(sheet, value=value)
+    cell.number_format = number_format
+    return cell
+
+
+def _write_sheet(book, df, sheet_name, chunk_rows):
+    """Stream one roster into a new sheet of a write-only workbook"""
+    sheet = book.create_sheet(sheet_name)
+
+    header = []
+    for col in df.columns:
+        cell = WriteOnlyCell(sheet, value=str(col))
+        cell.font = HEADER_FONT
+        cell.border = HEADER_BORDER
+        cell.alignment = HEADER_ALIGNMENT
+        header.append(cell)
+    sheet.append(header)
+
+    # Plain numbers and text go in as they are; ID cells and dates get a format
+    formats = ['@' if is_id_column(col) else None for col in df.columns]
+    plain = [fmt is None and dtype.kind in 'biuf' for fmt, dtype in zip(formats, df.dtypes)]
+    if all(plain):
+        for chunk in background(lambda: _export_chunks(df, chunk_rows)):
+            for row in chunk:
+                sheet.append(row)
+    else:
+        for chunk in background(lambda: _export_chunks(df, chunk_rows)):
+            for row in chunk:
+                sheet.append([value if is_plain else _excel_cell(sheet, value, fmt)
+                              for value, fmt, is_plain in zip(row, formats, plain)])
+
+
+def write_roster_rows(df, output, sheet_name='Sheet1', chunk_rows=EXPORT_CHUNK_ROWS):
+    """Write a roster to xlsx with ID columns formatted as text, streaming rows into the sheet.
+
+    A background thread turns the frame into plain rows chunk by chunk while
+    this thread serializes them, so the XML and zip compression work starts
+    on the first rows instead of after the whole frame has been converted.
+    The workbook holds the same values and formats as write_roster_excel.
+    """
+    write_roster_sheets({sheet_name: df}, output, chunk_rows)
+
+
+def write_roster_sheets(sheets, output, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Write several rosters to one xlsx, one sheet each in the order given, like write_roster_rows"""
+    book = Workbook(write_only=True)
+    for sheet_name, df in sheets.items():
+        _write_sheet(book, df, sheet_name, chunk_rows)
+    book.save(output)
+
+
+class _EncodingWriter:
+    """Write-only file wrapper that base64-encodes bytes as they pass through.
+
+    It has no seek, so the zip writer streams its entries straight through
+    instead of going back to patch headers.
+    """
+
+    def __init__(self, output):
+        self.output = output
+        self._written = 0
+        self._pending = b''
+        self._encoded = []
+
+    def write(self, data):
+        data = bytes(data)
+        self.output.write(data)
+        self._written += len(data)
+
+        # Encode whole 3-byte groups now and keep the rest for the next write
+        pending = self._pending + data
+        whole = len(pending) - len(pending) % 3
+        self._encoded.append(base64.b64encode(pending[:whole]))
+        self._pending = pending[whole:]
+        return len(data)
+
+    def tell(self):
+        return self._written
+
+    def flush(self):
+        self.output.flush()
+
+    def encoded(self):
+        return (b''.join(self._encoded) + base64.b64encode(self._pending)).decode('ascii')
+
+
+class ExcelExport:
+    """Writes a roster workbook on background threads while the caller carries on.
+
+    Start it as soon as the rows to keep are known, do other work (such as
+    indexing the change log) and collect the workbook with result(). With
+    encode=True the bytes are also base64-encoded as they are written, ready
+    for a download link. Pass a dict of sheet name to frame instead of a
+    frame to write several sheets.
+    """
+
+    def __init__(self, df, output=None, encode=False, sheet_name='Sheet1'):
+        self.output = io.BytesIO() if output is None else output
+        self._writer = _EncodingWriter(self.output) if encode else None
+        self._error = None
+        self._thread = threading.Thread(target=self._write, args=(df, sheet_name), daemon=True)
+        self._thread.start()
+
+    def _write(self, df, sheet_name):
+        try:
+            sheets = df if isinstance(df, dict) else {sheet_name: df}
+            write_roster_sheets(sheets, self._writer or self.output)
+        except BaseException as e:
+            self._error = e
+
+    def result(self, timeout=None):
+        """Wait for the workbook and return the output it was written to"""
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            raise TimeoutError("The workbook is still being written")
+        if self._error is not None:
+            raise self._error
+        return self.output
+
+    def encoded(self):
+        """The finished workbook as base64 text (needs encode=True)"""
+        self.result()
+        return self._writer.encoded()
+
+
+def process_roster_file(source, engine=None, backend=None, mapping=None, path=None, output=None,
+                        encode=False, cache=None, progress=None, memo=None):
+    """Read, merge and export a roster with the stages overlapping.
+
+    Stage results go to memo (see run_pipeline_resumable). Returns the
+    run_pipeline result plus the applied 'profile' and the 'export' that is
+    writing the output workbook, already started.
+    """
+    if progress is not None:
+        progress(0.0, "Reading roster...")
+    df, profile_name, memoized = stream_roster(source, engine, mapping, path, backend, cache=cache)
+
+    missing = missing_columns(df.columns)
+    if missing:
+        raise ValueError(f"Missing required columns: {', '.join(missing)}")
+
+    # Stages are checkpointed, so a retried upload resumes after a crash or restart
+    result = run_pipeline_resumable(df, progress=progress, backend=memoized, memo=memo)
+
+    # The rows to keep are known, so start writing them out right away
+    result['export'] = ExcelExport(result['final_df'], output, encode)
+    result['profile'] = profile_name
+    return result
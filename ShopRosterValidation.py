@@ -0,0 +1,122 @@
+import pandas as pd
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:  # pyarrow is optional; pandas' regex matching is used without it
+    pa = None
+
+from ShopRosterBackends import PYTHON_WHITESPACE
+from ShopRosterKeys import BLANK_VALUES
+
+# Whitespace and digits spelled out, since \s and \d in RE2 (pyarrow) only
+# cover ASCII while Python's re also takes Unicode whitespace (a non-breaking
+# space) and digits; both engines then flag exactly the same values. The
+# whitespace is what str.strip() removes, as in the merge steps.
+_WS = f'[{PYTHON_WHITESPACE}]'
+_NOT_WS = f'[^{PYTHON_WHITESPACE}]'
+_WS_BUT_SPACE = f"[{PYTHON_WHITESPACE.replace(' ', '')}]"
+_DIGIT = '[0-9]'
+
+# Checks run before processing: (rule, column, kind, pattern, what is wrong).
+# 'flag' rules flag values matching the pattern, 'require' rules flag values
+# that do not. Only non-blank distinct values of a column are looked at.
+VALIDATION_RULES = [
+    ('malformed_email', 'Email', 'require',
+     f'^{_WS}*[^@{PYTHON_WHITESPACE}]+@[^@{PYTHON_WHITESPACE}]+\\.[^@.{PYTHON_WHITESPACE}]+{_WS}*$',
+     "Not a valid email address; it will only match identical text"),
+    ('email_whitespace', 'Email', 'flag', f'^{_WS}|{_WS}$',
+     "Leading or trailing whitespace; the email merge will not match it to the trimmed address"),
+    ('decimal_id', 'Member Card ID', 'flag', f'^{_WS}*{_DIGIT}+\\.0+{_WS}*$',
+     "ID with a stray decimal (12345.0) from a number round-trip"),
+    ('scientific_id', 'Member Card ID', 'flag', f'^{_WS}*{_DIGIT}(?:\\.{_DIGIT}+)?[eE][+-]?{_DIGIT}+{_WS}*$',
+     "ID in scientific notation; digits were probably lost"),
+    ('id_whitespace', 'Member Card ID', 'flag', f'^{_WS}|{_WS}$',
+     "Leading or trailing whitespace around the ID"),
+    ('name_control_chars', 'First Name', 'flag', r'[\x00-\x1f\x7f-\x9f]',
+     "Control characters (tabs, line breaks) in the name; the name merge will not match it"),
+    ('name_control_chars', 'Last Name', 'flag', r'[\x00-\x1f\x7f-\x9f]',
+     "Control characters (tabs, line breaks) in the name; the name merge will not match it"),
+    ('name_inner_whitespace', 'First Name', 'flag', f'{_NOT_WS}(?:{_WS}{{2,}}|{_WS_BUT_SPACE}){_NOT_WS}',
+     "Repeated or unusual whitespace inside the name; the name merge will not match it"),
+    ('name_inner_whitespace', 'Last Name', 'flag', f'{_NOT_WS}(?:{_WS}{{2,}}|{_WS_BUT_SPACE}){_NOT_WS}',
+     "Repeated or unusual whitespace inside the name; the name merge will not match it"),
+]
+
+
+def _matches(text, pattern):
+    """Mask of the strings in text that match a regular expression anywhere"""
+    if pa is not None:
+        return pc.match_substring_regex(text, pattern).to_numpy(zero_copy_only=False)
+    return text.str.contains(pattern, regex=True).to_numpy(dtype=bool)
+
+
+def _is_blank(text):
+    """Mask of the strings the merge steps treat as missing, as blank_to_nan does"""
+    if pa is not None:
+        listed = pc.is_in(text, value_set=pa.array(BLANK_VALUES)).to_numpy(zero_copy_only=False)
+    else:
+        listed = text.isin(BLANK_VALUES).to_numpy(dtype=bool)
+    return _matches(text, f'^{_WS}*$') | listed
+
+
+def validate_roster(df, rules=None):
+    """Check the key columns for values that would make the merge steps group records wrongly.
+
+    Each column is factorized once and the rules only look at its distinct
+    text values; the flags are then spread back to the rows through the
+    codes, so the cost follows the number of distinct values rather than
+    rows. Columns the roster does not have are skipped.
+
+    Returns 'summary' (one row per rule and column with the number of
+    flagged rows) and 'flagged' (the Excel row, column, rule and value of
+    every flagged cell).
+    """
+    rules = VALIDATION_RULES if rules is None else rules
+    summary = []
+    flagged = []
+
+    by_column = {}
+    for rule, column, kind, pattern, description in rules:
+        by_column.setdefault(column, []).append((rule, kind, pattern, description))
+
+    for column, column_rules in by_column.items():
+        if column not in df.columns:
+            continue
+
+        codes, uniques = pd.factorize(df[column].to_numpy(dtype=object))
+        text = pd.Series(uniques, dtype=object).astype(str)
+        if pa is not None:
+            text = pa.array(text.to_numpy(), type=pa.string())
+
+        # Blank values ('', whitespace, 'nan', 'None') count as missing in the merge steps, so no rule applies to them
+        filled = ~_is_blank(text)
+        present = codes >= 0
+        counts = np.bincount(codes[present], minlength=len(uniques))
+        for rule, kind, pattern, description in column_rules:
+            bad = _matches(text, pattern)
+            bad = filled & (~bad if kind == 'require' else bad)
+            summary.append({
+                'rule': rule,
+                'column': column,
+                'rows_flagged': int(counts[bad].sum()),
+                'description': description
+            })
+            if not bad.any():
+                continue
+
+            rows = np.flatnonzero(present & bad[np.where(present, codes, 0)])
+            flagged.append(pd.DataFrame({
+                'row': np.asarray(df.index[rows]) + 2,
+                'column': column,
+                'rule': rule,
+                'value': np.asarray(uniques, dtype=object)[codes[rows]]
+            }))
+
+    summary = pd.DataFrame(summary, columns=['rule', 'column', 'rows_flagged', 'description'])
+    if flagged:
+        flagged = pd.concat(flagged, ignore_index=True).sort_values('row', kind='stable', ignore_index=True)
+    else:
+        flagged = pd.DataFrame(columns=['row', 'column', 'rule', 'value'])
+    return {'summary': summary, 'flagged': flagged}
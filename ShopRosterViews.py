@@ -0,0 +1,104 @@
+import math
+
+import pandas as pd
+import numpy as np
+
+# Rows shown per page unless the caller asks for something else
+DEFAULT_PAGE_SIZE = 50
+
+
+class RecordIndex:
+    """Index over a change log or removed-records list for server-side paging.
+
+    The records are loaded into one frame once. Searches run on lowercase
+    copies of the text columns built up front, and sort orders are computed
+    once per column and reused, so each view only filters with masks and
+    slices out the requested page.
+    """
+
+    def __init__(self, records, search_columns=(), row_columns=()):
+        self.frame = pd.DataFrame(records)
+        self.columns = self.frame.columns.tolist()
+        self.search_columns = [col for col in search_columns if col in self.frame.columns]
+        self.row_columns = [col for col in row_columns if col in self.frame.columns]
+
+        # Lowercase text once for substring search
+        self._search = {
+            col: self.frame[col].astype(str).str.lower().where(self.frame[col].notna(), '').to_numpy()
+            for col in self.search_columns
+        }
+        self._orders = {}
+
+    def __len__(self):
+        return len(self.frame)
+
+    def _order(self, sort_by, ascending):
+        """Row positions in sorted order, computed the first time they are needed"""
+        if sort_by is None:
+            return np.arange(len(self.frame))
+
+        key = (sort_by, ascending)
+        if key not in self._orders:
+            values = self.frame[sort_by]
+            if values.dtype == object:
+                # Mixed IDs and names sort as text, missing values last
+                values = values.astype(str).where(values.notna(), None)
+            ordered = values.reset_index(drop=True).sort_values(
+                ascending=ascending, kind='stable', na_position='last')
+            self._orders[key] = ordered.index.to_numpy()
+        return self._orders[key]
+
+    def values(self, column):
+        """Distinct values of a column, for filter choices"""
+        return self.frame[column].dropna().unique().tolist() if column in self.frame.columns else []
+
+    def query(self, equals=None, search=None, row_range=None, sort_by=None, ascending=True,
+              page=1, page_size=DEFAULT_PAGE_SIZE):
+        """Filter, sort and cut out one page of records.
+
+        equals:    {column: value} exact matches, 'All' or None to skip a column
+        search:    case-insensitive substring looked up in the search columns
+        row_range: (first, last) Excel rows; a record matches if any row column falls inside
+
+        Returns the page as a DataFrame, the number of matching records and
+        the number of pages.
+        """
+        mask = np.ones(len(self.frame), dtype=bool)
+
+        for column, value in (equals or {}).items():
+            if value not in (None, 'All'):
+                mask &= (self.frame[column] == value).to_numpy()
+
+        if search:
+            needle = search.strip().lower()
+            found = np.zeros(len(self.frame), dtype=bool)
+            for column in self.search_columns:
+                found |= pd.Series(self._search[column]).str.contains(needle, regex=False).to_numpy()
+            mask &= found
+
+        if row_range is not None and self.row_columns:
+            first, last = row_range
+            in_range = np.zeros(len(self.frame), dtype=bool)
+            for column in self.row_columns:
+                rows = self.frame[column].to_numpy()
+                in_range |= (rows >= first) & (rows <= last)
+            mask &= in_range
+
+        order = self._order(sort_by, ascending)
+        selected = order[mask[order]]
+
+        total = len(selected)
+        page_count = max(1, math.ceil(total / page_size))
+        page = min(max(1, page), page_count)
+        start = (page - 1) * page_size
+        return self.frame.iloc[selected[start:start + page_size]], total, page_count
+
+
+def build_change_index(changes):
+    """Index an ID matching change log for paging"""
+    return RecordIndex(changes, search_columns=['identifier', 'id_copied'], row_columns=['no_id_row', 'has_id_row'])
+
+
+def build_removed_index(removed_records):
+    """Index the records removed for empty IDs for paging"""
+    return RecordIndex(removed_records, search_columns=['first_name', 'last_name', 'email'], row_columns=['row'])
@@ -0,0 +1,300 @@
+"""Watch-folder daemon for roster exports.
+
+Run with:  python ShopRosterWatch.py /shared/pos-exports
+
+Every roster (xlsx, xls or csv) that appears or changes in the folder is run
+through the three merge steps once it has finished being written. The
+results go next to it: <name>_processed.xlsx (.csv for a CSV roster),
+<name>_changes.csv, <name>_removed.csv and <name>_stats.json. Libraries are
+loaded and warmed up once at start and the roster cache and stage memo stay
+warm between files, so each file only costs its own processing time.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+
+try:
+    from watchdog.observers import Observer
+except ImportError:  # watchdog is optional; the folder is polled without it
+    Observer = None
+
+from ShopRosterCache import RosterCache
+from ShopRosterCsv import process_csv_file, write_csv_records
+from ShopRosterHistory import record_run
+from ShopRosterJobs import JobQueue, json_safe
+from ShopRosterMerge import CHANGE_COLUMNS, REMOVED_COLUMNS
+from ShopRosterStreaming import ExcelExport, process_roster_file
+
+# Files the watcher picks up
+ROSTER_EXTENSIONS = ('.xlsx', '.xls', '.csv')
+
+# Suffixes of the files written next to each roster, which are never picked up themselves
+OUTPUT_SUFFIXES = ('_processed', '_changes', '_removed', '_stats')
+
+# Defaults: look at the folder every 5 seconds, and take a file as complete once it has not changed for 2
+DEFAULT_INTERVAL = 5.0
+DEFAULT_SETTLE = 2.0
+
+
+def is_roster_file(name):
+    """Whether a file in the folder is a roster to process rather than an output, lock or temporary file"""
+    stem, extension = os.path.splitext(name)
+    if extension.lower() not in ROSTER_EXTENSIONS or name.startswith(('.', '~$')):
+        return False
+    return not stem.endswith(OUTPUT_SUFFIXES)
+
+
+def output_paths(path):
+    """Where the processed roster and the reports for a roster go"""
+    stem, extension = os.path.splitext(path)
+    processed_extension = '.csv' if extension.lower() == '.csv' else '.xlsx'
+    return {
+        'processed': f'{stem}_processed{processed_extension}',
+        'changes': f'{stem}_changes.csv',
+        'removed': f'{stem}_removed.csv',
+        'stats': f'{stem}_stats.json'
+    }
+
+
+def is_up_to_date(path, stat=None):
+    """Whether a roster was processed after its last change; the stats file is written last, so it marks a finished run"""
+    stat = stat or os.stat(path)
+    try:
+        return os.stat(output_paths(path)['stats']).st_mtime_ns >= stat.st_mtime_ns
+    except OSError:
+        return False
+
+
+@contextmanager
+def _atomic(path):
+    """Yield a hidden temporary path next to path and move it into place once written"""
+    directory = os.path.dirname(os.path.abspath(path))
+    temp_path = os.path.join(directory, f'.{uuid.uuid4().hex}.tmp')
+    # Created like any new file (unlike mkstemp's private ones), so outputs in a shared folder get the usual permissions
+    open(temp_path, 'x').close()
+    try:
+        yield temp_path
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def process_file(path, cache=None, progress=None):
+    """Job body: merge one roster and write the processed roster and reports next to it.
+
+    Every output is written to a temporary file first, so other programs
+    never see half of one. The run is added to the run history. Returns the
+    stats written to the stats file.
+    """
+    outputs = output_paths(path)
+    start = time.perf_counter()
+    if path.lower().endswith('.csv'):
+        with _atomic(outputs['processed']) as processed_path:
+            result = process_csv_file(path, processed_path)
+        profile_name = None
+        final_records = len(result['rows'])
+    else:
+        with _atomic(outputs['processed']) as processed_path:
+            result = process_roster_file(path, output=processed_path, cache=cache, progress=progress)
+            result.pop('export').result()
+        profile_name = result['profile']
+        final_records = len(result['final_df'])
+
+    with _atomic(outputs['changes']) as changes_path:
+        write_csv_records(changes_path, result['changes'], CHANGE_COLUMNS)
+    with _atomic(outputs['removed']) as removed_path:
+        write_csv_records(removed_path, result['removed_records'], REMOVED_COLUMNS)
+
+    stats = json_safe({
+        'source': os.path.basename(path),
+        'run_id': record_run(result, 'watch', path),
+        'processed_at': datetime.now().isoformat(timespec='seconds'),
+        'seconds': round(time.perf_counter() - start, 3),
+        'profile': profile_name,
+        'name': result['name_stats'],
+        'email': result['email_stats'],
+        'empty_id': result['empty_id_stats'],
+        'final_records': final_records
+    })
+    with _atomic(outputs['stats']) as stats_path:
+        with open(stats_path, 'w', encoding='utf-8') as f:
+            json.dump(stats, f, indent=2)
+    return stats
+
+
+def warm_up():
+    """Run a tiny workbook through the same read, merge and write path the watched files take"""
+    df = pd.DataFrame({
+        'First Name': ['Pat', 'Pat'],
+        'Last Name': ['Lee', 'Lee'],
+        'Member Card ID': ['1', None],
+        'Email': ['pat@example.com', None]
+    })
+    workbook = ExcelExport(df).result()
+    workbook.seek(0)
+    process_roster_file(workbook).pop('export').result()
+
+
+class _Wake:
+    """Watchdog event handler that wakes the scan loop on any change in the folder"""
+
+    def __init__(self, event):
+        self.event = event
+
+    def dispatch(self, event):
+        self.event.set()
+
+
+class FolderWatcher:
+    """Watches one folder and processes each new or changed roster in it.
+
+    The folder is scanned every interval seconds, or as soon as watchdog
+    reports a change when it is installed. A file is processed once its size
+    and modification time have held still for settle seconds, so exports
+    still being copied in are left alone. Files run on a bounded job queue,
+    never more than one job per file; a file that changes while it is being
+    processed is processed again afterwards. Rosters whose stats file is
+    newer than they are were processed before and are skipped.
+    """
+
+    def __init__(self, folder, interval=DEFAULT_INTERVAL, settle=DEFAULT_SETTLE, max_jobs=None, cache=None,
+                 log=print):
+        self.folder = folder
+        self.interval = interval
+        self.settle = settle
+        self.jobs = JobQueue(max_workers=max_jobs)
+        self.cache = RosterCache() if cache is None else cache
+        self.log = log
+        self._pending = {}  # path: (size, mtime) when last seen, while waiting for it to settle
+        self._active = {}  # path: (job ID, (size, mtime) the job started from)
+        self._handled = {}  # path: (size, mtime) last processed or skipped
+        self._wake = threading.Event()
+        self._stopping = False
+
+    def _message(self, message, error=False):
+        line = f"{datetime.now():%Y-%m-%d %H:%M:%S} {message}"
+        if error:
+            print(line, file=sys.stderr)
+        elif self.log is not None:
+            self.log(line)
+
+    def _collect(self):
+        """Report the jobs that finished since the last scan"""
+        for path, (job_id, signature) in list(self._active.items()):
+            status = self.jobs.status(job_id)
+            if status is not None and status['status'] in ('queued', 'running'):
+                continue
+            del self._active[path]
+            self._handled[path] = signature
+            name = os.path.basename(path)
+            if status is not None and status['status'] == 'done':
+                stats = self.jobs.result(job_id)
+                self._message(f"Processed {name}: {stats['final_records']} records kept in {stats['seconds']:.2f}s")
+            else:
+                self._message(f"Failed to process {name}: {status['message'] if status else 'job expired'}", error=True)
+            self.jobs.forget(job_id)
+
+    def scan(self):
+        """Look at the folder once: report finished jobs and start jobs for files that are ready"""
+        self._collect()
+        now = time.time()
+        seen = set()
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if not is_roster_file(entry.name) or not entry.is_file():
+                    continue
+                path = entry.path
+                seen.add(path)
+                stat = entry.stat()
+                signature = (stat.st_size, stat.st_mtime_ns)
+                if path in self._active or self._handled.get(path) == signature:
+                    continue
+                if path not in self._handled and is_up_to_date(path, stat):
+                    self._handled[path] = signature
+                    continue
+                if self._pending.get(path) != signature or now - stat.st_mtime < self.settle:
+                    self._pending[path] = signature
+                    continue
+
+                del self._pending[path]
+                self._message(f"Processing {entry.name}...")
+                self._active[path] = (self.jobs.submit(process_file, path, cache=self.cache), signature)
+
+        # Forget files that were moved away or deleted
+        for known in (self._pending, self._handled):
+            for path in [path for path in known if path not in seen]:
+                del known[path]
+
+    @property
+    def busy(self):
+        """Whether files are waiting to settle or being processed"""
+        return bool(self._pending or self._active)
+
+    def run(self, once=False):
+        """Scan until stopped; with once=True, stop when the files present have been processed"""
+        observer = None
+        if Observer is not None and not once:
+            observer = Observer()
+            observer.schedule(_Wake(self._wake), self.folder, recursive=False)
+            observer.start()
+        try:
+            while not self._stopping:
+                self.scan()
+                if once and not self.busy:
+                    break
+                # Check back sooner while files are settling or running
+                self._wake.wait(min(self.settle, self.interval) if self.busy else self.interval)
+                self._wake.clear()
+        finally:
+            if observer is not None:
+                observer.stop()
+                observer.join()
+
+    def stop(self):
+        """Make run() return after the current scan"""
+        self._stopping = True
+        self._wake.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Process roster exports dropped into a folder")
+    parser.add_argument('folder', help="Folder to watch")
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL,
+                        help=f"Seconds between scans of the folder (default: {DEFAULT_INTERVAL:g})")
+    parser.add_argument('--settle', type=float, default=DEFAULT_SETTLE,
+                        help=f"Seconds a file must stay unchanged before it is processed (default: {DEFAULT_SETTLE:g})")
+    parser.add_argument('--max-jobs', type=int, default=None, help="Files to process at once (default: SHOPROSTER_MAX_JOBS or 2)")
+    parser.add_argument('--once', action='store_true', help="Process the files already there and exit")
+    parser.add_argument('--quiet', action='store_true', help="Only print errors")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.folder):
+        print(f"Error: {args.folder} is not a folder", file=sys.stderr)
+        return 1
+
+    warm_up()
+    watcher = FolderWatcher(args.folder, args.interval, args.settle, args.max_jobs,
+                            log=None if args.quiet else print)
+    if not args.quiet:
+        how = "notifications and polling" if Observer is not None and not args.once else "polling"
+        print(f"Watching {os.path.abspath(args.folder)} for rosters ({how})")
+    try:
+        watcher.run(once=args.once)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.jobs.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
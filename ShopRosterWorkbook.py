@@ -0,0 +1,202 @@
+import io
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from ShopRosterCrossMerge import merge_rosters
+from ShopRosterPipeline import _report, run_pipeline
+from ShopRosterProfiles import missing_columns, read_roster_with_profile
+from ShopRosterReader import sheet_names
+from ShopRosterStreaming import ExcelExport
+
+# Environment variable capping the worker processes sheets are processed in
+SHEET_WORKERS_ENV_VAR = 'SHOPROSTER_SHEET_WORKERS'
+
+# Worker pool kept between workbooks, as (size, executor)
+_pool = None
+_pool_lock = threading.Lock()
+
+# Statistics that add up over sheets processed one by one
+STAT_KEYS = {
+    'name_stats': ['total_records', 'unique_names', 'matches_found', 'ids_copied', 'records_removed',
+                   'records_with_id', 'records_without_id'],
+    'email_stats': ['total_records', 'unique_emails', 'matches_found', 'ids_copied', 'records_removed'],
+    'empty_id_stats': ['total_records', 'records_removed']
+}
+
+
+def sheet_workers(sheet_count, workers=None):
+    """Number of worker processes for a workbook: one per sheet, up to the CPU count or SHOPROSTER_SHEET_WORKERS"""
+    workers = workers or int(os.environ.get(SHEET_WORKERS_ENV_VAR, 0)) or os.cpu_count() or 1
+    return max(1, min(workers, sheet_count))
+
+
+def _workbook_data(source):
+    """The workbook as something every worker process can open: its path or its bytes"""
+    if isinstance(source, (str, bytes, os.PathLike)):
+        return source
+    source.seek(0)
+    return source.read()
+
+
+def _open(data):
+    return io.BytesIO(data) if isinstance(data, bytes) else data
+
+
+def _read_sheet(data, sheet, engine, mapping, path):
+    """Worker: decode one sheet into a roster, with the column mapping or a saved profile applied"""
+    df, profile_name = read_roster_with_profile(_open(data), engine, mapping, path, sheet)
+    missing = missing_columns(df.columns)
+    if missing:
+        raise ValueError(f"Sheet '{sheet}' is missing required columns: {', '.join(missing)}")
+    return df, profile_name
+
+
+def _process_sheet(data, sheet, engine, mapping, path, backend):
+    """Worker: decode one sheet and run the three merge steps on it alone"""
+    df, profile_name = _read_sheet(data, sheet, engine, mapping, path)
+    return run_pipeline(df, backend=backend), profile_name
+
+
+def _process_pool(workers):
+    """Worker processes shared by every workbook, so only the first one waits for them to start.
+
+    Workers are forked from a server that has already imported this module
+    and pandas, which is safe in a threaded server like Streamlit where plain
+    forking is not. The pool is rebuilt when a different size is asked for.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool[0] != workers:
+            _pool[1].shutdown(wait=False)
+            _pool = None
+        if _pool is None:
+            if 'forkserver' in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context('forkserver')
+                context.set_forkserver_preload([__name__])
+            else:
+                context = multiprocessing.get_context('spawn')
+            _pool = (workers, ProcessPoolExecutor(workers, mp_context=context))
+        return _pool[1]
+
+
+def _discard_pool(pool):
+    """Drop a pool one of whose workers died, so the next workbook gets a new one"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool[1] is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def _run_sheets(task, data, sheets, args, workers, progress, share):
+    """Run task(data, sheet, *args) for every sheet, in worker processes when there is more than one.
+
+    Returns the results in sheet order and reports progress over the first
+    share of the run as sheets finish.
+    """
+    results = {}
+    workers = sheet_workers(len(sheets), workers)
+    if workers == 1:
+        for done, sheet in enumerate(sheets, start=1):
+            results[sheet] = task(data, sheet, *args)
+            _report(progress, share * done / len(sheets), f"Processed sheet '{sheet}' ({done} of {len(sheets)})")
+    else:
+        # A worker that died (killed, out of memory) breaks the whole pool; the
+        # sheets not finished yet are run once more on a new one
+        for attempt in range(2):
+            pool = _process_pool(workers)
+            try:
+                futures = {pool.submit(task, data, sheet, *args): sheet for sheet in sheets if sheet not in results}
+                for future in as_completed(futures):
+                    results[futures[future]] = future.result()
+                    _report(progress, share * len(results) / len(sheets),
+                            f"Processed sheet '{futures[future]}' ({len(results)} of {len(sheets)})")
+                break
+            except BrokenProcessPool:
+                _discard_pool(pool)
+                if attempt:
+                    raise
+    return {sheet: results[sheet] for sheet in sheets}
+
+
+def _sheet_result(sheet, result):
+    """Describe one sheet's run the way merge_rosters describes each file"""
+    changes = [
+        {
+            'match_type': change['match_type'],
+            'identifier': change['identifier'],
+            'no_id_file': sheet,
+            'no_id_row': change['no_id_row'],
+            'has_id_file': sheet,
+            'has_id_row': change['has_id_row'],
+            'id_copied': change['id_copied']
+        }
+        for change in result['changes']
+    ]
+    removed_records = [dict(record, file=sheet) for record in result['removed_records']]
+    stats = {
+        'total_records': result['name_stats']['total_records'],
+        'ids_received': len(changes),
+        'records_merged_away': len(changes),
+        'empty_id_removed': len(removed_records),
+        'final_records': len(result['final_df'])
+    }
+    return {'final_df': result['final_df'], 'removed_records': removed_records, 'stats': stats}, changes
+
+
+def process_workbook(source, sheets=None, combined=False, engine=None, backend=None, mapping=None, path=None,
+                     output=None, encode=False, workers=None, progress=None):
+    """Process several sheets of one workbook, each sheet in its own worker process.
+
+    sheets picks the sheets by name (all of them by default). With
+    combined=False every sheet is decoded and merged on its own in a worker;
+    with combined=True the workers decode the sheets and duplicates are then
+    resolved across all of them with merge_rosters, sheets taking the place
+    of files. Column mappings and saved profiles apply per sheet.
+
+    Returns results shaped like merge_rosters, keyed by sheet name under
+    'files', with the applied 'profiles' and the 'export' that is writing
+    one workbook holding a processed sheet per selected sheet, in workbook
+    order, with ID columns formatted as text.
+    """
+    data = _workbook_data(source)
+    names = sheet_names(_open(data), engine)
+    if sheets is None:
+        sheets = names
+    unknown = [sheet for sheet in sheets if sheet not in names]
+    if unknown:
+        raise ValueError(f"The workbook has no sheet named {', '.join(map(repr, unknown))}")
+    sheets = [sheet for sheet in names if sheet in sheets]
+    if not sheets:
+        raise ValueError("No sheets selected")
+
+    if combined:
+        _report(progress, 0.0, "Reading sheets...")
+        read = _run_sheets(_read_sheet, data, sheets, (engine, mapping, path), workers, progress, 0.5)
+        result = merge_rosters({sheet: df for sheet, (df, _) in read.items()},
+                               progress=lambda fraction, message: _report(progress, 0.5 + fraction / 2, message),
+                               backend=backend)
+        profiles = {sheet: profile_name for sheet, (_, profile_name) in read.items()}
+    else:
+        _report(progress, 0.0, "Processing sheets...")
+        processed = _run_sheets(_process_sheet, data, sheets, (engine, mapping, path, backend), workers, progress,
+                                1.0)
+        result = {'files': {}, 'changes': [], 'removed_records': []}
+        result.update({name: dict.fromkeys(keys, 0) for name, keys in STAT_KEYS.items()})
+        profiles = {}
+        for sheet, (sheet_result, profile_name) in processed.items():
+            result['files'][sheet], changes = _sheet_result(sheet, sheet_result)
+            result['changes'].extend(changes)
+            result['removed_records'].extend(result['files'][sheet]['removed_records'])
+            for name, keys in STAT_KEYS.items():
+                for key in keys:
+                    result[name][key] += sheet_result[name][key]
+            profiles[sheet] = profile_name
+
+    result['profiles'] = {sheet: profile_name for sheet, profile_name in profiles.items() if profile_name}
+    result['export'] = ExcelExport({sheet: file_result['final_df'] for sheet, file_result in result['files'].items()},
+                                   output, encode)
+    return result
@@ -0,0 +1,164 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import ShopRosterCheckpoints
+from ShopRosterCheckpoints import StageMemo, frame_checksum, checkpoint_path, run_pipeline_resumable
+from ShopRosterPipeline import run_pipeline
+
+
+class Crash(Exception):
+    pass
+
+
+def _roster(size=300, seed=7):
+    rng = np.random.default_rng(seed)
+    first = rng.choice(['Pat', 'Sam', 'Jo', 'Lee', 'Kim', 'Alex'], size)
+    last = rng.choice(['Smith', 'Park', 'Jones', 'Brown'], size)
+    ids = np.where(rng.random(size) < 0.4, [str(100000 + i) for i in range(size)], None)
+    emails = np.where(rng.random(size) < 0.7, [f'member{i % 40}@example.com' for i in range(size)], None)
+    return pd.DataFrame({'First Name': first, 'Last Name': last, 'Member Card ID': ids, 'Email': emails,
+                         'Notes': [f'note {i}' for i in range(size)]})
+
+
+def _assert_same_run(expected, actual):
+    pd.testing.assert_frame_equal(expected['final_df'], actual['final_df'])
+    assert expected['changes'] == actual['changes']
+    assert expected['removed_records'] == actual['removed_records']
+    for key in ('name_stats', 'email_stats', 'empty_id_stats'):
+        assert expected[key] == actual[key]
+
+
+@pytest.fixture(autouse=True)
+def checkpoint_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv('SHOPROSTER_CHECKPOINT_DIR', str(tmp_path))
+    return tmp_path
+
+
+# The stage each crash happens in, and the last stage completed before it
+CRASH_POINTS = [
+    ('process_member_data_by_name', 'normalized'),
+    ('process_member_data_by_email', 'name'),
+    ('remove_empty_id_records', 'email'),
+    ('finalize_roster', 'empty_id'),
+]
+
+
+@pytest.mark.parametrize('crashing, completed', CRASH_POINTS)
+def test_resume_after_a_crash_matches_a_clean_run(monkeypatch, crashing, completed):
+    df = _roster()
+    expected = run_pipeline(df.copy())
+
+    def crash(*args, **kwargs):
+        raise Crash()
+
+    with monkeypatch.context() as patch:
+        patch.setattr(ShopRosterCheckpoints, crashing, crash)
+        with pytest.raises(Crash):
+            run_pipeline_resumable(df.copy(), memo=StageMemo(0))
+
+    messages = []
+    actual = run_pipeline_resumable(df.copy(), memo=StageMemo(0),
+                                    progress=lambda fraction, message: messages.append(message))
+    _assert_same_run(expected, actual)
+    assert f"Resuming after the {completed} stage..." in messages
+
+
+def test_checkpoint_is_removed_after_a_completed_run():
+    df = _roster()
+    run_pipeline_resumable(df.copy(), memo=StageMemo(0))
+    assert ShopRosterCheckpoints.load_checkpoint(checkpoint_path(frame_checksum(df))) is None
+
+
+def test_checkpoint_of_another_roster_is_ignored(monkeypatch):
+    df = _roster()
+    changed = df.copy()
+    changed.loc[0, 'First Name'] = 'Robin'
+
+    def crash(*args, **kwargs):
+        raise Crash()
+
+    # Both rosters share one checkpoint file, as a roster edited between runs would
+    path = checkpoint_path(frame_checksum(df))
+    with monkeypatch.context() as patch:
+        patch.setattr(ShopRosterCheckpoints, 'process_member_data_by_email', crash)
+        with pytest.raises(Crash):
+            run_pipeline_resumable(df.copy(), path=path, memo=StageMemo(0))
+
+    messages = []
+    actual = run_pipeline_resumable(changed.copy(), path=path, memo=StageMemo(0),
+                                    progress=lambda fraction, message: messages.append(message))
+    _assert_same_run(run_pipeline(changed.copy()), actual)
+    assert "The roster changed since the last checkpoint; starting over" in messages
+
+
+def _entry(size):
+    return {'chain': ['normalized'], 'stats': {}, 'changes': [], 'arrays': {'mask': np.zeros(size, dtype=np.uint8)}}
+
+
+def test_memo_evicts_least_recently_used_within_the_byte_limit():
+    memo = StageMemo(max_entries=10, max_bytes=1000)
+    for i in range(3):
+        memo.put(f'roster{i}', ['normalized'], _entry(300))
+    assert memo.get('roster0', ['normalized']) is not None
+
+    memo.put('roster3', ['normalized'], _entry(300))
+    assert memo.size <= memo.max_bytes
+    assert memo.get('roster1', ['normalized']) is None
+    assert all(memo.get(f'roster{i}', ['normalized']) is not None for i in (0, 2, 3))
+
+
+def test_memo_drops_an_entry_bigger_than_the_byte_limit():
+    memo = StageMemo(max_entries=10, max_bytes=1000)
+    memo.put('small', ['normalized'], _entry(300))
+    memo.put('big', ['normalized'], _entry(2000))
+    assert memo.get('big', ['normalized']) is None
+    assert memo.get('small', ['normalized']) is not None
+    assert memo.size <= memo.max_bytes
+
+
+def test_memo_evicts_past_the_entry_limit():
+    memo = StageMemo(max_entries=2, max_bytes=10 ** 6)
+    for i in range(3):
+        memo.put(f'roster{i}', ['normalized'], _entry(10))
+    assert len(memo) == 2
+    assert memo.get('roster0', ['normalized']) is None
+
+
+def test_memo_stays_within_the_byte_limit_over_runs():
+    # Each run stores four stages of roughly 40-60 KB together, so the later runs evict the earlier ones
+    memo = StageMemo(max_entries=100, max_bytes=200000)
+    for seed in range(5):
+        df = _roster(seed=seed)
+        run_pipeline_resumable(df.copy(), memo=memo)
+        assert 0 < memo.size <= memo.max_bytes
+        assert memo.size == sum(ShopRosterCheckpoints._entry_size(entry) for entry in memo._entries.values())
+        assert memo.get(frame_checksum(df), ShopRosterCheckpoints.stage_chain()) is not None
+    assert len(memo) < 5 * 4
+
+
+def test_memo_reruns_only_the_stages_after_a_changed_option(monkeypatch):
+    df = _roster()
+    memo = StageMemo()
+    runs = {'name': 0, 'email': 0}
+
+    def counting(stage, step):
+        def run(*args, **kwargs):
+            runs[stage] += 1
+            return step(*args, **kwargs)
+        return run
+
+    monkeypatch.setattr(ShopRosterCheckpoints, 'process_member_data_by_name',
+                        counting('name', ShopRosterCheckpoints.process_member_data_by_name))
+    monkeypatch.setattr(ShopRosterCheckpoints, 'process_member_data_by_email',
+                        counting('email', ShopRosterCheckpoints.process_member_data_by_email))
+
+    full = run_pipeline_resumable(df.copy(), memo=memo)
+    name_only = run_pipeline_resumable(df.copy(), memo=memo, match_email=False)
+    without_removal = run_pipeline_resumable(df.copy(), memo=memo, remove_empty_ids=False)
+    assert runs == {'name': 1, 'email': 1}
+
+    _assert_same_run(run_pipeline(df.copy()), full)
+    assert name_only['email_stats'] is None
+    assert without_removal['empty_id_stats'] is None
+    assert without_removal['removed_records'] == []
@@ -0,0 +1,98 @@
+import io
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pandas as pd
+import pytest
+
+import ShopRosterServer
+from ShopRosterServer import make_server
+
+
+def _roster_bytes(df):
+    output = io.BytesIO()
+    df.to_excel(output, index=False)
+    return output.getvalue()
+
+
+def _roster():
+    return pd.DataFrame({
+        'First Name': ['Pat', 'Pat', 'Sam', 'Jo'],
+        'Last Name': ['Lee', 'Lee', 'Kim', 'Park'],
+        'Member Card ID': ['1001', None, None, '1003'],
+        'Email': ['pat@example.com', 'pat@example.com', 'sam@example.com', 'jo@example.com']
+    })
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.setenv('SHOPROSTER_HISTORY', str(tmp_path / 'history.sqlite'))
+    monkeypatch.setenv('SHOPROSTER_CACHE_DIR', str(tmp_path / 'cache'))
+    server = make_server(port=0, max_jobs=1, quiet=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+    server.server_close()
+    server.jobs.shutdown()
+
+
+def _request(url, data=None):
+    """Status, headers and body of a request, whether or not it succeeded"""
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=data)) as response:
+            return response.status, response.headers, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers, e.read()
+
+
+def test_health(server):
+    status, _, body = _request(f'{server}/health')
+    assert status == 200
+    assert json.loads(body)['status'] == 'ok'
+
+
+def test_process_returns_the_processed_workbook(server):
+    status, headers, body = _request(f'{server}/process?name=roster.xlsx', _roster_bytes(_roster()))
+
+    assert status == 200
+    stats = json.loads(headers['X-Roster-Stats'])
+    assert stats['name']['matches_found'] == 1
+    assert stats['empty_id']['records_removed'] == 1
+    processed = pd.read_excel(io.BytesIO(body), dtype=str)
+    assert processed['Member Card ID'].tolist() == ['1001', '1003']
+
+
+def test_process_json_output(server):
+    status, _, body = _request(f'{server}/process?output=json', _roster_bytes(_roster()))
+
+    assert status == 200
+    payload = json.loads(body)
+    assert payload['run_id'] is not None
+    assert [change['id_copied'] for change in payload['changes']] == ['1001']
+    assert [record['first_name'] for record in payload['removed_records']] == ['Sam']
+
+
+def test_bad_uploads_are_422(server):
+    status, _, body = _request(f'{server}/process', b'not a workbook')
+    assert status == 422
+
+    status, _, body = _request(f'{server}/process', _roster_bytes(pd.DataFrame({'Name': ['Pat']})))
+    assert status == 422
+    assert 'Missing required columns' in json.loads(body)['error']
+
+
+def test_internal_errors_are_500(server, monkeypatch):
+    def fail(*args, **kwargs):
+        raise MemoryError("out of memory")
+
+    monkeypatch.setattr(ShopRosterServer, 'process_roster_file', fail)
+    status, _, body = _request(f'{server}/process', _roster_bytes(_roster()))
+    assert status == 500
+    assert 'out of memory' in json.loads(body)['error']
+
+
+def test_unknown_path_is_404(server):
+    assert _request(f'{server}/nothing')[0] == 404
@@ -0,0 +1,53 @@
+import pandas as pd
+import pytest
+
+import ShopRosterValidation
+from ShopRosterValidation import validate_roster
+
+
+def _unicode_roster():
+    return pd.DataFrame({
+        'First Name': ['Di\xa0Ed', 'Pat', 'Jo  Ann', 'Lee'],
+        'Last Name': ['Lee', 'Kim　', '\xa0', 'Park'],
+        'Member Card ID': ['4\xa0', '١٢.0', '12.0 ', None],
+        'Email': ['x@y.com\x0b', '\xa0', 'pat@example.com', 'a\xa0b@c.org']
+    })
+
+
+def test_pyarrow_and_pandas_flag_the_same_values(monkeypatch):
+    pytest.importorskip('pyarrow')
+    df = _unicode_roster()
+    with_pyarrow = validate_roster(df)
+    monkeypatch.setattr(ShopRosterValidation, 'pa', None)
+    without_pyarrow = validate_roster(df)
+
+    pd.testing.assert_frame_equal(with_pyarrow['summary'], without_pyarrow['summary'])
+    pd.testing.assert_frame_equal(with_pyarrow['flagged'], without_pyarrow['flagged'])
+
+
+def test_unicode_whitespace_counts_as_whitespace(monkeypatch):
+    monkeypatch.setattr(ShopRosterValidation, 'pa', None)
+    summary = validate_roster(_unicode_roster())['summary'].set_index(['rule', 'column'])['rows_flagged']
+
+    assert summary['email_whitespace', 'Email'] == 1
+    assert summary['malformed_email', 'Email'] == 1
+    assert summary['id_whitespace', 'Member Card ID'] == 2
+    assert summary['decimal_id', 'Member Card ID'] == 1
+    assert summary['name_inner_whitespace', 'First Name'] == 2
+
+
+def test_values_the_merge_treats_as_missing_are_not_flagged(monkeypatch):
+    df = pd.DataFrame({
+        'First Name': ['Pat', 'Sam', 'Jo'],
+        'Last Name': ['Lee', 'Kim', 'Park'],
+        'Member Card ID': ['nan', 'None', ' '],
+        'Email': ['None', 'nan', '\xa0']
+    })
+    for engine in ('pyarrow', 'pandas'):
+        if engine == 'pandas':
+            monkeypatch.setattr(ShopRosterValidation, 'pa', None)
+        elif ShopRosterValidation.pa is None:
+            continue
+        result = validate_roster(df)
+        assert result['summary']['rows_flagged'].sum() == 0
+        assert result['flagged'].empty